@@ -0,0 +1,254 @@
+# Agregados de servicio precalculados a partir del GTFS
+# Se alimenta con los mismos lotes que se cargan a BigQuery (un solo recorrido de
+# stop_times) y guarda solo columnas enteras compactas. Al final produce:
+#   agg_rutas: viajes, primera/última salida, headway y tiempo de viaje por ruta, sentido y servicio
+#   agg_paradas: viajes, rutas y primera/última pasada por parada y servicio
+# Los horarios GTFS (HH:MM:SS, pueden pasar de 24h) se convierten a segundos con NumPy.
+from datetime import datetime, timedelta
+import numpy as np
+from google.cloud import bigquery
+from registro_esquemas import DisenoTabla
+
+# Tablas del GTFS que el agregador necesita leer
+TABLAS_OBSERVADAS = ('calendar', 'calendar_dates', 'frequencies', 'stop_times', 'trips')
+
+schemas_agregados = {
+    'agg_rutas': [
+        bigquery.SchemaField('route_id', 'STRING'),
+        bigquery.SchemaField('direction_id', 'INTEGER'),
+        bigquery.SchemaField('service_id', 'STRING'),
+        bigquery.SchemaField('viajes', 'INTEGER'),
+        bigquery.SchemaField('primera_salida_s', 'INTEGER'),
+        bigquery.SchemaField('ultima_salida_s', 'INTEGER'),
+        bigquery.SchemaField('primera_salida', 'STRING'),
+        bigquery.SchemaField('ultima_salida', 'STRING'),
+        bigquery.SchemaField('headway_promedio_s', 'FLOAT'),
+        bigquery.SchemaField('tiempo_viaje_promedio_s', 'FLOAT'),
+        bigquery.SchemaField('tiempo_viaje_max_s', 'INTEGER'),
+        bigquery.SchemaField('dias_servicio', 'INTEGER'),
+        bigquery.SchemaField('created_at', 'TIMESTAMP'),
+        bigquery.SchemaField('periodo_de_carga', 'STRING'),
+        bigquery.SchemaField('fecha_carga', 'DATE')
+    ],
+    'agg_paradas': [
+        bigquery.SchemaField('stop_id', 'STRING'),
+        bigquery.SchemaField('service_id', 'STRING'),
+        bigquery.SchemaField('viajes', 'INTEGER'),
+        bigquery.SchemaField('rutas', 'INTEGER'),
+        bigquery.SchemaField('primera_pasada_s', 'INTEGER'),
+        bigquery.SchemaField('ultima_pasada_s', 'INTEGER'),
+        bigquery.SchemaField('primera_pasada', 'STRING'),
+        bigquery.SchemaField('ultima_pasada', 'STRING'),
+        bigquery.SchemaField('created_at', 'TIMESTAMP'),
+        bigquery.SchemaField('periodo_de_carga', 'STRING'),
+        bigquery.SchemaField('fecha_carga', 'DATE')
+    ]
+}
+
+# Los agregados se recalculan completos en cada corrida: las particiones viejas se pueden borrar
+EXPIRACION_AGREGADOS_DIAS = 365
+disenos_agregados = {
+    'agg_rutas': DisenoTabla(clustering=['route_id', 'service_id'], expiracion_dias=EXPIRACION_AGREGADOS_DIAS),
+    'agg_paradas': DisenoTabla(clustering=['stop_id', 'service_id'], expiracion_dias=EXPIRACION_AGREGADOS_DIAS),
+}
+
+def tiempos_a_segundos(tiempos):
+    # 'H:MM:SS', 'HH:MM:SS' o 'HHH:MM:SS' (los espacios alrededor se ignoran) -> segundos
+    # desde el inicio del día de servicio; vacíos o mal formados -> -1.
+    # Se quitan los espacios antes de fijar el ancho y se alinea a la derecha con ceros:
+    # los ':' quedan en las posiciones -3 y -6 y todo lo anterior son las horas
+    texto = np.char.strip(np.asarray(tiempos, dtype=str).reshape(-1))
+    ancho = texto.dtype.itemsize // 4
+    if not texto.size or ancho < 7:
+        return np.full(texto.size, -1, dtype=np.int64)
+    digitos = np.char.rjust(texto, ancho, '0').view(np.uint32).reshape(-1, ancho).astype(np.int64) - ord('0')
+    separadores = digitos == ord(':') - ord('0')
+    numeros = np.delete(digitos, [ancho - 6, ancho - 3], axis=1)
+    validos = (separadores[:, -6] & separadores[:, -3] & (separadores.sum(axis=1) == 2)
+               & ((numeros >= 0) & (numeros <= 9)).all(axis=1))
+    pesos = 10 ** np.arange(ancho - 7, -1, -1, dtype=np.int64)
+    horas = np.where(validos[:, None], numeros[:, :ancho - 6], 0) @ pesos
+    segundos = horas * 3600 + (digitos[:, -5] * 10 + digitos[:, -4]) * 60 + digitos[:, -2] * 10 + digitos[:, -1]
+    return np.where(validos, segundos, -1)
+
+def segundos_a_texto(segundos):
+    segundos = int(segundos)
+    return f'{segundos // 3600:02d}:{segundos % 3600 // 60:02d}:{segundos % 60:02d}'
+
+def _indices(valores, mapa):
+    # Asigna un entero estable a cada texto (trip_id, stop_id) a medida que aparece
+    return np.fromiter((mapa.setdefault(v, len(mapa)) for v in valores), dtype=np.int64, count=len(valores))
+
+class AgregadorGtfs:
+    def __init__(self):
+        self.trip_ids = {}
+        self.stop_ids = {}
+        self.trips = {}  # trip_id -> (route_id, service_id, direction_id)
+        self.frecuencias = []  # (trip_id, inicio_s, fin_s, headway_s)
+        self.calendario = []
+        self.excepciones = []
+        self.bloques = []  # (trip, stop, salida_s) por lote de stop_times
+
+    def observar(self, table_id, lote):
+        if table_id == 'stop_times':
+            salidas = tiempos_a_segundos([r.get('departure_time') or r.get('arrival_time') or '' for r in lote])
+            trips = _indices([r.get('trip_id') for r in lote], self.trip_ids)
+            stops = _indices([r.get('stop_id') for r in lote], self.stop_ids)
+            validos = salidas >= 0
+            self.bloques.append((trips[validos].astype(np.int32), stops[validos].astype(np.int32),
+                                 salidas[validos].astype(np.int32)))
+        elif table_id == 'trips':
+            for r in lote:
+                self.trips[r.get('trip_id')] = (r.get('route_id'), r.get('service_id'), r.get('direction_id'))
+        elif table_id == 'frequencies':
+            inicios = tiempos_a_segundos([r.get('start_time') or '' for r in lote])
+            fines = tiempos_a_segundos([r.get('end_time') or '' for r in lote])
+            for r, inicio, fin in zip(lote, inicios, fines):
+                if inicio >= 0 and fin > inicio and r.get('headway_secs'):
+                    self.frecuencias.append((r['trip_id'], int(inicio), int(fin), int(r['headway_secs'])))
+        elif table_id == 'calendar':
+            self.calendario.extend(lote)
+        elif table_id == 'calendar_dates':
+            self.excepciones.extend(lote)
+
+    def _dias_servicio(self):
+        # Días en que corre cada service_id según calendar y calendar_dates
+        dias_semana = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+        fechas = {}
+        for c in self.calendario:
+            try:
+                inicio = datetime.strptime(c['start_date'], '%Y%m%d').date()
+                fin = datetime.strptime(c['end_date'], '%Y%m%d').date()
+            except (KeyError, TypeError, ValueError):
+                continue
+            activos = {i for i, dia in enumerate(dias_semana) if c.get(dia) == 1}
+            dias = set()
+            dia = inicio
+            while dia <= fin:
+                if dia.weekday() in activos:
+                    dias.add(dia)
+                dia += timedelta(days=1)
+            fechas[c['service_id']] = dias
+        for e in self.excepciones:
+            try:
+                dia = datetime.strptime(e['date'], '%Y%m%d').date()
+            except (KeyError, TypeError, ValueError):
+                continue
+            dias = fechas.setdefault(e['service_id'], set())
+            if e.get('exception_type') == 1:
+                dias.add(dia)
+            elif e.get('exception_type') == 2:
+                dias.discard(dia)
+        return {service_id: len(dias) for service_id, dias in fechas.items()}
+
+    def calcular(self, extras=None):
+        if not self.bloques:
+            return {'agg_rutas': [], 'agg_paradas': []}
+        trip = np.concatenate([b[0] for b in self.bloques])
+        stop = np.concatenate([b[1] for b in self.bloques])
+        salida = np.concatenate([b[2] for b in self.bloques]).astype(np.int64)
+        self.bloques = []
+        n_trips = len(self.trip_ids)
+
+        # Primera y última salida de cada viaje plantilla
+        primera = np.full(n_trips, np.iinfo(np.int64).max)
+        ultima = np.full(n_trips, -1, dtype=np.int64)
+        np.minimum.at(primera, trip, salida)
+        np.maximum.at(ultima, trip, salida)
+        duracion = np.where(ultima >= 0, ultima - primera, 0)
+
+        # Viajes con frequencies: cada ventana [inicio, fin) genera ceil((fin - inicio) / headway) salidas
+        corridas = np.ones(n_trips, dtype=np.int64)
+        inicio_corridas = primera.copy()
+        fin_corridas = primera.copy()
+        con_frecuencia = np.zeros(n_trips, dtype=bool)
+        for trip_id, inicio, fin, headway in self.frecuencias:
+            i = self.trip_ids.get(trip_id)
+            if i is None:
+                continue
+            n = -(-(fin - inicio) // headway)
+            if not con_frecuencia[i]:
+                con_frecuencia[i] = True
+                corridas[i] = 0
+                inicio_corridas[i] = inicio
+                fin_corridas[i] = inicio
+            corridas[i] += n
+            inicio_corridas[i] = min(inicio_corridas[i], inicio)
+            fin_corridas[i] = max(fin_corridas[i], inicio + (n - 1) * headway)
+
+        # Atributos de cada viaje desde trips.txt
+        nombres_trip = np.empty(n_trips, dtype=object)
+        for trip_id, i in self.trip_ids.items():
+            nombres_trip[i] = trip_id
+        atributos = [self.trips.get(t, (None, None, None)) for t in nombres_trip]
+        rutas = np.array([a[0] or '' for a in atributos], dtype=object)
+        servicios = np.array([a[1] or '' for a in atributos], dtype=object)
+        sentidos = np.array([-1 if a[2] is None else a[2] for a in atributos], dtype=np.int64)
+        dias = self._dias_servicio()
+        extras = extras or {}
+
+        # agg_rutas: agrupación por (ruta, sentido, servicio)
+        claves_ruta = np.array([f'{r}\x1f{d}\x1f{s}' for r, d, s in zip(rutas, sentidos, servicios)], dtype=object)
+        grupos, inverso = np.unique(claves_ruta.astype(str), return_inverse=True)
+        viajes = np.bincount(inverso, weights=corridas).astype(np.int64)
+        tiempo_total = np.bincount(inverso, weights=duracion * corridas)
+        primera_ruta = np.full(len(grupos), np.iinfo(np.int64).max)
+        ultima_ruta = np.full(len(grupos), -1, dtype=np.int64)
+        maximo_viaje = np.zeros(len(grupos), dtype=np.int64)
+        np.minimum.at(primera_ruta, inverso, inicio_corridas)
+        np.maximum.at(ultima_ruta, inverso, fin_corridas)
+        np.maximum.at(maximo_viaje, inverso, duracion)
+        agg_rutas = []
+        for g, clave in enumerate(grupos):
+            route_id, direction_id, service_id = clave.split('\x1f')
+            if not route_id or viajes[g] == 0:
+                continue
+            headway = (ultima_ruta[g] - primera_ruta[g]) / (viajes[g] - 1) if viajes[g] > 1 else None
+            agg_rutas.append({
+                'route_id': route_id,
+                'direction_id': None if direction_id == '-1' else int(direction_id),
+                'service_id': service_id,
+                'viajes': int(viajes[g]),
+                'primera_salida_s': int(primera_ruta[g]),
+                'ultima_salida_s': int(ultima_ruta[g]),
+                'primera_salida': segundos_a_texto(primera_ruta[g]),
+                'ultima_salida': segundos_a_texto(ultima_ruta[g]),
+                'headway_promedio_s': None if headway is None else round(float(headway), 1),
+                'tiempo_viaje_promedio_s': round(float(tiempo_total[g] / viajes[g]), 1),
+                'tiempo_viaje_max_s': int(maximo_viaje[g]),
+                'dias_servicio': dias.get(service_id),
+                **extras
+            })
+
+        # agg_paradas: agrupación por (parada, servicio) sobre cada stop_time
+        nombres_servicio, servicio_idx = np.unique(servicios.astype(str), return_inverse=True)
+        n_servicios = len(nombres_servicio)
+        clave = stop.astype(np.int64) * n_servicios + servicio_idx[trip]
+        grupos_parada, inverso = np.unique(clave, return_inverse=True)
+        viajes_parada = np.bincount(inverso, weights=corridas[trip]).astype(np.int64)
+        desfase = salida - primera[trip]
+        primera_pasada = np.full(len(grupos_parada), np.iinfo(np.int64).max)
+        ultima_pasada = np.full(len(grupos_parada), -1, dtype=np.int64)
+        np.minimum.at(primera_pasada, inverso, inicio_corridas[trip] + desfase)
+        np.maximum.at(ultima_pasada, inverso, fin_corridas[trip] + desfase)
+        # Rutas distintas por parada y servicio
+        ruta_idx = np.unique(rutas.astype(str), return_inverse=True)[1]
+        pares = np.unique(np.column_stack((inverso, ruta_idx[trip])), axis=0)
+        rutas_parada = np.bincount(pares[:, 0], minlength=len(grupos_parada))
+        nombres_stop = np.empty(len(self.stop_ids), dtype=object)
+        for stop_id, i in self.stop_ids.items():
+            nombres_stop[i] = stop_id
+        agg_paradas = []
+        for g, clave_parada in enumerate(grupos_parada):
+            agg_paradas.append({
+                'stop_id': nombres_stop[clave_parada // n_servicios],
+                'service_id': str(nombres_servicio[clave_parada % n_servicios]),
+                'viajes': int(viajes_parada[g]),
+                'rutas': int(rutas_parada[g]),
+                'primera_pasada_s': int(primera_pasada[g]),
+                'ultima_pasada_s': int(ultima_pasada[g]),
+                'primera_pasada': segundos_a_texto(primera_pasada[g]),
+                'ultima_pasada': segundos_a_texto(ultima_pasada[g]),
+                **extras
+            })
+        return {'agg_rutas': agg_rutas, 'agg_paradas': agg_paradas}
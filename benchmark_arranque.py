@@ -0,0 +1,92 @@
+# Benchmark de arranque de las funciones
+#   1. Import en frío de cada módulo de entrada (un proceso nuevo por medición) y
+#      qué librerías pesadas quedan cargadas solo por importarlo.
+#   2. Creación de los clientes de recursos.py: primera invocación (fría) contra
+#      las siguientes (en caliente, desde el caché). Sin credenciales de GCP se usan
+#      credenciales anónimas, que no hacen llamadas de red al construir el cliente.
+#
+#   python benchmark_arranque.py [--repeticiones 5]
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from unittest import mock
+
+MODULOS_ENTRADA = [
+    'fn_obtener_datos_diarios_in',
+    'fn_obtener_datos_diarios_in_realtime',
+    'fn_consumir_datos_diarios_realtime',
+    'fn_obtener_datos_diarios_tranf',
+    'fn_obtener_datos_historicos_in',
+    'fn_obtener_datos_historicos_tranf',
+    'fn_emparejar_paraderos',
+]
+LIBRERIAS_PESADAS = ['google.cloud.storage', 'google.cloud.bigquery', 'google.cloud.pubsub_v1',
+                     'grpc', 'numpy', 'pyarrow', 'requests']
+
+_SCRIPT_IMPORT = '''
+import json, sys, time
+inicio = time.perf_counter()
+import {modulo}
+duracion = time.perf_counter() - inicio
+print(json.dumps({{'s': duracion, 'cargadas': [m for m in {pesadas!r} if m in sys.modules]}}))
+'''
+
+def medir_import(modulo, repeticiones):
+    tiempos, cargadas = [], []
+    for _ in range(repeticiones):
+        salida = subprocess.run(
+            [sys.executable, '-c', _SCRIPT_IMPORT.format(modulo=modulo, pesadas=LIBRERIAS_PESADAS)],
+            capture_output=True, text=True, check=True)
+        resultado = json.loads(salida.stdout.strip().splitlines()[-1])
+        tiempos.append(resultado['s'])
+        cargadas = resultado['cargadas']
+    return {'import_mediana_ms': round(statistics.median(tiempos) * 1000, 1), 'librerias_cargadas': cargadas}
+
+def medir_clientes(repeticiones):
+    import google.auth
+    import recursos
+    fabricas = {
+        'storage': recursos.storage_client,
+        'bigquery': recursos.bigquery_client,
+        'publisher': lambda: recursos.publisher_client(100, 5 * 1024 * 1024, 0.05, False),
+        'subscriber': recursos.subscriber_client,
+        'sesion_http': recursos.sesion_http,
+    }
+    try:
+        google.auth.default()
+        parche = mock.patch.object(google.auth, 'default', google.auth.default)
+    except google.auth.exceptions.DefaultCredentialsError:
+        from google.auth.credentials import AnonymousCredentials
+        parche = mock.patch.object(google.auth, 'default', lambda *a, **k: (AnonymousCredentials(), 'local'))
+    resultados = {}
+    with parche:
+        for nombre, fabrica in fabricas.items():
+            recursos.limpiar()
+            inicio = time.perf_counter()
+            fabrica()
+            frio = time.perf_counter() - inicio
+            calientes = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                fabrica()
+                calientes.append(time.perf_counter() - inicio)
+            resultados[nombre] = {'frio_ms': round(frio * 1000, 2),
+                                  'caliente_ms': round(statistics.median(calientes) * 1000, 4)}
+    recursos.limpiar()
+    return resultados
+
+def main():
+    parser = argparse.ArgumentParser(description='Mide el costo de arranque de las funciones')
+    parser.add_argument('--repeticiones', type=int, default=5)
+    args = parser.parse_args()
+    resumen = {
+        'imports': {modulo: medir_import(modulo, args.repeticiones) for modulo in MODULOS_ENTRADA},
+        'clientes': medir_clientes(args.repeticiones),
+    }
+    print(json.dumps(resumen, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+# Benchmark de las funciones contra entorno_local (sin servicios de GCP)
+# Ejecuta en orden las funciones de las dos cadenas y el par publicador/consumidor de
+# Pub/Sub sobre datos sintéticos, y mide por función: tiempo, throughput, llamadas a
+# cada servicio local y memoria máxima (RSS). El resultado se compara con la línea base
+# de linea_base_benchmark.json; si hay regresiones el proceso termina con código 1.
+#
+#   python benchmark_funciones.py                              (escenario pequeno)
+#   python benchmark_funciones.py --escenario completo         (~1,8 millones de stop_times)
+#   python benchmark_funciones.py --escenario realista --guardar-linea-base
+import argparse
+import importlib
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+
+RUTA_LINEA_BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'linea_base_benchmark.json')
+
+# Las latencias son segundos por llamada a cada servicio local
+ESCENARIOS = {
+    'pequeno': {'recorridos': 50, 'rutas_gtfs': 20, 'viajes_gtfs': 2000},
+    'realista': {'recorridos': 300, 'realista': True, 'rutas_gtfs': 200, 'viajes_gtfs': 20000,
+                 'paradas_gtfs': 11000, 'tasa_error_red': 0.02,
+                 'latencias': {'red': 0.03, 'gcs': 0.005, 'bigquery': 0.2, 'pubsub': 0.002}},
+    'completo': {'recorridos': 400, 'realista': True, 'rutas_gtfs': 400, 'viajes_gtfs': 60000,
+                 'paradas_gtfs': 11000, 'tasa_error_red': 0.02,
+                 'latencias': {'red': 0.03, 'gcs': 0.005, 'bigquery': 0.2, 'pubsub': 0.002}},
+}
+
+# (nombre, módulo, entry point, unidad del throughput, parámetros del request).
+# El límite de peticiones por segundo se desactiva para medir el código y no el limitador.
+FUNCIONES = [
+    ('get_daily_data', 'fn_obtener_datos_diarios_in', 'get_daily_data', 'recorridos',
+     {'peticiones_por_segundo': 0}),
+    ('process_json_to_bigquery', 'fn_obtener_datos_diarios_tranf', 'process_json_to_bigquery', 'filas', {}),
+    ('download_and_extract_zip', 'fn_obtener_datos_historicos_in', 'download_and_extract_zip', 'MB', {}),
+    ('process_historical_data', 'fn_obtener_datos_historicos_tranf', 'process_historical_data', 'filas', {}),
+    ('get_daily_data_realtime', 'fn_obtener_datos_diarios_in_realtime', 'get_daily_data', 'recorridos',
+     {'peticiones_por_segundo': 0, 'comprimir': True}),
+    ('consume_daily_data', 'fn_consumir_datos_diarios_realtime', 'consume_daily_data', 'filas',
+     {'ventana_lote': 1.0, 'max_pulls_vacios': 1}),
+]
+
+# Margen aceptado sobre la línea base antes de considerar una regresión
+TOLERANCIA_TIEMPO = 0.25
+MARGEN_TIEMPO_S = 0.05  # Bajo este tiempo absoluto las diferencias son ruido
+TOLERANCIA_RSS = 0.15
+TOLERANCIA_LLAMADAS = 0.05
+
+def reiniciar_pico_rss():
+    # En Linux escribir 5 en clear_refs reinicia VmHWM; si no se puede, el pico es del proceso
+    try:
+        with open('/proc/self/clear_refs', 'w') as archivo:
+            archivo.write('5')
+        return True
+    except OSError:
+        return False
+
+def pico_rss_mb():
+    try:
+        with open('/proc/self/status') as archivo:
+            for linea in archivo:
+                if linea.startswith('VmHWM:'):
+                    return int(linea.split()[1]) / 1024
+    except OSError:
+        pass
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maximo / (1024 * 1024) if sys.platform == 'darwin' else maximo / 1024
+
+def contar_llamadas():
+    from entorno_local import SERVICIOS_LOCALES
+    nombres = {'StorageLocal': 'gcs', 'BigQueryLocal': 'bigquery', 'PubSubLocal': 'pubsub', 'SesionRedLocal': 'red'}
+    return {f'{nombres[servicio.__name__]}.{llamada}': n
+            for servicio in SERVICIOS_LOCALES for llamada, n in servicio.llamadas.items()}
+
+def contar_unidades():
+    from entorno_local import StorageLocal, BigQueryLocal
+    return {
+        'filas': sum(len(tabla['filas']) for tabla in BigQueryLocal.tablas.values()),
+        'MB': sum(len(objeto[0]) for objetos in StorageLocal.buckets.values()
+                  for objeto in objetos.values()) / 1e6,
+    }
+
+def ejecutar_escenario(escenario):
+    from entorno_local import entorno_local
+    from runner_dag import SolicitudLocal
+    entry_points = {nombre: getattr(importlib.import_module(modulo), funcion)
+                    for nombre, modulo, funcion, _, _ in FUNCIONES}
+    resultados = {}
+    with entorno_local(**ESCENARIOS[escenario]):
+        for nombre, _, _, unidad, parametros in FUNCIONES:
+            llamadas_antes, unidades_antes = contar_llamadas(), contar_unidades()
+            pico_por_funcion = reiniciar_pico_rss()
+            inicio = time.perf_counter()
+            respuesta = entry_points[nombre](SolicitudLocal(parametros))
+            duracion = time.perf_counter() - inicio
+            llamadas = {clave: n - llamadas_antes.get(clave, 0) for clave, n in contar_llamadas().items()
+                        if n - llamadas_antes.get(clave, 0)}
+            if unidad == 'recorridos':
+                unidades = ESCENARIOS[escenario]['recorridos']
+            else:
+                unidades = contar_unidades()[unidad] - unidades_antes[unidad]
+            resultados[nombre] = {
+                'respuesta': respuesta,
+                'tiempo_s': round(duracion, 3),
+                'unidad': unidad,
+                'unidades': round(unidades, 3),
+                'throughput': round(unidades / duracion, 1) if duracion else None,
+                'rss_mb': round(pico_rss_mb(), 1),
+                'rss_por_funcion': pico_por_funcion,
+                'llamadas': dict(sorted(llamadas.items())),
+            }
+            print(f'{nombre}: {duracion:.2f} s, {unidades:.0f} {unidad} -> {respuesta}')
+    return resultados
+
+def combinar(repeticiones):
+    # Mediana de tiempo y memoria entre repeticiones; las llamadas son las de la última
+    combinado = {}
+    for nombre in repeticiones[-1]:
+        medidas = [repeticion[nombre] for repeticion in repeticiones]
+        tiempo = statistics.median(m['tiempo_s'] for m in medidas)
+        combinado[nombre] = {
+            **medidas[-1],
+            'tiempo_s': round(tiempo, 3),
+            'throughput': round(medidas[-1]['unidades'] / tiempo, 1) if tiempo else None,
+            'rss_mb': round(statistics.median(m['rss_mb'] for m in medidas), 1),
+        }
+    return combinado
+
+def comparar(actual, base):
+    regresiones = []
+    for nombre, medida in actual.items():
+        if medida['respuesta'].startswith('Error'):
+            regresiones.append(f'{nombre}: {medida["respuesta"]}')
+        anterior = base.get(nombre)
+        if not anterior:
+            continue
+        if (medida['tiempo_s'] > anterior['tiempo_s'] * (1 + TOLERANCIA_TIEMPO)
+                and medida['tiempo_s'] - anterior['tiempo_s'] > MARGEN_TIEMPO_S):
+            regresiones.append(f'{nombre}: tiempo {anterior["tiempo_s"]} s -> {medida["tiempo_s"]} s')
+        if medida['rss_por_funcion'] and medida['rss_mb'] > anterior['rss_mb'] * (1 + TOLERANCIA_RSS):
+            regresiones.append(f'{nombre}: RSS {anterior["rss_mb"]} MB -> {medida["rss_mb"]} MB')
+        for clave, n in medida['llamadas'].items():
+            previas = anterior['llamadas'].get(clave, 0)
+            if n > previas * (1 + TOLERANCIA_LLAMADAS) and n - previas > 1:
+                regresiones.append(f'{nombre}: llamadas {clave} {previas} -> {n}')
+    return regresiones
+
+def main():
+    parser = argparse.ArgumentParser(description='Mide las funciones contra entorno_local')
+    parser.add_argument('--escenario', choices=sorted(ESCENARIOS), default='pequeno')
+    parser.add_argument('--repeticiones', type=int, default=1)
+    parser.add_argument('--linea-base', default=RUTA_LINEA_BASE)
+    parser.add_argument('--guardar-linea-base', action='store_true',
+                        help='reemplaza la línea base del escenario con esta medición')
+    args = parser.parse_args()
+
+    resultados = combinar([ejecutar_escenario(args.escenario) for _ in range(max(1, args.repeticiones))])
+    lineas_base = {}
+    if os.path.exists(args.linea_base):
+        with open(args.linea_base) as archivo:
+            lineas_base = json.load(archivo)
+    regresiones = comparar(resultados, lineas_base.get(args.escenario, {}).get('funciones', {}))
+
+    print(json.dumps({'escenario': args.escenario, 'funciones': resultados, 'regresiones': regresiones},
+                     indent=2, ensure_ascii=False))
+    if args.guardar_linea_base:
+        lineas_base[args.escenario] = {
+            'python': platform.python_version(),
+            'maquina': f'{platform.system()} {platform.machine()}, {os.cpu_count()} CPU',
+            'funciones': resultados,
+        }
+        with open(args.linea_base, 'w') as archivo:
+            json.dump(lineas_base, archivo, indent=2, ensure_ascii=False)
+            archivo.write('\n')
+        print(f'Línea base del escenario {args.escenario} guardada en {args.linea_base}')
+    elif regresiones:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
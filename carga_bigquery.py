@@ -0,0 +1,104 @@
+# Carga a BigQuery acumulando filas por tabla
+# Las filas se serializan a NDJSON en memoria y se envían en un solo load job
+# por tabla (sin costo ni cuota de streaming). Para corridas pequeñas se puede
+# seguir usando insert_rows_json; el modo se decide una sola vez por corrida.
+import io
+import json
+from google.cloud import bigquery
+from instrumentacion import contar, span
+
+MODO_CARGA = 'auto'  # auto | load | streaming
+UMBRAL_STREAMING = 500  # En modo auto, si la corrida completa tiene menos filas se usa streaming
+LOTE_STREAMING = 500  # Filas por llamada a insert_rows_json
+
+def insertar_streaming(client, dataset_id, table_id, rows):
+    table_ref = client.dataset(dataset_id).table(table_id)
+    for i in range(0, len(rows), LOTE_STREAMING):
+        contar('bigquery.llamadas')
+        errors = client.insert_rows_json(table_ref, rows[i:i + LOTE_STREAMING])
+        if errors != []:
+            raise RuntimeError(f'Errores al insertar filas en la tabla {table_id}: {errors}')
+
+def cargar_ndjson(client, dataset_id, table_id, schema, archivo, reemplazar=False):
+    # reemplazar=true usa WRITE_TRUNCATE: el job deja en la tabla solo estas filas y su esquema
+    table_ref = client.dataset(dataset_id).table(table_id)
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        schema=schema,
+        write_disposition=(bigquery.WriteDisposition.WRITE_TRUNCATE if reemplazar
+                           else bigquery.WriteDisposition.WRITE_APPEND)
+    )
+    if not reemplazar:
+        # Permite columnas nuevas del esquema declarado en tablas ya existentes; BigQuery
+        # solo acepta schema_update_options con WRITE_APPEND
+        job_config.schema_update_options = [bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION]
+    contar('bigquery.llamadas')
+    contar('bigquery.bytes', archivo.getbuffer().nbytes if hasattr(archivo, 'getbuffer') else 0)
+    job = client.load_table_from_file(archivo, table_ref, job_config=job_config, rewind=True)
+    job.result()  # Lanza una excepción si el job falla
+    if job.errors:
+        raise RuntimeError(f'El load job {job.job_id} de la tabla {table_id} terminó con errores: {job.errors}')
+    return job.output_rows
+
+class CargaPorLotes:
+    def __init__(self, client, dataset_id, schemas, modo=MODO_CARGA,
+                 umbral_streaming=UMBRAL_STREAMING, max_filas=None, reemplazar=(), filas_esperadas=None):
+        self.client = client
+        self.dataset_id = dataset_id
+        self.schemas = schemas
+        self.modo = modo
+        # El modo auto se resuelve aquí, con el total de filas que el llamador espera
+        # para toda la corrida: decidirlo en cada envío mandaría por streaming las tablas
+        # pequeñas y las colas de cada lote, y esas filas quedan en el buffer de streaming
+        # fuera del alcance de DML. Sin total esperado se usan load jobs.
+        self.streaming = modo == 'streaming' or (
+            modo == 'auto' and filas_esperadas is not None and filas_esperadas < umbral_streaming)
+        self.max_filas = max_filas  # Si se define, se envía un job cada `max_filas` filas
+        # Tablas cuyo primer envío reemplaza el contenido (siempre por load job)
+        self.reemplazar = set(reemplazar)
+        self.buffers = {}
+        self.filas = {}
+        self.cargadas = {table_id: 0 for table_id in schemas}
+
+    def agregar(self, table_id, rows):
+        if not rows:
+            return
+        buffer = self.buffers.setdefault(table_id, io.BytesIO())
+        for row in rows:
+            buffer.write(json.dumps(row).encode('utf-8'))
+            buffer.write(b'\n')
+        self.filas[table_id] = self.filas.get(table_id, 0) + len(rows)
+        if self.max_filas and self.filas[table_id] >= self.max_filas:
+            self.enviar(table_id)
+
+    def enviar(self, table_id):
+        filas = self.filas.pop(table_id, 0)
+        buffer = self.buffers.pop(table_id, None)
+        if not filas:
+            return 0
+        with span('bigquery.carga', table_id):
+            if table_id in self.reemplazar:
+                self.reemplazar.discard(table_id)
+                filas = cargar_ndjson(self.client, self.dataset_id, table_id, self.schemas[table_id], buffer,
+                                      reemplazar=True)
+                print(f'{filas} filas cargadas con load job en la tabla {table_id} (reemplazo)')
+            elif self.streaming:
+                rows = [json.loads(linea) for linea in buffer.getvalue().splitlines()]
+                insertar_streaming(self.client, self.dataset_id, table_id, rows)
+                print(f'{filas} filas insertadas por streaming en la tabla {table_id}')
+            else:
+                filas = cargar_ndjson(self.client, self.dataset_id, table_id, self.schemas[table_id], buffer)
+                print(f'{filas} filas cargadas con load job en la tabla {table_id}')
+        contar('bigquery.filas', filas)
+        self.cargadas[table_id] = self.cargadas.get(table_id, 0) + filas
+        return filas
+
+    def cerrar(self):
+        for table_id in list(self.buffers):
+            self.enviar(table_id)
+        return self.cargadas
+
+    def descartar(self):
+        # Olvida las filas aún no enviadas (p. ej. tras un error, antes de reintentar)
+        self.buffers.clear()
+        self.filas.clear()
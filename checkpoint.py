@@ -0,0 +1,70 @@
+# Punto de control de una corrida, guardado como JSON en el bucket por fecha
+# Registra las claves ya terminadas (codsint, recorrido, tabla) y un estado libre
+# (por ejemplo filas ya cargadas de una tabla). Si la función se corta por timeout,
+# la siguiente invocación del mismo día retoma desde lo último que se guardó.
+# Un adjunto guarda, junto al JSON y en cada guardar(), datos binarios de la corrida
+# que hay que recuperar al retomar (por ejemplo las claves ya vistas de un índice).
+import json
+import threading
+from datetime import datetime
+
+CADA_RECORRIDOS = 200  # Recorridos entre dos guardados del punto de control
+
+def ruta_checkpoint(prefijo, fecha, proceso):
+    return f'{prefijo}/_checkpoints/{fecha}-{proceso}.json'
+
+def ruta_adjunto(ruta, nombre):
+    return f'{ruta.rsplit(".", 1)[0]}-{nombre}.bin'
+
+class Checkpoint:
+    def __init__(self, bucket, ruta, reiniciar=False):
+        self.bucket = bucket
+        self.ruta = ruta
+        self.blob = bucket.blob(ruta)
+        self.lock = threading.Lock()
+        self.hechos = set()
+        self.estado = {}
+        self.adjuntos = {}
+        self.retomado = False
+        if self.blob.exists():
+            if reiniciar:
+                self.blob.delete()
+            else:
+                contenido = json.loads(self.blob.download_as_text())
+                self.hechos = set(contenido.get('hechos', []))
+                self.estado = contenido.get('estado', {})
+                self.retomado = True
+                print(f'Retomando desde {ruta}: {len(self.hechos)} elementos ya procesados')
+
+    def hecho(self, clave):
+        with self.lock:
+            return str(clave) in self.hechos
+
+    def pendientes(self, claves):
+        with self.lock:
+            return [clave for clave in claves if str(clave) not in self.hechos]
+
+    def marcar(self, claves):
+        with self.lock:
+            self.hechos.update(str(clave) for clave in claves)
+
+    def adjuntar(self, nombre, serializar):
+        # serializar() -> bytes que se suben en cada guardar(), antes del JSON. Devuelve lo
+        # guardado por la invocación que se retoma, o None si la corrida parte de cero
+        blob = self.bucket.blob(ruta_adjunto(self.ruta, nombre))
+        self.adjuntos[nombre] = (blob, serializar)
+        if not self.retomado or not blob.exists():
+            return None
+        return blob.download_as_bytes()
+
+    def guardar(self):
+        # Los adjuntos se suben primero: el JSON nunca marca elementos cuyos datos faltan
+        for blob, serializar in self.adjuntos.values():
+            blob.upload_from_string(serializar(), content_type='application/octet-stream')
+        with self.lock:
+            contenido = json.dumps({
+                'actualizado': datetime.now().isoformat(),
+                'hechos': sorted(self.hechos),
+                'estado': self.estado
+            })
+        self.blob.upload_from_string(contenido, content_type='application/json')
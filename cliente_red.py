@@ -0,0 +1,169 @@
+# Cliente HTTP compartido para la API de red.cl
+# Lo usan fn_obtener_datos_diarios_in y fn_obtener_datos_diarios_in_realtime
+import random
+import threading
+import time
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from parametros import get_parametro
+from recursos import sesion_http
+from instrumentacion import contar, observar
+
+URL_SERVICIOS = 'https://www.red.cl/restservice_v2/rest/getservicios/all'
+URL_RECORRIDO = 'https://www.red.cl/restservice_v2/rest/conocerecorrido?codsint={codsint}'
+
+# Valores por defecto (se pueden cambiar por parámetro en cada función)
+CONCURRENCIA_POR_DEFECTO = 16
+PETICIONES_POR_SEGUNDO = 10.0  # Límite por host para no saturar red.cl
+REINTENTOS = 4
+BACKOFF_BASE = 0.5  # Segundos
+BACKOFF_MAXIMO = 20.0
+TIMEOUT = (5, 30)  # (conexión, lectura) en segundos
+UMBRAL_CIRCUITO = 10  # Fallos consecutivos antes de abrir el circuito
+ENFRIAMIENTO_CIRCUITO = 30.0  # Segundos con el circuito abierto
+
+# Códigos que vale la pena reintentar; el resto de los 4xx falla de inmediato
+CODIGOS_REINTENTABLES = {429, 500, 502, 503, 504}
+
+class CircuitoAbierto(requests.exceptions.RequestException):
+    pass
+
+class LimitadorPorHost:
+    # Reparte turnos separados por un intervalo mínimo para cada host
+    def __init__(self, peticiones_por_segundo):
+        self.intervalo = 1.0 / peticiones_por_segundo if peticiones_por_segundo > 0 else 0
+        self.lock = threading.Lock()
+        self.proximo_turno = {}
+
+    def esperar(self, url):
+        if not self.intervalo:
+            return
+        host = urlparse(url).netloc
+        with self.lock:
+            ahora = time.monotonic()
+            turno = max(ahora, self.proximo_turno.get(host, ahora))
+            self.proximo_turno[host] = turno + self.intervalo
+        if turno > ahora:
+            time.sleep(turno - ahora)
+
+class Circuito:
+    # Cortocircuito simple: cerrado -> abierto tras `umbral` fallos seguidos;
+    # pasado el enfriamiento deja pasar una petición de prueba (semiabierto)
+    def __init__(self, umbral=UMBRAL_CIRCUITO, enfriamiento=ENFRIAMIENTO_CIRCUITO):
+        self.umbral = umbral
+        self.enfriamiento = enfriamiento
+        self.lock = threading.Lock()
+        self.fallos = 0
+        self.abierto_desde = None
+        self.prueba_en_curso = False
+
+    def permitir(self):
+        with self.lock:
+            if self.abierto_desde is None:
+                return True
+            if time.monotonic() - self.abierto_desde < self.enfriamiento or self.prueba_en_curso:
+                return False
+            self.prueba_en_curso = True
+            return True
+
+    def registrar_exito(self):
+        with self.lock:
+            self.fallos = 0
+            self.abierto_desde = None
+            self.prueba_en_curso = False
+
+    def registrar_fallo(self):
+        with self.lock:
+            self.fallos += 1
+            self.prueba_en_curso = False
+            if self.abierto_desde is not None or self.fallos >= self.umbral:
+                if self.abierto_desde is None:
+                    print(f'Circuito abierto tras {self.fallos} fallos consecutivos')
+                self.abierto_desde = time.monotonic()
+
+def crear_sesion(concurrencia):
+    # Sesión con keep-alive y un pool de conexiones del tamaño de la concurrencia
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=concurrencia)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+class ClienteRed:
+    def __init__(self, concurrencia=CONCURRENCIA_POR_DEFECTO, peticiones_por_segundo=PETICIONES_POR_SEGUNDO,
+                 reintentos=REINTENTOS, backoff_base=BACKOFF_BASE, backoff_maximo=BACKOFF_MAXIMO,
+                 timeout=TIMEOUT, umbral_circuito=UMBRAL_CIRCUITO,
+                 enfriamiento_circuito=ENFRIAMIENTO_CIRCUITO):
+        self.concurrencia = concurrencia
+        # La sesión (y sus conexiones abiertas) se reutiliza en las invocaciones siguientes
+        self.session = sesion_http(('red', concurrencia), lambda: crear_sesion(concurrencia))
+        self.limitador = LimitadorPorHost(peticiones_por_segundo)
+        self.circuito = Circuito(umbral_circuito, enfriamiento_circuito)
+        self.reintentos = reintentos
+        self.backoff_base = backoff_base
+        self.backoff_maximo = backoff_maximo
+        self.timeout = timeout
+
+    def _espera(self, intento, response=None):
+        # Backoff exponencial con jitter completo; se respeta Retry-After si viene
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            return min(float(response.headers['Retry-After']), self.backoff_maximo)
+        return random.uniform(0, min(self.backoff_maximo, self.backoff_base * (2 ** intento)))
+
+    def get_json(self, url):
+        for intento in range(self.reintentos + 1):
+            if not self.circuito.permitir():
+                raise CircuitoAbierto(f'Circuito abierto, no se consulta {url}')
+            self.limitador.esperar(url)
+            response = None
+            inicio = time.perf_counter()
+            try:
+                contar('http.llamadas')
+                response = self.session.get(url, timeout=self.timeout)
+                if response.status_code in CODIGOS_REINTENTABLES:
+                    response.raise_for_status()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.HTTPError) as e:
+                observar('http.get', time.perf_counter() - inicio)
+                self.circuito.registrar_fallo()
+                if intento == self.reintentos:
+                    contar('http.fallos')
+                    raise
+                contar('http.reintentos')
+                print(f'Reintento {intento + 1}/{self.reintentos} para {url}: {e}')
+                time.sleep(self._espera(intento, response))
+                continue
+            # Un 4xx no reintentable es un error del pedido, no de disponibilidad
+            observar('http.get', time.perf_counter() - inicio)
+            contar('http.bytes', len(response.content or b''))
+            self.circuito.registrar_exito()
+            response.raise_for_status()
+            return response.json()
+
+    def cerrar(self):
+        # La sesión es compartida entre invocaciones, por eso no se cierra aquí
+        pass
+
+def get_servicios_diarios(cliente):
+    try:
+        return cliente.get_json(URL_SERVICIOS)  # Devuelve una lista de códigos de servicios
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f'Error al obtener servicios diarios: {e}')
+        return None
+
+def get_detalles_recorrido(cliente, codsint):
+    try:
+        return cliente.get_json(URL_RECORRIDO.format(codsint=codsint))
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f'Error al obtener detalles del recorrido {codsint}: {e}')
+        return None
+
+def crear_cliente(request):
+    # Construye el cliente con los parámetros opcionales de la petición HTTP
+    return ClienteRed(
+        concurrencia=max(1, get_parametro(request, 'concurrencia', CONCURRENCIA_POR_DEFECTO, int)),
+        peticiones_por_segundo=get_parametro(request, 'peticiones_por_segundo', PETICIONES_POR_SEGUNDO, float),
+        reintentos=get_parametro(request, 'reintentos', REINTENTOS, int),
+        timeout=get_parametro(request, 'timeout', TIMEOUT, float),
+    )
@@ -0,0 +1,261 @@
+# Recarga incremental de las tablas GTFS (modo_historico=delta)
+# Por cada tabla se guarda en el bucket la huella del último feed cargado: el hash de
+# la clave natural y el hash del contenido de cada fila (arreglos uint64 en un .npz) y
+# las claves en texto (JSON por línea, gzip) en el mismo orden. Al llegar un feed nuevo
+# se compara fila a fila con esa huella y solo las filas insertadas, modificadas o
+# eliminadas pasan a la tabla de staging `{tabla}__delta`; un único MERGE por tabla
+# las aplica sobre `{tabla}_vigente`, que guarda una fila vigente por clave en vez de
+# una copia completa del feed por cada periodo_de_carga. Las tablas históricas del
+# modo completo no se tocan.
+# Sin huella previa (primera corrida, o tras una carga en modo completo) o si el feed
+# trae claves repetidas, la tabla vigente se reemplaza completa (WRITE_TRUNCATE); al
+# ser propia del modo delta, el reemplazo no borra historia.
+import gzip
+import hashlib
+import io
+import json
+from instrumentacion import contar, span
+from carga_bigquery import CargaPorLotes
+
+PREFIJO_HUELLAS = 'datos_historicos/_huellas'
+RUTA_VIGENTES = f'{PREFIJO_HUELLAS}/vigentes.json'
+SUFIJO_STAGING = '__delta'
+SUFIJO_VIGENTE = '_vigente'
+
+# Clave natural de cada archivo del feed
+CLAVES_NATURALES = {
+    'agency': ('agency_id',),
+    'calendar': ('service_id',),
+    'calendar_dates': ('service_id', 'date'),
+    'feed_info': ('feed_publisher_name',),
+    'frequencies': ('trip_id', 'start_time'),
+    'routes': ('route_id',),
+    'shapes': ('shape_id', 'shape_pt_sequence'),
+    'stop_times': ('trip_id', 'stop_sequence'),
+    'stops': ('stop_id',),
+    'trips': ('trip_id',),
+}
+# Columnas de control: cambian en cada corrida y no cuentan como cambio de la fila
+COLUMNAS_CONTROL = ('created_at', 'periodo_de_carga', 'fecha_carga')
+
+QUERY_MERGE = """
+    MERGE `{dataset_id}.{table_id}` AS destino
+    USING `{dataset_id}.{staging_id}` AS cambios
+    ON {condicion}
+    WHEN MATCHED AND cambios._operacion = 'delete' THEN DELETE
+    WHEN MATCHED AND cambios._operacion = 'upsert' THEN UPDATE SET {asignaciones}
+    WHEN NOT MATCHED AND cambios._operacion = 'upsert' THEN INSERT ({columnas}) VALUES ({valores})
+"""
+
+def _hash64(texto):
+    return int.from_bytes(hashlib.blake2b(texto.encode('utf-8'), digest_size=8).digest(), 'big')
+
+def huella_fila(row, claves):
+    # (hash de la clave, hash del contenido sin columnas de control, clave en texto)
+    clave = json.dumps([row.get(campo) for campo in claves], ensure_ascii=False)
+    contenido = json.dumps({campo: valor for campo, valor in sorted(row.items()) if campo not in COLUMNAS_CONTROL},
+                           ensure_ascii=False, default=str)
+    return _hash64(clave), _hash64(contenido), clave
+
+def tabla_vigente(table_id):
+    return f'{table_id}{SUFIJO_VIGENTE}'
+
+def schema_staging(schema):
+    from google.cloud import bigquery
+    return list(schema) + [bigquery.SchemaField('_operacion', 'STRING')]
+
+def query_merge(dataset_id, table_id, schema):
+    claves = CLAVES_NATURALES[table_id]
+    columnas = [field.name for field in schema]
+    return QUERY_MERGE.format(
+        dataset_id=dataset_id,
+        table_id=tabla_vigente(table_id),
+        staging_id=f'{table_id}{SUFIJO_STAGING}',
+        # Con = una clave con algún NULL nunca coincide: se reinsertaría y no se podría borrar
+        condicion=' AND '.join(f'destino.{campo} IS NOT DISTINCT FROM cambios.{campo}' for campo in claves),
+        asignaciones=', '.join(f'{columna} = cambios.{columna}' for columna in columnas if columna not in claves),
+        columnas=', '.join(columnas),
+        valores=', '.join(f'cambios.{columna}' for columna in columnas)
+    )
+
+def tabla_incremental(bucket, table_id):
+    # True si la última carga de la tabla fue delta: su versión actual está en tabla_vigente()
+    blob = bucket.get_blob(RUTA_VIGENTES)
+    return blob is not None and table_id in json.loads(blob.download_as_text())
+
+class HuellasGtfs:
+    # Puntero a la huella vigente de cada tabla: {table_id: prefijo de sus archivos}
+    def __init__(self, bucket):
+        self.bucket = bucket
+        blob = bucket.get_blob(RUTA_VIGENTES)
+        self.vigentes = json.loads(blob.download_as_text()) if blob is not None else {}
+
+    def _guardar_vigentes(self):
+        self.bucket.blob(RUTA_VIGENTES).upload_from_string(json.dumps(self.vigentes, sort_keys=True),
+                                                           content_type='application/json')
+
+    def leer(self, table_id):
+        # (hashes de clave, hashes de fila, blob de claves) o None si no hay huella
+        import numpy as np
+        ruta = self.vigentes.get(table_id)
+        if not ruta:
+            return None
+        blob = self.bucket.get_blob(f'{ruta}.npz')
+        if blob is None:
+            return None
+        arreglos = np.load(io.BytesIO(blob.download_as_bytes()))
+        return arreglos['claves'], arreglos['filas'], self.bucket.blob(f'{ruta}.claves.jsonl.gz')
+
+    def guardar(self, table_id, fecha, hashes_clave, hashes_fila, claves_gz):
+        # Se llama solo después de que el MERGE o el reemplazo de la tabla terminó bien
+        import numpy as np
+        ruta = f'{PREFIJO_HUELLAS}/{fecha}/{table_id}'
+        arreglos = io.BytesIO()
+        np.savez(arreglos, claves=hashes_clave, filas=hashes_fila)
+        self.bucket.blob(f'{ruta}.npz').upload_from_string(arreglos.getvalue(),
+                                                          content_type='application/octet-stream')
+        self.bucket.blob(f'{ruta}.claves.jsonl.gz').upload_from_string(claves_gz,
+                                                                       content_type='application/gzip')
+        self.vigentes[table_id] = ruta
+        self._guardar_vigentes()
+
+    def olvidar(self, tablas):
+        # Tras una carga completa la tabla vigente queda atrasada: la próxima corrida delta la reemplaza
+        if any(table_id in self.vigentes for table_id in tablas):
+            for table_id in tablas:
+                self.vigentes.pop(table_id, None)
+            self._guardar_vigentes()
+
+class DiferenciaTabla:
+    # Compara en streaming las filas del feed nuevo con la huella anterior de la tabla
+    def __init__(self, table_id, anterior=None):
+        import numpy as np
+        self.table_id = table_id
+        self.claves = CLAVES_NATURALES[table_id]
+        self.hashes_clave = []
+        self.hashes_fila = []
+        self.claves_texto = io.BytesIO()
+        self._gzip = gzip.GzipFile(fileobj=self.claves_texto, mode='wb')
+        self.anterior = anterior
+        self.conteo = {'insertadas': 0, 'modificadas': 0, 'eliminadas': 0, 'sin_cambio': 0}
+        if anterior is not None:
+            claves, filas, _ = anterior
+            self.orden = np.argsort(claves, kind='stable')
+            self.claves_ordenadas = claves[self.orden]
+            self.filas_anteriores = filas
+            self.vistas = np.zeros(len(claves), dtype=bool)
+
+    def comparar(self, lote):
+        # Devuelve las filas del lote que cambiaron, marcadas con _operacion=upsert
+        import numpy as np
+        huellas = [huella_fila(row, self.claves) for row in lote]
+        claves = np.fromiter((h[0] for h in huellas), dtype=np.uint64, count=len(huellas))
+        filas = np.fromiter((h[1] for h in huellas), dtype=np.uint64, count=len(huellas))
+        self.hashes_clave.append(claves)
+        self.hashes_fila.append(filas)
+        self._gzip.write(''.join(h[2] + '\n' for h in huellas).encode('utf-8'))
+        if self.anterior is None:
+            return []
+        if len(self.claves_ordenadas):
+            posiciones = np.minimum(np.searchsorted(self.claves_ordenadas, claves), len(self.claves_ordenadas) - 1)
+            existe = self.claves_ordenadas[posiciones] == claves
+        else:
+            posiciones = np.zeros(len(claves), dtype=np.intp)
+            existe = np.zeros(len(claves), dtype=bool)
+        indices = self.orden[posiciones[existe]]
+        self.vistas[indices] = True
+        cambiada = np.ones(len(claves), dtype=bool)
+        cambiada[existe] = self.filas_anteriores[indices] != filas[existe]
+        insertadas = int((~existe).sum())
+        modificadas = int(cambiada.sum()) - insertadas
+        self.conteo['insertadas'] += insertadas
+        self.conteo['modificadas'] += modificadas
+        self.conteo['sin_cambio'] += len(lote) - insertadas - modificadas
+        return [dict(lote[i], _operacion='upsert') for i in np.flatnonzero(cambiada)]
+
+    def cerrar(self):
+        import numpy as np
+        self._gzip.close()
+        self.hashes_clave = np.concatenate(self.hashes_clave) if self.hashes_clave else np.zeros(0, np.uint64)
+        self.hashes_fila = np.concatenate(self.hashes_fila) if self.hashes_fila else np.zeros(0, np.uint64)
+
+    def claves_repetidas(self):
+        import numpy as np
+        return len(self.hashes_clave) - len(np.unique(self.hashes_clave))
+
+    def eliminadas(self, filas_por_lote):
+        # Lotes de filas de borrado: claves de la huella anterior que no aparecieron en el feed
+        if self.anterior is None:
+            return
+        faltantes = ~self.vistas
+        self.conteo['eliminadas'] = int(faltantes.sum())
+        if not self.conteo['eliminadas']:
+            return
+        lote = []
+        with self.anterior[2].open('rb') as binario, gzip.open(binario, 'rt', encoding='utf-8') as texto:
+            for i, linea in enumerate(texto):
+                if faltantes[i]:
+                    lote.append(dict(zip(self.claves, json.loads(linea)), _operacion='delete'))
+                    if len(lote) >= filas_por_lote:
+                        yield lote
+                        lote = []
+        if lote:
+            yield lote
+
+    def registrar(self):
+        for nombre, n in self.conteo.items():
+            contar(f'delta.{nombre}', n)
+        print(f'Tabla {self.table_id}: {json.dumps(self.conteo)}')
+
+def cargar_tabla_delta(client, dataset_id, table_id, schema, lotes, releer, huellas, fecha, filas_por_carga):
+    # lotes: filas del feed nuevo (ya observadas por los agregados); releer() vuelve a leerlas
+    # si hay que caer al reemplazo completo. Devuelve el conteo de filas por operación.
+    anterior = huellas.leer(table_id)
+    diferencia = DiferenciaTabla(table_id, anterior)
+    vigente_id = tabla_vigente(table_id)
+    if anterior is None:
+        print(f'Tabla {vigente_id} sin huella previa: se reemplaza completa')
+        carga = CargaPorLotes(client, dataset_id, {vigente_id: schema}, modo='load',
+                              max_filas=filas_por_carga, reemplazar=[vigente_id])
+        for lote in lotes:
+            diferencia.comparar(lote)
+            carga.agregar(vigente_id, lote)
+        carga.cerrar()
+        diferencia.cerrar()
+        diferencia.conteo['insertadas'] = carga.cargadas[vigente_id]
+    else:
+        staging_id = f'{table_id}{SUFIJO_STAGING}'
+        carga = CargaPorLotes(client, dataset_id, {staging_id: schema_staging(schema)}, modo='load',
+                              max_filas=filas_por_carga, reemplazar=[staging_id])
+        for lote in lotes:
+            carga.agregar(staging_id, diferencia.comparar(lote))
+        diferencia.cerrar()
+        repetidas = diferencia.claves_repetidas()
+        if repetidas:
+            # Con claves repetidas el MERGE no sabe qué fila actualizar: se reemplaza la tabla vigente
+            print(f'Tabla {table_id}: {repetidas} claves repetidas en el feed, se reemplaza {vigente_id} completa')
+            carga.descartar()
+            client.delete_table(client.dataset(dataset_id).table(staging_id), not_found_ok=True)
+            huellas.olvidar([table_id])
+            return cargar_tabla_delta(client, dataset_id, table_id, schema, releer(), releer, huellas, fecha,
+                                      filas_por_carga)
+        for lote in diferencia.eliminadas(filas_por_carga):
+            carga.agregar(staging_id, lote)
+        carga.cerrar()
+        if carga.cargadas[staging_id]:
+            with span('bigquery.merge', table_id):
+                job = client.query(query_merge(dataset_id, table_id, schema))
+                job.result()
+            contar('bigquery.llamadas')
+            print(f'MERGE aplicado en la tabla {vigente_id}: {carga.cargadas[staging_id]} cambios')
+        else:
+            print(f'Tabla {table_id} sin cambios respecto del feed anterior')
+        client.delete_table(client.dataset(dataset_id).table(staging_id), not_found_ok=True)
+    diferencia.registrar()
+    if diferencia.claves_repetidas():
+        # Sin huella la próxima corrida vuelve a reemplazar la tabla
+        print(f'Tabla {table_id}: claves repetidas en el feed, no se guarda la huella')
+    else:
+        huellas.guardar(table_id, fecha, diferencia.hashes_clave, diferencia.hashes_fila,
+                        diferencia.claves_texto.getvalue())
+    return diferencia.conteo
@@ -0,0 +1,695 @@
+# Reemplazos locales en memoria de Cloud Storage, BigQuery, Pub/Sub, la API de red.cl
+# y la descarga del GTFS, para ejecutar las funciones en proceso (runner_dag.py).
+# Los datos son sintéticos y deterministas; solo se implementa lo que usan las funciones.
+import hashlib
+import io
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from datetime import datetime, timezone
+import zipfile
+from contextlib import contextmanager
+from unittest import mock
+
+# --- Datos sintéticos ---
+
+def codsints_sinteticos(recorridos):
+    return [f'{100 + i}{"I" if i % 2 else "R"}' for i in range(recorridos)]
+
+def recorrido_sintetico(codsint, paraderos=10, puntos=50, servicios=3, red=40):
+    # `red` es la cantidad de paraderos distintos de la ciudad entre los que se eligen los del recorrido
+    semilla = sum(map(ord, str(codsint)))
+
+    def paradero(j):
+        return {
+            'id': j, 'cod': f'PA{j}', 'num': j, 'pos': [-33.4 + j * 1e-3, -70.6], 'name': f'Parada {j}',
+            'comuna': 'Santiago', 'type': 1, 'eje': 'Alameda', 'codSimt': f'PA{j}', 'distancia': 0.0,
+            'stop': {'stopId': j, 'stopCoordenadaX': '-70.6', 'stopCoordenadaY': str(-33.4 + j * 1e-3)},
+            'servicios': [{
+                'id': k, 'cod': str(k), 'destino': 'Centro', 'orden': 1, 'color': '#FF0000',
+                'negocio': {'nombre': f'Unidad {k % 7}', 'color': '#00FF00'},
+                'recorrido': {'destino': 'Centro'}, 'itinerario': True, 'codigo': str(k)
+            } for k in range(servicios)]
+        }
+
+    def sentido(desfase):
+        inicio = (semilla + desfase) % red
+        return {
+            'horarios': [{'tipoDia': 'L', 'inicio': '05:30', 'fin': '23:30'},
+                         {'tipoDia': 'S', 'inicio': '06:30', 'fin': '23:00'}],
+            'path': [[-33.4 + k * 1e-4, -70.6 + ((k * 37 + semilla) % 11) * 1e-5] for k in range(puntos)],
+            'paraderos': [paradero(j) for j in range(inicio, inicio + paraderos)]
+        }
+
+    return {
+        'negocio': {'id': semilla % 7, 'nombre': f'Unidad {semilla % 7}', 'color': '#00FF00', 'url': ''},
+        'ida': sentido(0),
+        'regreso': sentido(20)
+    }
+
+def recorrido_realista(codsint):
+    # Tamaños como los de conocerecorrido: 25-70 paraderos por sentido, 400-1500 puntos
+    # de path y 1-8 servicios por paradero, elegidos entre ~11.000 paraderos de la ciudad
+    azar = random.Random(str(codsint))
+    return recorrido_sintetico(codsint, paraderos=azar.randint(25, 70), puntos=azar.randint(400, 1500),
+                               servicios=azar.randint(1, 8), red=11000)
+
+def _escribir_miembro(archivo, nombre, encabezado, filas, bloque=10000):
+    # Escribe una tabla del ZIP por bloques, sin armar el CSV completo en memoria
+    with archivo.open(nombre, 'w') as miembro:
+        miembro.write(encabezado.encode('utf-8'))
+        pendientes = []
+        for fila in filas:
+            pendientes.append(fila)
+            if len(pendientes) >= bloque:
+                miembro.write(''.join(pendientes).encode('utf-8'))
+                pendientes.clear()
+        miembro.write(''.join(pendientes).encode('utf-8'))
+
+def gtfs_sintetico(rutas=10, viajes=100, paradas_por_viaje=30, paradas=None):
+    # ZIP con las tablas que carga fn_obtener_datos_historicos_tranf; las paradas
+    # coinciden en código y posición con los paraderos sintéticos de red.cl.
+    # stop_times tiene viajes * paradas_por_viaje filas (60.000 viajes ~ 1,8 millones)
+    ids_rutas = codsints_sinteticos(rutas)
+    n_paradas = paradas or 7 * 5 + paradas_por_viaje
+
+    def viaje(t):
+        ruta, servicio = ids_rutas[t % rutas], 'LSD'[t % 3]
+        return ruta, servicio, f'{ruta}-{servicio}-{t}'
+
+    def primera_parada(t):
+        if paradas is None:
+            return (t % 7) * 5
+        return (t * 37) % max(1, n_paradas - paradas_por_viaje + 1)
+
+    def filas_trips():
+        for t in range(viajes):
+            ruta, servicio, trip_id = viaje(t)
+            yield f'{ruta},{servicio},{trip_id},Centro,{t % 2},{ruta}-{t % 2}\n'
+
+    def filas_stop_times():
+        for t in range(viajes):
+            trip_id = viaje(t)[2]
+            base = 5 * 3600 + t * 600 % (18 * 3600)
+            for k in range(paradas_por_viaje):
+                s = base + k * 120
+                hora = f'{s // 3600:02d}:{s % 3600 // 60:02d}:{s % 60:02d}'
+                yield f'{trip_id},{hora},{hora},PA{primera_parada(t) + k},{k + 1}\n'
+
+    tablas = {
+        'agency.txt': ('agency_id,agency_name,agency_url,agency_timezone\n',
+                       ['DTPM,Directorio de Transporte Público Metropolitano,http://www.dtpm.cl,America/Santiago\n']),
+        'calendar.txt': ('service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date\n',
+                         ['L,1,1,1,1,1,0,0,20240601,20241231\n', 'S,0,0,0,0,0,1,0,20240601,20241231\n',
+                          'D,0,0,0,0,0,0,1,20240601,20241231\n']),
+        'calendar_dates.txt': ('service_id,date,exception_type\n', ['L,20240918,2\n']),
+        'feed_info.txt': ('feed_publisher_name,feed_publisher_url,feed_lang,feed_start_date,feed_end_date,'
+                          'feed_version\n', ['DTPM,http://www.dtpm.cl,es,20240601,20241231,LOCAL\n']),
+        'routes.txt': ('route_id,agency_id,route_short_name,route_long_name,route_desc,route_type,route_url,'
+                       'route_color,route_text_color\n',
+                       (f'{r},DTPM,{r},Ruta {r},,3,,FF0000,FFFFFF\n' for r in ids_rutas)),
+        'trips.txt': ('route_id,service_id,trip_id,trip_headsign,direction_id,shape_id\n', filas_trips()),
+        'stop_times.txt': ('trip_id,arrival_time,departure_time,stop_id,stop_sequence\n', filas_stop_times()),
+        'frequencies.txt': ('trip_id,start_time,end_time,headway_secs,exact_times\n',
+                            (f'{viaje(t)[2]},06:00:00,09:00:00,600,0\n' for t in range(0, viajes, 4))),
+        'shapes.txt': ('shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence\n',
+                       (f'{r}-{d},{-33.4 + k * 1e-4:.6f},{-70.6 + k * 1e-4:.6f},{k + 1}\n'
+                        for r in ids_rutas for d in (0, 1) for k in range(100))),
+        'stops.txt': ('stop_id,stop_code,stop_name,stop_lat,stop_lon,stop_url,wheelchair_boarding\n',
+                      (f'PA{j},PA{j},Parada {j},{-33.4 + j * 1e-3:.6f},-70.600000,,1\n' for j in range(n_paradas))),
+    }
+    salida = io.BytesIO()
+    with zipfile.ZipFile(salida, 'w', zipfile.ZIP_DEFLATED) as archivo:
+        for nombre, (encabezado, filas) in tablas.items():
+            _escribir_miembro(archivo, nombre, encabezado, filas)
+    return salida.getvalue()
+
+# --- Llamadas y latencia simulada ---
+
+_lock_llamadas = threading.Lock()
+
+def _registrar(servicio, llamada):
+    # Cuenta la llamada en `servicio.llamadas` y espera la latencia configurada del servicio
+    with _lock_llamadas:
+        servicio.llamadas[llamada] = servicio.llamadas.get(llamada, 0) + 1
+    if servicio.latencia:
+        time.sleep(servicio.latencia)
+
+# --- Cloud Storage ---
+
+class _Escritura(io.BytesIO):
+    def __init__(self, blob):
+        super().__init__()
+        self.blob = blob
+
+    def close(self):
+        if not self.closed:
+            self.blob._guardar(self.getvalue())
+        super().close()
+
+class BlobLocal:
+    def __init__(self, name, bucket, chunk_size=None):
+        self.name = name
+        self.bucket = bucket
+
+    @property
+    def _objetos(self):
+        return self.bucket.objetos
+
+    @property
+    def generation(self):
+        objeto = self._objetos.get(self.name)
+        return objeto[1] if objeto else None
+
+    @property
+    def size(self):
+        objeto = self._objetos.get(self.name)
+        return len(objeto[0]) if objeto else None
+
+    def _verificar(self, if_generation_match):
+        if if_generation_match is not None and (self.generation or 0) != if_generation_match:
+            from google.api_core.exceptions import PreconditionFailed
+            raise PreconditionFailed(f'{self.name}: generación distinta de {if_generation_match}')
+
+    def _guardar(self, datos, if_generation_match=None):
+        _registrar(StorageLocal, 'upload')
+        with self.bucket.lock:
+            self._verificar(if_generation_match)
+            self._objetos[self.name] = (bytes(datos), (self.generation or 0) + 1)
+
+    def exists(self, **kwargs):
+        _registrar(StorageLocal, 'metadata')
+        return self.name in self._objetos
+
+    def reload(self, **kwargs):
+        if self.name not in self._objetos:
+            from google.api_core.exceptions import NotFound
+            raise NotFound(self.name)
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None, **kwargs):
+        self._guardar(data.encode('utf-8') if isinstance(data, str) else data, if_generation_match)
+
+    def upload_from_file(self, file_obj, size=None, content_type=None, if_generation_match=None, **kwargs):
+        self._guardar(file_obj.read() if size is None else file_obj.read(size), if_generation_match)
+
+    def download_as_bytes(self, start=None, end=None, if_generation_match=None, **kwargs):
+        _registrar(StorageLocal, 'download')
+        self.reload()
+        self._verificar(if_generation_match)
+        datos = self._objetos[self.name][0]
+        if start is not None or end is not None:
+            datos = datos[start or 0:None if end is None else end + 1]
+        return datos
+
+    def download_as_text(self, encoding='utf-8', **kwargs):
+        return self.download_as_bytes(**kwargs).decode(encoding)
+
+    def open(self, mode='r', chunk_size=None, content_type=None, ignore_flush=None, encoding=None, **kwargs):
+        if 'w' in mode:
+            escritura = _Escritura(self)
+            return escritura if 'b' in mode else io.TextIOWrapper(escritura, encoding=encoding or 'utf-8')
+        lectura = io.BytesIO(self.download_as_bytes())
+        return lectura if 'b' in mode else io.TextIOWrapper(lectura, encoding=encoding or 'utf-8')
+
+    def delete(self, **kwargs):
+        _registrar(StorageLocal, 'delete')
+        with self.bucket.lock:
+            if self._objetos.pop(self.name, None) is None:
+                from google.api_core.exceptions import NotFound
+                raise NotFound(self.name)
+
+class BucketLocal:
+    def __init__(self, name, objetos, lock):
+        self.name = name
+        self.objetos = objetos
+        self.lock = lock
+
+    def blob(self, name, chunk_size=None, **kwargs):
+        return BlobLocal(name, self, chunk_size)
+
+    def get_blob(self, name, **kwargs):
+        _registrar(StorageLocal, 'metadata')
+        return BlobLocal(name, self) if name in self.objetos else None
+
+class StorageLocal:
+    # Todas las instancias comparten los mismos buckets, como el servicio real
+    buckets = {}
+    lock = threading.Lock()
+    llamadas = {}
+    latencia = 0.0  # Segundos por llamada
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def bucket(self, name):
+        with self.lock:
+            objetos = self.buckets.setdefault(name, {})
+        return BucketLocal(name, objetos, self.lock)
+
+    def list_blobs(self, bucket, prefix=None, max_results=None, **kwargs):
+        _registrar(StorageLocal, 'list')
+        bucket = bucket if isinstance(bucket, BucketLocal) else self.bucket(bucket)
+        with bucket.lock:
+            nombres = sorted(n for n in bucket.objetos if n.startswith(prefix or ''))
+        if max_results:
+            nombres = nombres[:max_results]
+        return iter([BlobLocal(n, bucket) for n in nombres])
+
+# --- BigQuery ---
+
+class _JobLocal:
+    errors = None
+
+    def __init__(self, job_id, output_rows=0):
+        self.job_id = job_id
+        self.output_rows = output_rows
+
+    def result(self, **kwargs):
+        return self
+
+class _ConsultaLocal(_JobLocal):
+    def __init__(self, job_id, filas):
+        super().__init__(job_id)
+        self.filas = filas
+
+    def result(self, **kwargs):
+        return iter(self.filas)
+
+def _cumple_fecha(fecha, filtro, acepta_nulos):
+    # filtro: match de `fecha_carga (=|>=) DATE '...'`
+    if fecha is None:
+        return acepta_nulos
+    operador, limite = filtro.groups()
+    return str(fecha) == limite if operador == '=' else str(fecha) >= limite
+
+class BigQueryLocal:
+    # Tablas en memoria compartidas: {table_id: {'schema': [...], 'filas': [...]}}
+    tablas = {}
+    lock = threading.Lock()
+    llamadas = {}
+    latencia = 0.0
+
+    def __init__(self, *args, project='local', **kwargs):
+        self.project = project
+
+    def dataset(self, dataset_id):
+        from google.cloud import bigquery
+        return bigquery.DatasetReference(self.project, dataset_id)
+
+    def get_table(self, table):
+        from google.cloud import bigquery
+        _registrar(BigQueryLocal, 'metadata')
+        if table.table_id not in self.tablas:
+            from google.api_core.exceptions import NotFound
+            raise NotFound(f'Tabla {table.table_id}')
+        tabla = self.tablas[table.table_id]
+        resultado = bigquery.Table(self.dataset(table.dataset_id).table(table.table_id), schema=tabla['schema'])
+        resultado.time_partitioning = tabla.get('time_partitioning')
+        resultado.clustering_fields = tabla.get('clustering_fields')
+        return resultado
+
+    def update_table(self, table, fields, **kwargs):
+        _registrar(BigQueryLocal, 'metadata')
+        with self.lock:
+            tabla = self.tablas[table.table_id]
+            if 'schema' in fields:
+                tabla['schema'] = list(table.schema)
+            for campo in ('time_partitioning', 'clustering_fields'):
+                if campo in fields:
+                    tabla[campo] = getattr(table, campo)
+        return table
+
+    def create_table(self, table, exists_ok=False, **kwargs):
+        _registrar(BigQueryLocal, 'metadata')
+        with self.lock:
+            self.tablas.setdefault(table.table_id, {'schema': list(table.schema), 'filas': [],
+                                                    'time_partitioning': table.time_partitioning,
+                                                    'clustering_fields': table.clustering_fields})
+        return table
+
+    def copy_table(self, sources, destination, **kwargs):
+        from google.api_core.exceptions import Conflict
+        _registrar(BigQueryLocal, 'copy')
+        with self.lock:
+            if destination.table_id in self.tablas:
+                raise Conflict(f'Tabla {destination.table_id}')
+            tabla = self.tablas[sources.table_id]
+            self.tablas[destination.table_id] = dict(tabla, filas=[dict(fila) for fila in tabla['filas']])
+        return _JobLocal(f'copy-{destination.table_id}', len(tabla['filas']))
+
+    def delete_table(self, table, not_found_ok=False, **kwargs):
+        _registrar(BigQueryLocal, 'metadata')
+        with self.lock:
+            if self.tablas.pop(table.table_id, None) is None and not not_found_ok:
+                from google.api_core.exceptions import NotFound
+                raise NotFound(f'Tabla {table.table_id}')
+
+    def _agregar(self, table_id, filas, job_config=None):
+        if (job_config is not None and job_config.schema_update_options
+                and job_config.write_disposition not in (None, 'WRITE_APPEND')):
+            from google.api_core.exceptions import BadRequest
+            raise BadRequest('schema_update_options solo se admite con WRITE_APPEND')
+        with self.lock:
+            tabla = self.tablas.setdefault(table_id, {'schema': [], 'filas': []})
+            if job_config is not None and job_config.schema and not tabla['schema']:
+                tabla['schema'] = list(job_config.schema)
+            if job_config is not None and job_config.write_disposition == 'WRITE_TRUNCATE':
+                tabla['filas'] = []
+            tabla['filas'].extend(filas)
+
+    def insert_rows_json(self, table, rows, **kwargs):
+        _registrar(BigQueryLocal, 'insert_rows_json')
+        self._agregar(table.table_id, list(rows))
+        return []
+
+    def load_table_from_file(self, file_obj, destination, rewind=False, job_config=None, **kwargs):
+        _registrar(BigQueryLocal, 'load')
+        if rewind:
+            file_obj.seek(0)
+        filas = [json.loads(linea) for linea in file_obj.read().splitlines() if linea.strip()]
+        self._agregar(destination.table_id, filas, job_config)
+        return _JobLocal(f'load-{destination.table_id}', len(filas))
+
+    def load_table_from_uri(self, source_uris, destination, job_config=None, **kwargs):
+        import pyarrow.parquet as pq
+        _registrar(BigQueryLocal, 'load')
+        bucket, nombre = source_uris[len('gs://'):].split('/', 1)
+        datos = StorageLocal().bucket(bucket).blob(nombre).download_as_bytes()
+        filas = pq.read_table(io.BytesIO(datos)).to_pylist()
+        self._agregar(destination.table_id, filas, job_config)
+        return _JobLocal(f'load-{destination.table_id}', len(filas))
+
+    def _merge(self, sql):
+        # Aplica el MERGE de delta_gtfs: borra, actualiza o inserta según cambios._operacion
+        destino = re.search(r'MERGE\s+`[^`]*?\.?(\w+)`', sql).group(1)
+        origen = re.search(r'USING\s+`[^`]*?\.?(\w+)`', sql).group(1)
+        claves = re.findall(r'destino\.(\w+)\s+IS NOT DISTINCT FROM\s+cambios\.', sql)
+        with self.lock:
+            cambios = {tuple(fila.get(c) for c in claves): fila for fila in self.tablas[origen]['filas']}
+            filas, afectadas = [], 0
+            for fila in self.tablas[destino]['filas']:
+                cambio = cambios.get(tuple(fila.get(c) for c in claves))
+                if cambio is None:
+                    filas.append(fila)
+                    continue
+                afectadas += 1
+                if cambio['_operacion'] == 'upsert':
+                    filas.append({c: v for c, v in cambio.items() if c != '_operacion'})
+            existentes = {tuple(fila.get(c) for c in claves) for fila in self.tablas[destino]['filas']}
+            for clave, cambio in cambios.items():
+                if cambio['_operacion'] == 'upsert' and clave not in existentes:
+                    filas.append({c: v for c, v in cambio.items() if c != '_operacion'})
+                    afectadas += 1
+            self.tablas[destino]['filas'] = filas
+        return _JobLocal(f'merge-{destino}', afectadas)
+
+    def _insertar_desde(self, sql):
+        # INSERT ... SELECT de la migración de registro_esquemas: copia las filas y deduce
+        # fecha_carga de periodo_de_carga como lo hace la expresión SQL
+        destino = re.search(r'INSERT INTO\s+`[^`]*?\.?(\w+)`', sql).group(1)
+        origen = re.search(r'FROM\s+`[^`]*?\.?(\w+)`', sql).group(1)
+        filas = [dict(fila) for fila in self.tablas[origen]['filas']]
+        for fila in filas:
+            if fila.get('fecha_carga') is None and fila.get('periodo_de_carga'):
+                fila['fecha_carga'] = fila['periodo_de_carga']
+        self._agregar(destino, filas)
+        return _JobLocal(f'insert-{destino}', len(filas))
+
+    def _ultima_particion(self, sql):
+        # MAX(partition_id) de INFORMATION_SCHEMA.PARTITIONS para tablas particionadas por columna
+        table_id = re.search(r"table_name\s*=\s*'(\w+)'", sql).group(1)
+        tabla = self.tablas.get(table_id, {})
+        particion = tabla.get('time_partitioning')
+        ids = set()
+        if particion is not None and particion.field:
+            ids = {str(fila[particion.field]).replace('-', '') for fila in tabla['filas']
+                   if fila.get(particion.field) is not None}
+        return _ConsultaLocal(f'particiones-{table_id}', [{'partition_id': max(ids, default=None)}])
+
+    def query(self, sql, **kwargs):
+        # Solo devuelve las filas de la tabla del FROM, sin repetir la primera columna
+        # del SELECT y aplicando el filtro por fecha_carga (alcanza para las consultas
+        # de fn_emparejar_paraderos)
+        _registrar(BigQueryLocal, 'query')
+        if sql.lstrip().startswith('MERGE'):
+            return self._merge(sql)
+        if sql.lstrip().startswith('INSERT'):
+            return self._insertar_desde(sql)
+        if 'INFORMATION_SCHEMA.PARTITIONS' in sql:
+            return self._ultima_particion(sql)
+        table_id = re.search(r'FROM\s+`[^`]*?\.?(\w+)`', sql).group(1)
+        columna = re.search(r'SELECT\s+(\w+)', sql).group(1)
+        filtro = re.search(r"fecha_carga\s*(>=|=)\s*DATE\s*'([\d-]+)'", sql)
+        filas, vistos = [], set()
+        for fila in self.tablas.get(table_id, {}).get('filas', []):
+            if filtro and not _cumple_fecha(fila.get('fecha_carga'), filtro, 'fecha_carga IS NULL' in sql):
+                continue
+            if fila.get(columna) not in vistos:
+                vistos.add(fila.get(columna))
+                filas.append(dict(fila))
+        return _ConsultaLocal(f'query-{table_id}', filas)
+
+# --- Pub/Sub ---
+
+class _MensajeLocal:
+    def __init__(self, message_id, data, attributes):
+        self.message_id = message_id
+        self.data = data
+        self.attributes = attributes
+        self.publish_time = datetime.now(timezone.utc)
+
+class _RecibidoLocal:
+    def __init__(self, ack_id, message, delivery_attempt):
+        self.ack_id = ack_id
+        self.message = message
+        self.delivery_attempt = delivery_attempt
+
+class _PullLocal:
+    def __init__(self, received_messages):
+        self.received_messages = received_messages
+
+class PubSubLocal:
+    # Tópicos y suscripciones en memoria compartidos por publicadores y suscriptores.
+    # Una suscripción recibe los mensajes que se publican en su tópico después de crearla;
+    # un mensaje entregado y no confirmado vuelve a la cola al vencer su plazo o con un nack.
+    suscripciones = {}  # subscription_path -> topic_path
+    colas = {}  # subscription_path -> deque de (mensaje, entregas)
+    en_vuelo = {}  # ack_id -> (subscription_path, mensaje, entregas, vence)
+    lock = threading.Lock()
+    contador = itertools.count()
+    llamadas = {}
+    latencia = 0.0
+    plazo_ack = 60.0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    @classmethod
+    def suscribir(cls, subscription_path, topic_path):
+        with cls.lock:
+            cls.suscripciones[subscription_path] = topic_path
+            cls.colas.setdefault(subscription_path, deque())
+
+    @classmethod
+    def reiniciar(cls):
+        with cls.lock:
+            cls.suscripciones.clear()
+            cls.colas.clear()
+            cls.en_vuelo.clear()
+        cls.llamadas.clear()
+
+class PublicadorLocal(PubSubLocal):
+    def topic_path(self, project, topic):
+        return f'projects/{project}/topics/{topic}'
+
+    def publish(self, topic, data, ordering_key='', **attrs):
+        mensaje = _MensajeLocal(str(next(self.contador)), data, dict(attrs))
+        _registrar(PubSubLocal, 'publish')
+        with self.lock:
+            for subscription_path, topic_path in self.suscripciones.items():
+                if topic_path == topic:
+                    self.colas[subscription_path].append((mensaje, 0))
+        future = Future()
+        future.set_result(mensaje.message_id)
+        return future
+
+    def resume_publish(self, topic, ordering_key):
+        pass
+
+class SuscriptorLocal(PubSubLocal):
+    def subscription_path(self, project, subscription):
+        return f'projects/{project}/subscriptions/{subscription}'
+
+    def _vencidos(self, ahora):
+        for ack_id, (subscription_path, mensaje, entregas, vence) in list(self.en_vuelo.items()):
+            if vence <= ahora:
+                del self.en_vuelo[ack_id]
+                self.colas[subscription_path].append((mensaje, entregas))
+
+    def pull(self, request, timeout=None, **kwargs):
+        subscription_path = request['subscription']
+        recibidos = []
+        _registrar(PubSubLocal, 'pull')
+        with self.lock:
+            ahora = time.monotonic()
+            self._vencidos(ahora)
+            cola = self.colas.setdefault(subscription_path, deque())
+            while cola and len(recibidos) < request.get('max_messages', 1):
+                mensaje, entregas = cola.popleft()
+                ack_id = f'ack-{next(self.contador)}'
+                self.en_vuelo[ack_id] = (subscription_path, mensaje, entregas + 1, ahora + self.plazo_ack)
+                recibidos.append(_RecibidoLocal(ack_id, mensaje, entregas + 1))
+        return _PullLocal(recibidos)
+
+    @staticmethod
+    def _validar_ack_ids(request):
+        # Pub/Sub rechaza acknowledge y modify_ack_deadline sin ack_ids
+        if not request['ack_ids']:
+            from google.api_core.exceptions import InvalidArgument
+            raise InvalidArgument('ack_ids vacío')
+
+    def acknowledge(self, request, **kwargs):
+        _registrar(PubSubLocal, 'acknowledge')
+        self._validar_ack_ids(request)
+        with self.lock:
+            for ack_id in request['ack_ids']:
+                self.en_vuelo.pop(ack_id, None)
+
+    def modify_ack_deadline(self, request, **kwargs):
+        # Plazo 0 equivale a un nack: el mensaje queda disponible de inmediato
+        _registrar(PubSubLocal, 'modify_ack_deadline')
+        self._validar_ack_ids(request)
+        with self.lock:
+            vence = time.monotonic() + request['ack_deadline_seconds']
+            for ack_id in request['ack_ids']:
+                if ack_id in self.en_vuelo:
+                    subscription_path, mensaje, entregas, _ = self.en_vuelo[ack_id]
+                    self.en_vuelo[ack_id] = (subscription_path, mensaje, entregas, vence)
+            self._vencidos(time.monotonic())
+
+# --- red.cl y descarga del GTFS ---
+
+class _RespuestaLocal:
+    def __init__(self, status_code=200, contenido=None, datos=b'', headers=None):
+        self.status_code = status_code
+        self.contenido = contenido
+        self.datos = datos
+        self.headers = headers or {}
+
+    @property
+    def content(self):
+        return json.dumps(self.contenido).encode('utf-8') if self.contenido is not None else self.datos
+
+    def json(self):
+        return self.contenido
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            import requests
+            raise requests.exceptions.HTTPError(f'{self.status_code} local', response=self)
+
+    def iter_content(self, chunk_size=1024 * 1024):
+        for i in range(0, len(self.datos), chunk_size):
+            yield self.datos[i:i + chunk_size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class SesionRedLocal:
+    # Respuestas de red.cl con latencia fija y una tasa de errores 503 reintentables.
+    # Qué intento falla depende solo de la URL y del número de intento, así la cantidad
+    # de llamadas no cambia entre corridas aunque los hilos se intercalen distinto.
+    llamadas = {}
+    latencia = 0.0
+
+    def __init__(self, codsints, generador=recorrido_sintetico, tasa_error=0.0):
+        self.codsints = codsints
+        self.generador = generador
+        self.tasa_error = tasa_error
+        self.lock = threading.Lock()
+        self.intentos = {}
+
+    def _falla(self, url):
+        if not self.tasa_error:
+            return False
+        with self.lock:
+            intento = self.intentos[url] = self.intentos.get(url, 0) + 1
+        digest = hashlib.blake2b(f'{url}#{intento}'.encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'big') / 2 ** 64 < self.tasa_error
+
+    def get(self, url, timeout=None, **kwargs):
+        _registrar(SesionRedLocal, 'get')
+        if self._falla(url):
+            return _RespuestaLocal(status_code=503)
+        if 'getservicios' in url:
+            return _RespuestaLocal(contenido=list(self.codsints))
+        codsint = url.split('codsint=', 1)[1]
+        return _RespuestaLocal(contenido=self.generador(codsint))
+
+    def close(self):
+        pass
+
+class SesionGtfsLocal:
+    # Sesión por defecto de recursos.sesion_http: responde la descarga condicional del GTFS
+    def __init__(self, zip_gtfs):
+        self.zip_gtfs = zip_gtfs
+
+    def get(self, url, headers=None, **kwargs):
+        _registrar(SesionRedLocal, 'gtfs')
+        if headers and headers.get('If-None-Match') == '"local"':
+            return _RespuestaLocal(status_code=304)
+        return _RespuestaLocal(datos=self.zip_gtfs, headers={'ETag': '"local"'})
+
+    def close(self):
+        pass
+
+SERVICIOS_LOCALES = (StorageLocal, BigQueryLocal, PubSubLocal, SesionRedLocal)
+
+@contextmanager
+def entorno_local(recorridos=50, rutas_gtfs=10, viajes_gtfs=100, paradas_por_viaje=30, paradas_gtfs=None,
+                  realista=False, tasa_error_red=0.0, latencias=None):
+    # Reemplaza los clientes de Google, la API de red.cl y la descarga del GTFS
+    # mientras dura el bloque; al salir se restauran los originales.
+    # realista=true usa recorridos del tamaño de los reales; `latencias` fija los segundos
+    # por llamada de cada servicio: {'red': 0.05, 'gcs': 0.02, 'bigquery': 0.5, 'pubsub': 0.01}
+    from google.cloud import storage, bigquery, pubsub_v1
+    import cliente_red
+    import recursos
+    from fn_obtener_datos_diarios_in_realtime import PROJECT_ID, TOPIC_ID
+    from fn_consumir_datos_diarios_realtime import SUBSCRIPTION_ID
+    codsints = codsints_sinteticos(recorridos)
+    zip_gtfs = gtfs_sintetico(rutas_gtfs, viajes_gtfs, paradas_por_viaje, paradas_gtfs)
+    generador = recorrido_realista if realista else recorrido_sintetico
+
+    StorageLocal.buckets.clear()
+    BigQueryLocal.tablas.clear()
+    PubSubLocal.reiniciar()
+    PubSubLocal.suscribir(SuscriptorLocal().subscription_path(PROJECT_ID, SUBSCRIPTION_ID),
+                          PublicadorLocal().topic_path(PROJECT_ID, TOPIC_ID))
+    latencias = latencias or {}
+    for servicio, nombre in zip(SERVICIOS_LOCALES, ('gcs', 'bigquery', 'pubsub', 'red')):
+        servicio.llamadas.clear()
+        servicio.latencia = latencias.get(nombre, 0.0)
+    with mock.patch.object(storage, 'Client', StorageLocal), \
+            mock.patch.object(bigquery, 'Client', BigQueryLocal), \
+            mock.patch.object(pubsub_v1, 'PublisherClient', PublicadorLocal), \
+            mock.patch.object(pubsub_v1, 'SubscriberClient', SuscriptorLocal), \
+            mock.patch.object(cliente_red, 'crear_sesion',
+                              lambda concurrencia: SesionRedLocal(codsints, generador, tasa_error_red)):
+        # Los clientes cacheados se descartan al entrar y al salir
+        recursos.limpiar()
+        recursos.sesion_http(crear=lambda: SesionGtfsLocal(zip_gtfs))
+        try:
+            yield
+        finally:
+            recursos.limpiar()
+            for servicio in SERVICIOS_LOCALES:
+                servicio.latencia = 0.0
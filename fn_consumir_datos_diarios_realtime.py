@@ -0,0 +1,209 @@
+# Consumidor de los recorridos publicados por fn_obtener_datos_diarios_in_realtime
+# La función se invoca periódicamente (Cloud Scheduler) y hace pull síncrono de la
+# suscripción durante a lo más `tiempo_maximo` segundos. Los mensajes se aplanan con
+# transformar_recorrido y se escriben en micro-lotes (por cantidad o por ventana de
+# tiempo); un lote se confirma (ack) solo después de que todas sus filas quedaron en
+# BigQuery. Si la escritura falla, los mensajes del lote se liberan (nack) para que
+# Pub/Sub los vuelva a entregar: la entrega es al menos una vez. Mientras esperan en el
+# lote y durante la escritura, el plazo de ack de los mensajes se extiende a `plazo_ack`
+# para que Pub/Sub no los reentregue (y duplique filas) antes de confirmarlos.
+import gzip
+import json
+import time
+from parametros import get_parametro
+from instrumentacion import instrumentar, contar, observar, span
+from recursos import bigquery_client, storage_client, subscriber_client
+from registro_esquemas import registro_esquemas
+from carga_bigquery import CargaPorLotes, MODO_CARGA
+from indice_deduplicacion import IndiceDeduplicacion
+from fn_obtener_datos_diarios_tranf import schemas, disenos, transformar_recorrido, MODO_PATHS, TOLERANCIA_PATHS_M
+
+PROJECT_ID = "eva-2-duocuc-clk"
+SUBSCRIPTION_ID = "get_daily_data-sub"
+
+# Configuración por defecto de los micro-lotes
+MAX_MENSAJES_LOTE = 500
+VENTANA_LOTE = 5.0  # Segundos desde el primer mensaje del lote hasta escribirlo
+MENSAJES_POR_PULL = 100
+TIEMPO_MAXIMO = 480  # Segundos de consumo por invocación (menos que el timeout de la función)
+MAX_PULLS_VACIOS = 3  # Pulls seguidos sin mensajes antes de terminar antes de tiempo
+PLAZO_ACK = 60  # Segundos de plazo de ack: debe cubrir la ventana del lote más la carga (máx. 600)
+
+def decodificar_mensaje(mensaje):
+    # Devuelve (codsint, detalles); el publicador comprime con gzip si se pide comprimir=true
+    data = mensaje.data
+    if mensaje.attributes.get('content_encoding') == 'gzip':
+        data = gzip.decompress(data)
+    return mensaje.attributes.get('codsint'), json.loads(data.decode('utf-8'))
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+class ConsumidorRecorridos:
+    def __init__(self, subscriber, subscription_path, carga, modo_paths=MODO_PATHS,
+                 tolerancia_m=TOLERANCIA_PATHS_M, max_mensajes=MAX_MENSAJES_LOTE,
+                 ventana=VENTANA_LOTE, mensajes_por_pull=MENSAJES_POR_PULL, plazo_ack=PLAZO_ACK):
+        self.subscriber = subscriber
+        self.subscription_path = subscription_path
+        self.carga = carga
+        self.modo_paths = modo_paths
+        self.tolerancia_m = tolerancia_m
+        self.max_mensajes = max_mensajes
+        self.ventana = ventana
+        self.mensajes_por_pull = mensajes_por_pull
+        self.plazo_ack = max(10, min(600, int(plazo_ack)))
+        self.confirmados = 0
+        self.liberados = 0
+        self.descartados = 0
+        self.latencias = []  # Segundos entre la publicación y la disponibilidad en BigQuery
+        self._nuevo_lote()
+
+    def _nuevo_lote(self):
+        self.ack_ids = []
+        self.publicados = []
+        self.filas = {}
+        self.inicio_lote = None
+
+    def _pull(self, timeout):
+        from google.api_core.exceptions import DeadlineExceeded
+        try:
+            contar('pubsub.llamadas')
+            with span('pubsub.pull'):
+                respuesta = self.subscriber.pull(
+                    request={'subscription': self.subscription_path,
+                             'max_messages': min(self.mensajes_por_pull, self.max_mensajes - len(self.ack_ids))},
+                    timeout=timeout)
+        except DeadlineExceeded:
+            return []
+        return respuesta.received_messages
+
+    def extender(self, ack_ids):
+        # Renueva el plazo de ack; se llama tras cada pull y antes de escribir el lote
+        if not ack_ids:
+            return
+        contar('pubsub.llamadas')
+        self.subscriber.modify_ack_deadline(request={'subscription': self.subscription_path,
+                                                     'ack_ids': list(ack_ids),
+                                                     'ack_deadline_seconds': self.plazo_ack})
+
+    def agregar(self, recibido):
+        mensaje = recibido.message
+        try:
+            codsint, detalles = decodificar_mensaje(mensaje)
+            tablas = transformar_recorrido(codsint, detalles, self.modo_paths, self.tolerancia_m)
+        except Exception as e:
+            # Un mensaje que no se puede leer nunca se podrá escribir: se confirma para no bloquear
+            print(f'Mensaje {mensaje.message_id} descartado: {e}')
+            self.subscriber.acknowledge(request={'subscription': self.subscription_path,
+                                                 'ack_ids': [recibido.ack_id]})
+            self.descartados += 1
+            contar('pubsub.descartados')
+            return
+        if self.inicio_lote is None:
+            self.inicio_lote = time.monotonic()
+        for table_id, rows in tablas.items():
+            self.filas.setdefault(table_id, []).extend(rows)
+        self.ack_ids.append(recibido.ack_id)
+        self.publicados.append(mensaje.publish_time.timestamp())
+
+    def lote_listo(self):
+        if not self.ack_ids:
+            return False
+        return len(self.ack_ids) >= self.max_mensajes or time.monotonic() - self.inicio_lote >= self.ventana
+
+    def escribir(self):
+        if not self.ack_ids:
+            return
+        # El índice es del lote: si la escritura falla, la reentrega no queda filtrada
+        indice = IndiceDeduplicacion()
+        self.extender(self.ack_ids)
+        try:
+            with span('lote.escritura'):
+                for table_id, rows in self.filas.items():
+                    self.carga.agregar(table_id, indice.filtrar(table_id, rows))
+                self.carga.cerrar()
+        except Exception as e:
+            print(f'Error al escribir un lote de {len(self.ack_ids)} mensajes, se liberan: {e}')
+            self.carga.descartar()
+            self.subscriber.modify_ack_deadline(request={'subscription': self.subscription_path,
+                                                         'ack_ids': self.ack_ids, 'ack_deadline_seconds': 0})
+            self.liberados += len(self.ack_ids)
+            contar('pubsub.liberados', len(self.ack_ids))
+            self._nuevo_lote()
+            return
+        disponible = time.time()
+        self.subscriber.acknowledge(request={'subscription': self.subscription_path, 'ack_ids': self.ack_ids})
+        latencias = [disponible - publicado for publicado in self.publicados]
+        self.latencias.extend(latencias)
+        for latencia in latencias:
+            observar('pubsub.latencia_extremo', latencia)
+        self.confirmados += len(self.ack_ids)
+        contar('pubsub.confirmados', len(self.ack_ids))
+        print(f'Lote de {len(self.ack_ids)} mensajes escrito, latencia máxima {max(latencias):.2f} s')
+        self._nuevo_lote()
+
+    def consumir(self, tiempo_maximo=TIEMPO_MAXIMO, max_vacios=MAX_PULLS_VACIOS):
+        fin = time.monotonic() + tiempo_maximo
+        vacios = 0
+        while time.monotonic() < fin and vacios < max_vacios:
+            # El pull no espera más allá de lo que le queda a la ventana del lote en curso
+            espera = self.ventana
+            if self.inicio_lote is not None:
+                espera = self.ventana - (time.monotonic() - self.inicio_lote)
+            recibidos = self._pull(max(1.0, min(espera, fin - time.monotonic())))
+            vacios = 0 if recibidos else vacios + 1
+            self.extender([recibido.ack_id for recibido in recibidos])
+            for recibido in recibidos:
+                self.agregar(recibido)
+            if self.lote_listo():
+                self.escribir()
+        self.escribir()
+        return self.resumen()
+
+    def resumen(self):
+        return {
+            'confirmados': self.confirmados,
+            'liberados': self.liberados,
+            'descartados': self.descartados,
+            'latencia_p50_s': round(percentil(self.latencias, 50), 3),
+            'latencia_p95_s': round(percentil(self.latencias, 95), 3),
+            'latencia_max_s': round(max(self.latencias, default=0.0), 3)
+        }
+
+@instrumentar('consume_daily_data')
+def consume_daily_data(request):
+    try:
+        client = bigquery_client()
+        dataset_id = 'transporte_publico'
+        bucket = storage_client().bucket('transporte-publico-red')
+        registro_esquemas(client, dataset_id, bucket).asegurar(
+            schemas, disenos, get_parametro(request, 'migrar_particiones', False, bool))
+
+        # El modo se fija para toda la invocación: load jobs por defecto (el volumen de la
+        # suscripción no se conoce de antemano); modo_carga=streaming si se necesita latencia mínima
+        carga = CargaPorLotes(client, dataset_id, schemas, modo=get_parametro(request, 'modo_carga', MODO_CARGA))
+        subscriber = subscriber_client()
+        consumidor = ConsumidorRecorridos(
+            subscriber,
+            subscriber.subscription_path(PROJECT_ID, get_parametro(request, 'suscripcion', SUBSCRIPTION_ID)),
+            carga,
+            modo_paths=get_parametro(request, 'modo_paths', MODO_PATHS),
+            tolerancia_m=get_parametro(request, 'tolerancia_m', TOLERANCIA_PATHS_M, float),
+            max_mensajes=max(1, get_parametro(request, 'max_mensajes_lote', MAX_MENSAJES_LOTE, int)),
+            ventana=get_parametro(request, 'ventana_lote', VENTANA_LOTE, float),
+            mensajes_por_pull=get_parametro(request, 'mensajes_por_pull', MENSAJES_POR_PULL, int),
+            plazo_ack=get_parametro(request, 'plazo_ack', PLAZO_ACK, int)
+        )
+        resumen = consumidor.consumir(
+            tiempo_maximo=get_parametro(request, 'tiempo_maximo', TIEMPO_MAXIMO, float),
+            max_vacios=get_parametro(request, 'max_pulls_vacios', MAX_PULLS_VACIOS, int)
+        )
+        print(f'Consumo terminado: {json.dumps(resumen)}')
+        print(f'Filas cargadas por tabla: {carga.cargadas}')
+        return f'Mensajes consumidos: {json.dumps(resumen)}'
+    except Exception as e:
+        print(f'Error al consumir los datos diarios: {e}')
+        return f'Error al consumir los datos diarios: {e}'
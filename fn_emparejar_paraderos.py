@@ -0,0 +1,177 @@
+# Importar paquetes necesarios
+# fn_emparejar_paraderos: enlaza los paraderos de red.cl con las paradas GTFS
+import numpy as np
+from google.cloud import bigquery
+from datetime import datetime
+from parametros import get_parametro
+from instrumentacion import instrumentar, contar, span
+from recursos import bigquery_client, storage_client
+from registro_esquemas import registro_esquemas, DisenoTabla
+from indice_espacial import IndiceGrilla
+from carga_bigquery import CargaPorLotes
+from delta_gtfs import tabla_incremental
+from manifiesto_cambios import ManifiestoCambios, RUTA_MANIFIESTO_TRANSFORMACION
+
+K_CERCANOS = 3
+RADIO_M = 150.0  # Distancia máxima para considerar una parada candidata
+ESCALA_DISTANCIA_M = 40.0  # A esta distancia la confianza por cercanía cae a ~37%
+PESO_CODIGO = 0.4  # Peso de la coincidencia del código del paradero con stop_code/stop_id
+EXPIRACION_MATCH_DIAS = 365  # Cada corrida vuelve a emparejar todos los paraderos
+
+schema_match = [
+    bigquery.SchemaField('paradero_id', 'INTEGER'),
+    bigquery.SchemaField('cod', 'STRING'),
+    bigquery.SchemaField('stop_id', 'STRING'),
+    bigquery.SchemaField('stop_code', 'STRING'),
+    bigquery.SchemaField('rango', 'INTEGER'),
+    bigquery.SchemaField('distancia_m', 'FLOAT'),
+    bigquery.SchemaField('confianza', 'FLOAT'),
+    bigquery.SchemaField('periodo_de_carga', 'STRING'),
+    bigquery.SchemaField('fecha_carga', 'DATE')
+]
+
+diseno_match = DisenoTabla(clustering=['paradero_id', 'stop_id'], expiracion_dias=EXPIRACION_MATCH_DIAS)
+
+# Los filtros por fecha_carga son constantes para que BigQuery pode particiones: los
+# paraderos vigentes de cada recorrido están desde la fecha de cambio más antigua del
+# manifiesto del transform, y las paradas GTFS en la última partición de stops
+QUERY_PARADEROS = """
+    SELECT paradero_id, ANY_VALUE(cod) AS cod, ANY_VALUE(lat) AS lat, ANY_VALUE(lon) AS lon
+    FROM `{dataset_id}.paraderos`
+    WHERE {filtro_fecha}lat IS NOT NULL AND lon IS NOT NULL
+    GROUP BY paradero_id
+"""
+
+QUERY_ULTIMA_PARTICION = """
+    SELECT MAX(partition_id) AS partition_id
+    FROM `{dataset_id}.INFORMATION_SCHEMA.PARTITIONS`
+    WHERE table_name = '{table_id}' AND partition_id NOT IN ('__NULL__', '__UNPARTITIONED__')
+"""
+
+QUERY_STOPS = """
+    SELECT stop_id, ANY_VALUE(stop_code) AS stop_code,
+           ANY_VALUE(stop_lat) AS stop_lat, ANY_VALUE(stop_lon) AS stop_lon
+    FROM `{dataset_id}.stops`
+    WHERE fecha_carga = DATE '{fecha_carga}'
+      AND stop_lat IS NOT NULL AND stop_lon IS NOT NULL
+    GROUP BY stop_id
+"""
+
+# Tabla stops aún sin particionar (migrar_particiones pendiente)
+QUERY_STOPS_SIN_PARTICION = """
+    SELECT stop_id, ANY_VALUE(stop_code) AS stop_code,
+           ANY_VALUE(stop_lat) AS stop_lat, ANY_VALUE(stop_lon) AS stop_lon
+    FROM `{dataset_id}.stops`
+    WHERE periodo_de_carga = (SELECT MAX(periodo_de_carga) FROM `{dataset_id}.stops`)
+      AND stop_lat IS NOT NULL AND stop_lon IS NOT NULL
+    GROUP BY stop_id
+"""
+
+# Con modo_historico=delta la versión vigente de cada parada está en stops_vigente
+QUERY_STOPS_VIGENTES = """
+    SELECT stop_id, ANY_VALUE(stop_code) AS stop_code,
+           ANY_VALUE(stop_lat) AS stop_lat, ANY_VALUE(stop_lon) AS stop_lon
+    FROM `{dataset_id}.stops_vigente`
+    WHERE stop_lat IS NOT NULL AND stop_lon IS NOT NULL
+    GROUP BY stop_id
+"""
+
+def ultima_particion(client, dataset_id, table_id):
+    # Fecha (YYYY-MM-DD) de la última partición de la tabla, o None si no está particionada
+    filas = list(client.query(QUERY_ULTIMA_PARTICION.format(dataset_id=dataset_id, table_id=table_id)).result())
+    contar('bigquery.llamadas')
+    particion = filas[0]['partition_id'] if filas else None
+    return f'{particion[:4]}-{particion[4:6]}-{particion[6:8]}' if particion else None
+
+def query_paraderos(dataset_id, bucket):
+    # Sin manifiesto (ninguna corrida del transform lo guardó aún) se lee la tabla completa
+    manifiesto = ManifiestoCambios(bucket, RUTA_MANIFIESTO_TRANSFORMACION)
+    desde = min((entrada['cambio'] for entrada in manifiesto.recorridos.values()), default=None)
+    # Las filas anteriores a la columna fecha_carga (tabla sin migrar) la tienen en NULL
+    filtro_fecha = f"(fecha_carga >= DATE '{desde}' OR fecha_carga IS NULL) AND " if desde else ''
+    return QUERY_PARADEROS.format(dataset_id=dataset_id, filtro_fecha=filtro_fecha)
+
+def query_stops(client, dataset_id, bucket):
+    if tabla_incremental(bucket, 'stops'):
+        return QUERY_STOPS_VIGENTES.format(dataset_id=dataset_id)
+    fecha_carga = ultima_particion(client, dataset_id, 'stops')
+    if fecha_carga is None:
+        return QUERY_STOPS_SIN_PARTICION.format(dataset_id=dataset_id)
+    return QUERY_STOPS.format(dataset_id=dataset_id, fecha_carga=fecha_carga)
+
+def confianza(distancias, coincide_codigo):
+    # Combina cercanía (decaimiento exponencial) y coincidencia de código, entre 0 y 1
+    return (1 - PESO_CODIGO) * np.exp(-distancias / ESCALA_DISTANCIA_M) + PESO_CODIGO * coincide_codigo
+
+def emparejar(paraderos, stops, k=K_CERCANOS, radio_m=RADIO_M):
+    # paraderos: filas con paradero_id, cod, lat, lon; stops: stop_id, stop_code, stop_lat, stop_lon
+    indice = IndiceGrilla([s['stop_lat'] for s in stops], [s['stop_lon'] for s in stops],
+                          celda_m=max(radio_m, 50.0))
+    codigos = np.array([str(s['stop_code'] or s['stop_id']).upper() for s in stops])
+    ids = np.array([str(s['stop_id']).upper() for s in stops])
+    rows = []
+    for paradero in paraderos:
+        candidatos, distancias = indice.k_cercanos(paradero['lat'], paradero['lon'], k, radio_max_m=radio_m)
+        if not len(candidatos):
+            continue
+        cod = str(paradero['cod'] or '').upper()
+        coincide = ((codigos[candidatos] == cod) | (ids[candidatos] == cod)).astype(np.float64)
+        puntajes = confianza(distancias, coincide)
+        # El rango sigue la confianza: una parada con el mismo código gana a una más cercana
+        orden = np.argsort(-puntajes, kind='stable')
+        candidatos, distancias, puntajes = candidatos[orden], distancias[orden], puntajes[orden]
+        for rango, (i, distancia, puntaje) in enumerate(zip(candidatos, distancias, puntajes), start=1):
+            stop = stops[i]
+            rows.append({
+                'paradero_id': paradero['paradero_id'],
+                'cod': paradero['cod'],
+                'stop_id': stop['stop_id'],
+                'stop_code': stop['stop_code'],
+                'rango': rango,
+                'distancia_m': round(float(distancia), 2),
+                'confianza': round(float(puntaje), 4)
+            })
+    return rows
+
+@instrumentar('match_paraderos_to_stops')
+def match_paraderos_to_stops(request):
+    try:
+        # Obtener la fecha actual
+        now = datetime.now()
+        periodo_de_carga = now.strftime('%Y-%m-%d')
+
+        # Inicializar el cliente de BigQuery
+        client = bigquery_client()
+        dataset_id = 'transporte_publico'
+        bucket = storage_client().bucket('transporte-publico-red')
+        registro_esquemas(client, dataset_id, bucket).asegurar(
+            {'paradero_stop_match': schema_match}, {'paradero_stop_match': diseno_match},
+            get_parametro(request, 'migrar_particiones', False, bool))
+
+        with span('bigquery.consulta'):
+            paraderos = [dict(row) for row in client.query(query_paraderos(dataset_id, bucket)).result()]
+            stops = [dict(row) for row in client.query(query_stops(client, dataset_id, bucket)).result()]
+        contar('bigquery.llamadas', 2)
+        if not paraderos or not stops:
+            return 'No hay paraderos o paradas GTFS para emparejar'
+
+        # k=1 deja solo la mejor parada por paradero
+        with span('emparejamiento'):
+            rows = emparejar(
+                paraderos, stops,
+                k=get_parametro(request, 'k', K_CERCANOS, int),
+                radio_m=get_parametro(request, 'radio_m', RADIO_M, float)
+            )
+        for row in rows:
+            row['periodo_de_carga'] = periodo_de_carga
+            row['fecha_carga'] = periodo_de_carga
+
+        carga = CargaPorLotes(client, dataset_id, {'paradero_stop_match': schema_match}, filas_esperadas=len(rows))
+        carga.agregar('paradero_stop_match', rows)
+        carga.cerrar()
+        print(f'{len(paraderos)} paraderos, {len(stops)} paradas, {len(rows)} emparejamientos')
+
+        return 'Emparejamiento de paraderos y paradas almacenado en BigQuery'
+    except Exception as e:
+        print(f'Error al emparejar paraderos: {e}')
+        return f'Error al emparejar paraderos: {e}'
@@ -1,51 +1,161 @@
 # Importar paquetes necesarios
-import requests
 import json
-from google.cloud import storage
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from parametros import get_parametro
+from instrumentacion import instrumentar, contar, span, propagar
+from recursos import storage_client
+from cliente_red import crear_cliente, get_servicios_diarios, get_detalles_recorrido
+from manifiesto_fallos import ruta_manifiesto, leer_fallidos, guardar_fallidos
+from snapshot_diario import EscritorSnapshot
+from checkpoint import Checkpoint, ruta_checkpoint, CADA_RECORRIDOS
+from manifiesto_cambios import ManifiestoCambios, hash_recorrido, RUTA_MANIFIESTO_TRANSFORMACION
+from fragmentacion import (URL_FUNCION_INGESTA, particionar, shard_de, etiqueta_shard, guardar_plan,
+                           escribir_marcador, invocar_shards)
 
-def get_servicios_diarios():
-    try:
-        url = 'https://www.red.cl/restservice_v2/rest/getservicios/all'
-        response = requests.get(url)
-        response.raise_for_status()  # Esto lanzará una excepción para códigos de estado 4xx/5xx
-        return response.json()  # Devuelve una lista de códigos de servicios
-    except requests.exceptions.RequestException as e:
-        print(f'Error al obtener servicios diarios: {e}')
-        return None
-
-def get_detalles_recorrido(codsint):
-    try:
-        url = f'https://www.red.cl/restservice_v2/rest/conocerecorrido?codsint={codsint}'
-        response = requests.get(url)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f'Error al obtener detalles del recorrido {codsint}: {e}')
-        return None
+def coordinar_shards(request, client, bucket, fecha, num_shards):
+    # Obtiene los servicios una sola vez y reparte la ingesta en `num_shards` invocaciones
+    cliente = crear_cliente(request)
+    servicios = get_servicios_diarios(cliente)
+    cliente.cerrar()
+    if not servicios:
+        return 'Error al obtener los servicios diarios'
+    particiones = particionar(servicios, num_shards)
+    guardar_plan(client, bucket, fecha, particiones)
+
+    # Los shards reciben los mismos parámetros (formato, concurrencia, forzar, ...) que el coordinador
+    parametros = dict(request.args) if getattr(request, 'args', None) else {}
+    body = request.get_json(silent=True) if hasattr(request, 'get_json') else None
+    if isinstance(body, dict):
+        parametros.update(body)
+    for nombre in ('modo', 'shard', 'num_shards', 'codsints', 'url_shard'):
+        parametros.pop(nombre, None)
+
+    url = get_parametro(request, 'url_shard', URL_FUNCION_INGESTA)
+    resultados = invocar_shards(url, particiones, parametros)
+    for shard, resultado in enumerate(resultados):
+        print(f'Shard {shard} ({len(particiones[shard])} recorridos): {resultado}')
+    errores = sum(1 for resultado in resultados if resultado.startswith('Error'))
+    if errores:
+        return f'{errores} de {num_shards} shards terminaron con error'
+    return f'Datos diarios obtenidos en {num_shards} shards'
 
+@instrumentar('get_daily_data')
 def get_daily_data(request):
     try:
         # Obtener la fecha actual
         now = datetime.now()
         fecha = now.strftime('%Y-%m-%d')
 
-        servicios = get_servicios_diarios()
-        if not servicios:
-            return 'Error al obtener los servicios diarios'
+        # Cliente HTTP con reintentos y límites configurables (concurrencia=1 equivale al modo secuencial)
+        cliente = crear_cliente(request)
 
-        client = storage.Client()
+        client = storage_client()
         bucket = client.bucket('transporte-publico-red')
 
-        for codsint in servicios:  # Recorrer directamente la lista de códigos
-            detalles = get_detalles_recorrido(codsint)
-            if detalles:
-                # Crear un archivo separado para cada recorrido
-                blob = bucket.blob(f'datos_diarios/{fecha}/{codsint}.json')
-                blob.upload_from_string(json.dumps(detalles), content_type='application/json')
-            else:
-                print(f'No se pudieron obtener los detalles para el recorrido {codsint}')
+        # modo=coordinador reparte el trabajo en num_shards invocaciones paralelas;
+        # un shard recibe shard/num_shards y opcionalmente su lista de codsints
+        num_shards = get_parametro(request, 'num_shards', 1, int)
+        if get_parametro(request, 'modo', 'directo') == 'coordinador':
+            cliente.cerrar()
+            return coordinar_shards(request, client, bucket, fecha, max(1, num_shards))
+        shard = get_parametro(request, 'shard', None, int)
+        etiqueta = etiqueta_shard(shard, num_shards) if shard is not None else None
+        ruta_fallidos = ruta_manifiesto('datos_diarios', fecha, etiqueta)
+        codsints = get_parametro(request, 'codsints', None, list)
+
+        if get_parametro(request, 'solo_fallidos', False, bool):
+            # Solo se vuelven a consultar los recorridos que fallaron en la ejecución anterior
+            servicios = leer_fallidos(bucket, ruta_fallidos)
+            if not servicios:
+                return 'No hay recorridos fallidos pendientes'
+        else:
+            servicios = codsints or get_servicios_diarios(cliente)
+            if not servicios:
+                return 'Error al obtener los servicios diarios'
+            if shard is not None and not codsints:
+                servicios = [codsint for codsint in servicios if shard_de(codsint, num_shards) == shard]
+
+        # Punto de control del día (por shard): una reinvocación tras un timeout solo
+        # consulta los recorridos que no quedaron guardados (reiniciar=true parte de cero)
+        proceso = f'in-{etiqueta}' if etiqueta else 'in'
+        checkpoint = Checkpoint(bucket, ruta_checkpoint('datos_diarios', fecha, proceso),
+                                get_parametro(request, 'reiniciar', False, bool))
+        servicios = checkpoint.pendientes(servicios)
+        if not servicios:
+            cliente.cerrar()
+            if shard is not None:
+                escribir_marcador(bucket, fecha, shard, num_shards, {'recorridos': 0, 'fallidos': 0})
+            return 'Todos los recorridos del día ya estaban almacenados'
+
+        # formato=objetos: un JSON por recorrido; formato=snapshot: NDJSON comprimido por fragmento
+        formato = get_parametro(request, 'formato', 'objetos')
+        fragmentos = get_parametro(request, 'fragmentos', 1, int)
+        # Cada invocación usa su propio token en los nombres para no pisar fragmentos ya cerrados
+        token = uuid.uuid4().hex[:8]
+
+        # Los recorridos cuyo contenido no cambió no se vuelven a subir (forzar=true sube todo).
+        # Se compara con el manifiesto del transform, que registra un hash solo después de
+        # cargarlo en BigQuery: un recorrido subido pero nunca cargado se vuelve a subir.
+        # La ingesta solo lo lee; no registra hashes propios.
+        forzar = get_parametro(request, 'forzar', False, bool)
+        manifiesto = ManifiestoCambios(bucket, RUTA_MANIFIESTO_TRANSFORMACION)
+
+        def procesar_recorrido(codsint, snapshot):
+            with span('recorrido', codsint):
+                with span('red.recorrido'):
+                    detalles = get_detalles_recorrido(cliente, codsint)
+                if not detalles:
+                    print(f'No se pudieron obtener los detalles para el recorrido {codsint}')
+                    contar('recorridos.fallidos')
+                    return False
+                hash_actual = hash_recorrido(detalles)
+                if not forzar and not manifiesto.cambio(codsint, hash_actual):
+                    contar('recorridos.sin_cambios')
+                    return True
+                with span('gcs.escritura'):
+                    if snapshot:
+                        # Se escribe en la subida en curso mientras siguen las descargas
+                        snapshot.escribir(codsint, detalles)
+                    else:
+                        # Crear un archivo separado para cada recorrido
+                        datos = json.dumps(detalles)
+                        blob = bucket.blob(f'datos_diarios/{fecha}/{codsint}.json')
+                        blob.upload_from_string(datos, content_type='application/json')
+                        contar('gcs.bytes_subidos', len(datos))
+                contar('recorridos.guardados')
+                return True
+
+        # Se avanza por bloques: al cerrar cada bloque sus fragmentos de snapshot quedan
+        # confirmados en GCS y recién entonces se marcan en el punto de control
+        cada = max(1, get_parametro(request, 'cada', CADA_RECORRIDOS, int))
+        resultados = []
+        with ThreadPoolExecutor(max_workers=cliente.concurrencia) as executor:
+            for bloque, inicio in enumerate(range(0, len(servicios), cada)):
+                pendientes = servicios[inicio:inicio + cada]
+                snapshot = None
+                if formato == 'snapshot':
+                    etiqueta_bloque = '-'.join(p for p in (etiqueta, token, f'{bloque:03d}') if p)
+                    snapshot = EscritorSnapshot(bucket, fecha, fragmentos, etiqueta_bloque)
+                resultados_bloque = list(executor.map(propagar(lambda c: procesar_recorrido(c, snapshot)),
+                                                      pendientes))
+                if snapshot:
+                    with span('gcs.cierre_snapshot'):
+                        snapshot.cerrar()
+                checkpoint.marcar(c for c, ok in zip(pendientes, resultados_bloque) if ok)
+                checkpoint.guardar()
+                resultados.extend(resultados_bloque)
+        cliente.cerrar()
+
+        fallidos = [codsint for codsint, ok in zip(servicios, resultados) if not ok]
+        guardar_fallidos(bucket, ruta_fallidos, fallidos)
+        if shard is not None:
+            # El transform solo procesa el día cuando todos los shards dejaron su marcador
+            escribir_marcador(bucket, fecha, shard, num_shards,
+                              {'recorridos': len(servicios), 'fallidos': len(fallidos)})
 
+        print(f'Recorridos almacenados: {len(servicios) - len(fallidos)} de {len(servicios)}')
         return 'Datos diarios obtenidos y almacenados en Cloud Storage'
     except Exception as e:
         print(f'Error en el procesamiento de datos diarios: {e}')
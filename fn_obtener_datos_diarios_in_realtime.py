@@ -1,61 +1,155 @@
 # Importar paquetes necesarios
 # fn_obtener_datos_diarios_in_realtime
-import requests
 import json
-from google.cloud import pubsub_v1
+import gzip
+import threading
+import time
+from collections import deque
 from datetime import datetime
+from parametros import get_parametro
+from instrumentacion import instrumentar, contar, observar, propagar
+from cliente_red import crear_cliente, get_servicios_diarios, get_detalles_recorrido
+from manifiesto_fallos import ruta_manifiesto, leer_fallidos, guardar_fallidos
+from recursos import publisher_client, storage_client
 
-def get_servicios_diarios():
-    try:
-        url = 'https://www.red.cl/restservice_v2/rest/getservicios/all'
-        response = requests.get(url)
-        response.raise_for_status()  # Esto lanzará una excepción para códigos de estado 4xx/5xx
-        return response.json()  # Devuelve una lista de códigos de servicios
-    except requests.exceptions.RequestException as e:
-        print(f'Error al obtener servicios diarios: {e}')
-        return None
-
-def get_detalles_recorrido(codsint):
-    try:
-        url = f'https://www.red.cl/restservice_v2/rest/conocerecorrido?codsint={codsint}'
-        response = requests.get(url)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f'Error al obtener detalles del recorrido {codsint}: {e}')
-        return None
+PROJECT_ID = "eva-2-duocuc-clk"  # Reemplaza con tu ID de proyecto
+TOPIC_ID = "get_daily_data"  # Reemplaza con tu ID de topic
 
-def publish_to_pubsub(data):
-    project_id = "eva-2-duocuc-clk"  # Reemplaza con tu ID de proyecto
-    topic_id = "get_daily_data"  # Reemplaza con tu ID de topic
+# Configuración por defecto de los lotes de publicación
+MAX_MENSAJES_LOTE = 100
+MAX_BYTES_LOTE = 5 * 1024 * 1024  # Pub/Sub acepta hasta 10 MB por petición
+MAX_LATENCIA_LOTE = 0.05  # Segundos que se espera para completar un lote
+REINTENTOS_PUBLICACION = 3
+MAX_COLA_REINTENTOS = 200  # Mensajes guardados en memoria para reintentar
 
-    publisher = pubsub_v1.PublisherClient()
-    topic_path = publisher.topic_path(project_id, topic_id)
+class PublicadorRecorridos:
+    # El PublisherClient se comparte entre invocaciones (uno por configuración de lotes);
+    # los mensajes se agrupan y se publican en segundo plano. Los futures de esta
+    # invocación se esperan una sola vez al final.
+    def __init__(self, max_mensajes=MAX_MENSAJES_LOTE, max_bytes=MAX_BYTES_LOTE,
+                 max_latencia=MAX_LATENCIA_LOTE, comprimir=False, ordenar=False,
+                 reintentos=REINTENTOS_PUBLICACION, max_cola_reintentos=MAX_COLA_REINTENTOS):
+        # Con ordering keys cada codsint forma su propio lote, por eso es opcional
+        self.publisher = publisher_client(max_mensajes, max_bytes, max_latencia, ordenar)
+        self.topic_path = self.publisher.topic_path(PROJECT_ID, TOPIC_ID)
+        self.comprimir = comprimir
+        self.ordenar = ordenar
+        self.reintentos = reintentos
+        self.lock = threading.Lock()
+        self.pendientes = set()
+        self.cola_reintentos = deque()
+        self.max_cola_reintentos = max_cola_reintentos
+        self.publicados = 0
+        self.fallidos = []
 
-    try:
+    def publicar(self, codsint, data):
         message = json.dumps(data).encode("utf-8")
-        future = publisher.publish(topic_path, message)
-        print(f'Published message to {topic_path}: {future.result()}')
-    except Exception as e:
-        print(f'Error publishing message to Pub/Sub: {e}')
+        attrs = {'codsint': str(codsint)}
+        if self.comprimir:
+            message = gzip.compress(message)
+            attrs['content_encoding'] = 'gzip'
+        contar('pubsub.bytes', len(message))
+        self._enviar(codsint, message, attrs, 0)
+
+    def _enviar(self, codsint, message, attrs, intento):
+        ordering_key = str(codsint) if self.ordenar else ''
+        contar('pubsub.llamadas')
+        enviado = time.perf_counter()
+        future = self.publisher.publish(self.topic_path, message, ordering_key=ordering_key, **attrs)
+        with self.lock:
+            self.pendientes.add(future)
+        future.add_done_callback(
+            propagar(lambda f: self._al_terminar(f, codsint, message, attrs, intento, enviado)))
+
+    def _al_terminar(self, future, codsint, message, attrs, intento, enviado):
+        error = future.exception()
+        observar('pubsub.publicacion', time.perf_counter() - enviado)
+        with self.lock:
+            self.pendientes.discard(future)
+            if error is None:
+                self.publicados += 1
+                return
+            # La cola de reintentos es acotada: si está llena el recorrido queda como fallido
+            if intento < self.reintentos and len(self.cola_reintentos) < self.max_cola_reintentos:
+                contar('pubsub.reintentos')
+                self.cola_reintentos.append((codsint, message, attrs, intento + 1))
+            else:
+                contar('pubsub.fallos')
+                print(f'Error publishing message to Pub/Sub ({codsint}): {error}')
+                self.fallidos.append(codsint)
+
+    def esperar(self):
+        # Espera todos los futures y republica los fallidos hasta agotar la cola
+        while True:
+            with self.lock:
+                pendientes = list(self.pendientes)
+            for future in pendientes:
+                try:
+                    future.result()
+                except Exception:
+                    pass  # El callback ya clasificó el error
+            with self.lock:
+                if self.pendientes:
+                    continue
+                if not self.cola_reintentos:
+                    break
+                reintentos = list(self.cola_reintentos)
+                self.cola_reintentos.clear()
+            time.sleep(min(2 ** reintentos[0][3] * 0.1, 5))
+            for codsint, message, attrs, intento in reintentos:
+                if self.ordenar:
+                    # Un error con ordering key pausa esa key hasta reanudarla
+                    self.publisher.resume_publish(self.topic_path, str(codsint))
+                self._enviar(codsint, message, attrs, intento)
+        print(f'Published {self.publicados} messages to {self.topic_path}, {len(self.fallidos)} failed')
+        return self.fallidos
+
+def crear_publicador(request):
+    return PublicadorRecorridos(
+        max_mensajes=get_parametro(request, 'max_mensajes_lote', MAX_MENSAJES_LOTE, int),
+        max_bytes=get_parametro(request, 'max_bytes_lote', MAX_BYTES_LOTE, int),
+        max_latencia=get_parametro(request, 'max_latencia_lote', MAX_LATENCIA_LOTE, float),
+        comprimir=get_parametro(request, 'comprimir', False, bool),
+        ordenar=get_parametro(request, 'ordenar', False, bool),
+        max_cola_reintentos=get_parametro(request, 'max_cola_reintentos', MAX_COLA_REINTENTOS, int),
+    )
 
+@instrumentar('get_daily_data_realtime')
 def get_daily_data(request):
     try:
         # Obtener la fecha actual
         now = datetime.now()
         fecha = now.strftime('%Y-%m-%d')
 
-        servicios = get_servicios_diarios()
-        if not servicios:
-            return 'Error al obtener los servicios diarios'
+        cliente = crear_cliente(request)
+        publicador = crear_publicador(request)
 
+        bucket = storage_client().bucket('transporte-publico-red')
+        ruta_fallidos = ruta_manifiesto('datos_diarios_realtime', fecha)
+
+        if get_parametro(request, 'solo_fallidos', False, bool):
+            servicios = leer_fallidos(bucket, ruta_fallidos)
+            if not servicios:
+                return 'No hay recorridos fallidos pendientes'
+        else:
+            servicios = get_servicios_diarios(cliente)
+            if not servicios:
+                return 'Error al obtener los servicios diarios'
+
+        fallidos = []
         for codsint in servicios:  # Recorrer directamente la lista de códigos
-            detalles = get_detalles_recorrido(codsint)
+            detalles = get_detalles_recorrido(cliente, codsint)
             if detalles:
-                # Publicar detalles al Pub/Sub
-                publish_to_pubsub(detalles)
+                # Publicar detalles al Pub/Sub sin esperar la confirmación
+                publicador.publicar(codsint, detalles)
             else:
                 print(f'No se pudieron obtener los detalles para el recorrido {codsint}')
+                fallidos.append(codsint)
+        cliente.cerrar()
+
+        # Esperar todas las publicaciones una sola vez al final
+        fallidos.extend(publicador.esperar())
+        guardar_fallidos(bucket, ruta_fallidos, fallidos)
 
         return 'Datos diarios obtenidos y publicados en Pub/Sub'
     except Exception as e:
@@ -1,39 +1,269 @@
 import json
-from google.cloud import storage, bigquery
-from datetime import datetime
+from google.cloud import bigquery
+from datetime import datetime, date
 import os
+from snapshot_diario import listar_fragmentos, leer_lineas_snapshot, decodificar_linea, es_archivo_snapshot
+from carga_bigquery import CargaPorLotes, MODO_CARGA
+from parametros import get_parametro
+from instrumentacion import instrumentar, contar, span
+from registro_esquemas import registro_esquemas, DisenoTabla
+from recursos import bigquery_client, storage_client as obtener_storage_client
+from pipeline import Etapa, ejecutar_pipeline, CAPACIDAD_COLA
+from fragmentacion import shards_pendientes
+from checkpoint import Checkpoint, ruta_checkpoint, CADA_RECORRIDOS
+from manifiesto_cambios import ManifiestoCambios, hash_recorrido, RUTA_MANIFIESTO_TRANSFORMACION
+from indice_deduplicacion import IndiceDeduplicacion
 
-def create_table_if_not_exists(client, dataset_id, table_id, schema):
-    dataset_ref = client.dataset(dataset_id)
-    table_ref = dataset_ref.table(table_id)
-    try:
-        client.get_table(table_ref)
-        print(f"Table {table_id} already exists.")
-    except:
-        table = bigquery.Table(table_ref, schema=schema)
-        table = client.create_table(table)
-        print(f"Table {table_id} created.")
-
-def upload_data_to_bigquery(client, dataset_id, table_id, rows_to_insert):
-    if not rows_to_insert:
-        print(f"No rows to insert for table {table_id}")
-        return
-    
-    table_ref = client.dataset(dataset_id).table(table_id)
-    errors = client.insert_rows_json(table_ref, rows_to_insert)
-    if errors != []:
-        print(f"Errors occurred while inserting rows into table {table_id}: {errors}")
-
-def remove_duplicates(rows, key):
-    seen = set()
-    unique_rows = []
-    for row in rows:
-        identifier = row[key]
-        if identifier not in seen:
-            unique_rows.append(row)
-            seen.add(identifier)
-    return unique_rows
+# Concurrencia por defecto de cada etapa del pipeline
+HILOS_DESCARGA = 16
+HILOS_TRANSFORMACION = 2
+FILAS_POR_CARGA = 200000  # Acota el buffer NDJSON de cada tabla
+MODO_PATHS = 'puntos'  # puntos | simplificado | polilinea
+TOLERANCIA_PATHS_M = 5.0  # Tolerancia de la simplificación en metros
+
+# Definir los esquemas para las tablas
+schemas = {
+    'negocios': [
+        bigquery.SchemaField('negocio_id', 'INTEGER'),
+        bigquery.SchemaField('nombre', 'STRING'),
+        bigquery.SchemaField('color', 'STRING'),
+        bigquery.SchemaField('url', 'STRING'),
+        bigquery.SchemaField('fecha_carga', 'DATE')  # Día de la carga (partición)
+    ],
+    'horarios': [
+        bigquery.SchemaField('recorrido_id', 'STRING'),
+        bigquery.SchemaField('ida_o_regreso', 'STRING'),
+        bigquery.SchemaField('tipoDia', 'STRING'),
+        bigquery.SchemaField('inicio', 'STRING'),
+        bigquery.SchemaField('fin', 'STRING'),
+        bigquery.SchemaField('fecha_carga', 'DATE')
+    ],
+    'paths': [
+        bigquery.SchemaField('recorrido_id', 'STRING'),
+        bigquery.SchemaField('ida_o_regreso', 'STRING'),
+        bigquery.SchemaField('lat', 'FLOAT'),
+        bigquery.SchemaField('lon', 'FLOAT'),
+        bigquery.SchemaField('secuencia', 'INTEGER'),  # Posición del punto en el path original
+        bigquery.SchemaField('fecha_carga', 'DATE')
+    ],
+    'paths_polilinea': [
+        bigquery.SchemaField('recorrido_id', 'STRING'),
+        bigquery.SchemaField('ida_o_regreso', 'STRING'),
+        bigquery.SchemaField('polilinea', 'STRING'),  # Polilínea codificada (precisión 1e-5)
+        bigquery.SchemaField('geografia', 'GEOGRAPHY'),
+        bigquery.SchemaField('num_puntos', 'INTEGER'),
+        bigquery.SchemaField('fecha_carga', 'DATE')
+    ],
+    'paraderos': [
+        bigquery.SchemaField('recorrido_id', 'STRING'),
+        bigquery.SchemaField('ida_o_regreso', 'STRING'),
+        bigquery.SchemaField('paradero_id', 'INTEGER'),
+        bigquery.SchemaField('cod', 'STRING'),
+        bigquery.SchemaField('num', 'INTEGER'),
+        bigquery.SchemaField('lat', 'FLOAT'),
+        bigquery.SchemaField('lon', 'FLOAT'),
+        bigquery.SchemaField('name', 'STRING'),
+        bigquery.SchemaField('comuna', 'STRING'),
+        bigquery.SchemaField('type', 'INTEGER'),
+        bigquery.SchemaField('servicios', 'STRING'),
+        bigquery.SchemaField('stopId', 'INTEGER'),
+        bigquery.SchemaField('stopCoordenadaX', 'FLOAT'),
+        bigquery.SchemaField('stopCoordenadaY', 'FLOAT'),
+        bigquery.SchemaField('eje', 'STRING'),
+        bigquery.SchemaField('codSimt', 'STRING'),
+        bigquery.SchemaField('distancia', 'FLOAT'),
+        bigquery.SchemaField('fecha_carga', 'DATE')
+    ],
+    'servicios': [
+        bigquery.SchemaField('paradero_id', 'INTEGER'),
+        bigquery.SchemaField('id', 'INTEGER'),
+        bigquery.SchemaField('cod', 'STRING'),
+        bigquery.SchemaField('destino', 'STRING'),
+        bigquery.SchemaField('orden', 'INTEGER'),
+        bigquery.SchemaField('color', 'STRING'),
+        bigquery.SchemaField('negocio_nombre', 'STRING'),
+        bigquery.SchemaField('negocio_color', 'STRING'),
+        bigquery.SchemaField('recorrido_destino', 'STRING'),
+        bigquery.SchemaField('itinerario', 'BOOLEAN'),
+        bigquery.SchemaField('codigo', 'STRING'),
+        bigquery.SchemaField('fecha_carga', 'DATE')
+    ]
+}
+
+# Partición diaria por fecha_carga y clustering por las claves de consulta. Sin vencimiento:
+# un recorrido sin cambios no se vuelve a cargar, así que su versión vigente puede estar
+# en una partición antigua
+disenos = {
+    'negocios': DisenoTabla(clustering=['negocio_id']),
+    'horarios': DisenoTabla(clustering=['recorrido_id']),
+    'paths': DisenoTabla(clustering=['recorrido_id', 'ida_o_regreso']),
+    'paths_polilinea': DisenoTabla(clustering=['recorrido_id', 'ida_o_regreso']),
+    'paraderos': DisenoTabla(clustering=['paradero_id', 'recorrido_id']),
+    'servicios': DisenoTabla(clustering=['paradero_id']),
+}
+
+def listar_blobs_recorridos(storage_client, bucket, fecha):
+    # El listado se recorre por páginas a medida que el pipeline consume
+    prefix = f'datos_diarios/{fecha}/'
+    for blob in storage_client.list_blobs(bucket, prefix=prefix):
+        if blob.name.endswith('.json') and not es_archivo_snapshot(blob.name):
+            yield blob
+
+def descargar_recorrido(blob):
+    recorrido_id = os.path.splitext(os.path.basename(blob.name))[0]
+    texto = blob.download_as_text()
+    contar('gcs.bytes_descargados', len(texto))
+    return recorrido_id, texto
+
+def etapas_recorridos(storage_client, bucket, fecha, preparar, hilos_descarga, hilos_transformacion,
+                      pendiente=None):
+    # Si el día se guardó como snapshot consolidado, la fuente ya es una descarga
+    # en streaming y solo queda parsear; si no, se descargan los JSON en paralelo.
+    # `pendiente(recorrido_id)` permite saltarse los JSON antes de descargarlos.
+    if listar_fragmentos(storage_client, bucket, fecha):
+        fuente = leer_lineas_snapshot(storage_client, bucket, fecha)
+
+        def transformacion(linea):
+            with span('json.parse'):
+                recorrido = decodificar_linea(linea)
+            return preparar(*recorrido)
+        return fuente, [Etapa('transformacion', transformacion, hilos_transformacion)]
+    fuente = listar_blobs_recorridos(storage_client, bucket, fecha)
+    if pendiente:
+        fuente = (blob for blob in fuente
+                  if pendiente(os.path.splitext(os.path.basename(blob.name))[0]))
+
+    def transformacion(item):
+        with span('json.parse'):
+            json_data = json.loads(item[1])
+        return preparar(item[0], json_data)
+    return fuente, [Etapa('descarga', descargar_recorrido, hilos_descarga),
+                    Etapa('transformacion', transformacion, hilos_transformacion)]
+
+def transformar_paraderos(recorrido_id, ida_o_regreso, paraderos):
+    paraderos_rows = []
+    servicios_rows = []
+    for paradero in paraderos:
+        row = {
+            'recorrido_id': recorrido_id,
+            'ida_o_regreso': ida_o_regreso,
+            'paradero_id': paradero.get('id'),
+            'cod': paradero.get('cod'),
+            'num': paradero.get('num'),
+            'lat': paradero.get('pos')[0],
+            'lon': paradero.get('pos')[1],
+            'name': paradero.get('name'),
+            'comuna': paradero.get('comuna'),
+            'type': paradero.get('type'),
+            'servicios': json.dumps(paradero.get('servicios')),
+            'stopId': paradero['stop']['stopId'],
+            'stopCoordenadaX': float(paradero['stop']['stopCoordenadaX']),
+            'stopCoordenadaY': float(paradero['stop']['stopCoordenadaY']),
+            'eje': paradero.get('eje'),
+            'codSimt': paradero.get('codSimt'),
+            'distancia': paradero.get('distancia')
+        }
+        paraderos_rows.append(row)
+
+        # Procesar servicios
+        for servicio in paradero.get('servicios', []):
+            servicio_row = {
+                'paradero_id': paradero.get('id'),
+                'id': servicio.get('id'),
+                'cod': servicio.get('cod'),
+                'destino': servicio.get('destino'),
+                'orden': servicio.get('orden'),
+                'color': servicio.get('color'),
+                'negocio_nombre': servicio['negocio'].get('nombre'),
+                'negocio_color': servicio['negocio'].get('color'),
+                'recorrido_destino': servicio['recorrido'].get('destino'),
+                'itinerario': servicio.get('itinerario'),
+                'codigo': servicio.get('codigo')
+            }
+            servicios_rows.append(servicio_row)
+    return paraderos_rows, servicios_rows
+
+def transformar_polilinea(recorrido_id, ida_o_regreso, path):
+    # Un path completo en una sola fila: polilínea codificada y LINESTRING
+    if len(path) < 2:
+        return []
+    from polilineas import codificar, linestring_wkt
+    return [{
+        'recorrido_id': recorrido_id,
+        'ida_o_regreso': ida_o_regreso,
+        'polilinea': codificar(path),
+        'geografia': linestring_wkt(path),
+        'num_puntos': len(path)
+    }]
+
+def transformar_recorrido(recorrido_id, json_data, modo_paths=MODO_PATHS, tolerancia_m=TOLERANCIA_PATHS_M,
+                          fecha_carga=None):
+    # Aplana el JSON de un recorrido en filas por tabla; los duplicados se
+    # eliminan después con el índice de toda la corrida
+    fecha_carga = fecha_carga or date.today().isoformat()
+    tablas = {table_id: [] for table_id in schemas}
+
+    negocio = json_data.get('negocio', {})
+
+    # Negocios
+    negocio_row = {
+        'negocio_id': negocio.get('id'),
+        'nombre': negocio.get('nombre'),
+        'color': negocio.get('color'),
+        'url': negocio.get('url')
+    }
+    tablas['negocios'].append(negocio_row)
 
+    for ida_o_regreso in ('ida', 'regreso'):
+        sentido = json_data.get(ida_o_regreso, {})
+
+        # Horarios
+        horarios_rows = []
+        for horario in sentido.get('horarios', []):
+            row = {
+                'recorrido_id': recorrido_id,
+                'ida_o_regreso': ida_o_regreso,
+                'tipoDia': horario.get('tipoDia'),
+                'inicio': horario.get('inicio'),
+                'fin': horario.get('fin')
+            }
+            horarios_rows.append(row)
+        tablas['horarios'].extend(horarios_rows)
+
+        # Paths
+        path = sentido.get('path', [])
+        if modo_paths == 'polilinea':
+            tablas['paths_polilinea'].extend(transformar_polilinea(recorrido_id, ida_o_regreso, path))
+        else:
+            indices = range(len(path))
+            if modo_paths == 'simplificado' and path:
+                from polilineas import simplificar
+                indices = simplificar(path, tolerancia_m)
+            paths_rows = []
+            for i in indices:
+                point = path[i]
+                row = {
+                    'recorrido_id': recorrido_id,
+                    'ida_o_regreso': ida_o_regreso,
+                    'lat': point[0],
+                    'lon': point[1],
+                    'secuencia': int(i)
+                }
+                paths_rows.append(row)
+            tablas['paths'].extend(paths_rows)
+
+        # Paraderos y servicios
+        paraderos_rows, servicios_rows = transformar_paraderos(
+            recorrido_id, ida_o_regreso, sentido.get('paraderos', []))
+        tablas['paraderos'].extend(paraderos_rows)
+        tablas['servicios'].extend(servicios_rows)
+
+    for rows in tablas.values():
+        for row in rows:
+            row['fecha_carga'] = fecha_carga
+    return tablas
+
+@instrumentar('process_json_to_bigquery')
 def process_json_to_bigquery(request):
     try:
         # Obtener la fecha actual
@@ -42,244 +272,108 @@ def process_json_to_bigquery(request):
         periodo_de_carga = fecha  # Asumimos que el periodo de carga es la fecha actual
         
         # Inicializar el cliente de BigQuery
-        client = bigquery.Client()
+        client = bigquery_client()
 
         # Especificar el ID del dataset
         dataset_id = 'transporte_publico'
 
-        # Definir los esquemas para las tablas
-        schemas = {
-            'negocios': [
-                bigquery.SchemaField('negocio_id', 'INTEGER'),
-                bigquery.SchemaField('nombre', 'STRING'),
-                bigquery.SchemaField('color', 'STRING'),
-                bigquery.SchemaField('url', 'STRING')
-            ],
-            'horarios': [
-                bigquery.SchemaField('recorrido_id', 'STRING'),
-                bigquery.SchemaField('ida_o_regreso', 'STRING'),
-                bigquery.SchemaField('tipoDia', 'STRING'),
-                bigquery.SchemaField('inicio', 'STRING'),
-                bigquery.SchemaField('fin', 'STRING')
-            ],
-            'paths': [
-                bigquery.SchemaField('recorrido_id', 'STRING'),
-                bigquery.SchemaField('ida_o_regreso', 'STRING'),
-                bigquery.SchemaField('lat', 'FLOAT'),
-                bigquery.SchemaField('lon', 'FLOAT')
-            ],
-            'paraderos': [
-                bigquery.SchemaField('recorrido_id', 'STRING'),
-                bigquery.SchemaField('ida_o_regreso', 'STRING'),
-                bigquery.SchemaField('paradero_id', 'INTEGER'),
-                bigquery.SchemaField('cod', 'STRING'),
-                bigquery.SchemaField('num', 'INTEGER'),
-                bigquery.SchemaField('lat', 'FLOAT'),
-                bigquery.SchemaField('lon', 'FLOAT'),
-                bigquery.SchemaField('name', 'STRING'),
-                bigquery.SchemaField('comuna', 'STRING'),
-                bigquery.SchemaField('type', 'INTEGER'),
-                bigquery.SchemaField('servicios', 'STRING'),
-                bigquery.SchemaField('stopId', 'INTEGER'),
-                bigquery.SchemaField('stopCoordenadaX', 'FLOAT'),
-                bigquery.SchemaField('stopCoordenadaY', 'FLOAT'),
-                bigquery.SchemaField('eje', 'STRING'),
-                bigquery.SchemaField('codSimt', 'STRING'),
-                bigquery.SchemaField('distancia', 'FLOAT')
-            ],
-            'servicios': [
-                bigquery.SchemaField('paradero_id', 'INTEGER'),
-                bigquery.SchemaField('id', 'INTEGER'),
-                bigquery.SchemaField('cod', 'STRING'),
-                bigquery.SchemaField('destino', 'STRING'),
-                bigquery.SchemaField('orden', 'INTEGER'),
-                bigquery.SchemaField('color', 'STRING'),
-                bigquery.SchemaField('negocio_nombre', 'STRING'),
-                bigquery.SchemaField('negocio_color', 'STRING'),
-                bigquery.SchemaField('recorrido_destino', 'STRING'),
-                bigquery.SchemaField('itinerario', 'BOOLEAN'),
-                bigquery.SchemaField('codigo', 'STRING')
-            ]
-        }
-
-        # Crear tablas si no existen
-        for table_id, schema in schemas.items():
-            create_table_if_not_exists(client, dataset_id, table_id, schema)
+        # Las filas de todos los recorridos se acumulan y se cargan con un job por tabla.
+        # modo_carga=streaming usa insert_rows_json; auto usa load jobs porque el total
+        # de filas de la corrida no se conoce de antemano.
+        carga = CargaPorLotes(
+            client, dataset_id, schemas,
+            modo=get_parametro(request, 'modo_carga', MODO_CARGA),
+            max_filas=get_parametro(request, 'filas_por_carga', FILAS_POR_CARGA, int)
+        )
 
         # Inicializar el cliente de Cloud Storage
-        storage_client = storage.Client()
+        storage_client = obtener_storage_client()
         bucket = storage_client.bucket('transporte-publico-red')
-        prefix = f'datos_diarios/{fecha}/'
-
-        # Listar los blobs en la carpeta del día actual
-        blobs = list(storage_client.list_blobs(bucket, prefix=prefix))
-
-        # Procesar y subir cada archivo JSON
-        for blob in blobs:
-            recorrido_id = os.path.splitext(os.path.basename(blob.name))[0]
-            content = blob.download_as_text()
-            json_data = json.loads(content)
-
-            negocio = json_data.get('negocio', {})
-            ida = json_data.get('ida', {})
-            regreso = json_data.get('regreso', {})
-
-            # Negocios
-            negocio_row = {
-                'negocio_id': negocio.get('id'),                    
-                'nombre': negocio.get('nombre'),
-                'color': negocio.get('color'),
-                'url': negocio.get('url')
-            }
-            negocio_rows = [negocio_row]
-            negocio_rows = remove_duplicates(negocio_rows, 'negocio_id')
-            upload_data_to_bigquery(client, dataset_id, 'negocios', negocio_rows)
 
-            # Horarios de ida
-            horarios_rows = []
-            for horario in ida.get('horarios', []):
-                row = {
-                    'recorrido_id': recorrido_id,
-                    'ida_o_regreso': 'ida',
-                    'tipoDia': horario.get('tipoDia'),
-                    'inicio': horario.get('inicio'),
-                    'fin': horario.get('fin')
-                }
-                horarios_rows.append(row)
-            horarios_rows = remove_duplicates(horarios_rows, 'recorrido_id')
-            upload_data_to_bigquery(client, dataset_id, 'horarios', horarios_rows)
+        # Crea las tablas que falten y aplica columnas nuevas y diseño; un cambio incompatible
+        # corta aquí. migrar_particiones=true recrea particionadas las tablas que no lo están
+        registro_esquemas(client, dataset_id, bucket).asegurar(
+            schemas, disenos, get_parametro(request, 'migrar_particiones', False, bool))
 
-            # Horarios de regreso
-            horarios_rows = []
-            for horario in regreso.get('horarios', []):
-                row = {
-                    'recorrido_id': recorrido_id,
-                    'ida_o_regreso': 'regreso',
-                    'tipoDia': horario.get('tipoDia'),
-                    'inicio': horario.get('inicio'),
-                    'fin': horario.get('fin')
-                }
-                horarios_rows.append(row)
-            horarios_rows = remove_duplicates(horarios_rows, 'recorrido_id')
-            upload_data_to_bigquery(client, dataset_id, 'horarios', horarios_rows)
+        # Si la ingesta se repartió en shards, se espera a que todos hayan terminado
+        pendientes = shards_pendientes(storage_client, bucket, fecha)
+        if pendientes and not get_parametro(request, 'ignorar_shards', False, bool):
+            return f'Ingesta incompleta: faltan los shards {pendientes}'
 
-            # Paths de ida
-            paths_rows = []
-            for point in ida.get('path', []):
-                row = {
-                    'recorrido_id': recorrido_id,
-                    'ida_o_regreso': 'ida',
-                    'lat': point[0],
-                    'lon': point[1]
-                }
-                paths_rows.append(row)
-            paths_rows = remove_duplicates(paths_rows, 'recorrido_id')
-            upload_data_to_bigquery(client, dataset_id, 'paths', paths_rows)
+        # Solo los recorridos nuevos o con cambios generan filas (forzar=true recarga todo)
+        forzar = get_parametro(request, 'forzar', False, bool)
+        manifiesto = ManifiestoCambios(bucket, RUTA_MANIFIESTO_TRANSFORMACION)
 
-            # Paths de regreso
-            paths_rows = []
-            for point in regreso.get('path', []):
-                row = {
-                    'recorrido_id': recorrido_id,
-                    'ida_o_regreso': 'regreso',
-                    'lat': point[0],
-                    'lon': point[1]
-                }
-                paths_rows.append(row)
-            paths_rows = remove_duplicates(paths_rows, 'recorrido_id')
-            upload_data_to_bigquery(client, dataset_id, 'paths', paths_rows)
+        # modo_paths=simplificado aplica Douglas-Peucker con tolerancia_m;
+        # modo_paths=polilinea guarda un path por fila en paths_polilinea
+        modo_paths = get_parametro(request, 'modo_paths', MODO_PATHS)
+        tolerancia_m = get_parametro(request, 'tolerancia_m', TOLERANCIA_PATHS_M, float)
 
-            # Paraderos de ida
-            paraderos_rows = []
-            servicios_rows = []
-            for paradero in ida.get('paraderos', []):
-                row = {
-                    'recorrido_id': recorrido_id,
-                    'ida_o_regreso': 'ida',
-                    'paradero_id': paradero.get('id'),
-                    'cod': paradero.get('cod'),
-                    'num': paradero.get('num'),
-                    'lat': paradero.get('pos')[0],
-                    'lon': paradero.get('pos')[1],
-                    'name': paradero.get('name'),
-                    'comuna': paradero.get('comuna'),
-                    'type': paradero.get('type'),
-                    'servicios': json.dumps(paradero.get('servicios')),
-                    'stopId': paradero['stop']['stopId'],
-                    'stopCoordenadaX': float(paradero['stop']['stopCoordenadaX']),
-                    'stopCoordenadaY': float(paradero['stop']['stopCoordenadaY']),
-                    'eje': paradero.get('eje'),
-                    'codSimt': paradero.get('codSimt'),
-                    'distancia': paradero.get('distancia')
-                }
-                paraderos_rows.append(row)
-
-                # Procesar servicios
-                for servicio in paradero.get('servicios', []):
-                    servicio_row = {
-                        'paradero_id': paradero.get('id'),
-                        'id': servicio.get('id'),
-                        'cod': servicio.get('cod'),
-                        'destino': servicio.get('destino'),
-                        'orden': servicio.get('orden'),
-                        'color': servicio.get('color'),
-                        'negocio_nombre': servicio['negocio'].get('nombre'),
-                        'negocio_color': servicio['negocio'].get('color'),
-                        'recorrido_destino': servicio['recorrido'].get('destino'),
-                        'itinerario': servicio.get('itinerario'),
-                        'codigo': servicio.get('codigo')
-                    }
-                    servicios_rows.append(servicio_row)
-            paraderos_rows = remove_duplicates(paraderos_rows, 'paradero_id')
-            servicios_rows = remove_duplicates(servicios_rows, 'id')
-            upload_data_to_bigquery(client, dataset_id, 'paraderos', paraderos_rows)
-            upload_data_to_bigquery(client, dataset_id, 'servicios', servicios_rows)
-
-            # Paraderos de regreso
-            paraderos_rows = []
-            servicios_rows = []
-            for paradero in regreso.get('paraderos', []):
-                row = {
-                    'recorrido_id': recorrido_id,
-                    'ida_o_regreso': 'regreso',
-                    'paradero_id': paradero.get('id'),
-                    'cod': paradero.get('cod'),
-                    'num': paradero.get('num'),
-                    'lat': paradero.get('pos')[0],
-                    'lon': paradero.get('pos')[1],
-                    'name': paradero.get('name'),
-                    'comuna': paradero.get('comuna'),
-                    'type': paradero.get('type'),
-                    'servicios': json.dumps(paradero.get('servicios')),
-                    'stopId': paradero['stop']['stopId'],
-                    'stopCoordenadaX': float(paradero['stop']['stopCoordenadaX']),
-                    'stopCoordenadaY': float(paradero['stop']['stopCoordenadaY']),
-                    'eje': paradero.get('eje'),
-                    'codSimt': paradero.get('codSimt'),
-                    'distancia': paradero.get('distancia')
-                }
-                paraderos_rows.append(row)
-
-                # Procesar servicios
-                for servicio in paradero.get('servicios', []):
-                    servicio_row = {
-                        'paradero_id': paradero.get('id'),
-                        'id': servicio.get('id'),
-                        'cod': servicio.get('cod'),
-                        'destino': servicio.get('destino'),
-                        'orden': servicio.get('orden'),
-                        'color': servicio.get('color'),
-                        'negocio_nombre': servicio['negocio'].get('nombre'),
-                        'negocio_color': servicio['negocio'].get('color'),
-                        'recorrido_destino': servicio['recorrido'].get('destino'),
-                        'itinerario': servicio.get('itinerario'),
-                        'codigo': servicio.get('codigo')
-                    }
-                    servicios_rows.append(servicio_row)
-            paraderos_rows = remove_duplicates(paraderos_rows, 'paradero_id')
-            servicios_rows = remove_duplicates(servicios_rows, 'id')
-            upload_data_to_bigquery(client, dataset_id, 'paraderos', paraderos_rows)
-            upload_data_to_bigquery(client, dataset_id, 'servicios', servicios_rows)
+        # Recorridos ya cargados por una invocación anterior del día (reiniciar=true parte de cero)
+        checkpoint = Checkpoint(bucket, ruta_checkpoint('datos_diarios', fecha, 'tranf'),
+                                get_parametro(request, 'reiniciar', False, bool))
+
+        def preparar(recorrido_id, json_data):
+            if checkpoint.hecho(recorrido_id):
+                return None
+            hash_actual = hash_recorrido(json_data)
+            if not forzar and not manifiesto.cambio(recorrido_id, hash_actual):
+                contar('recorridos.sin_cambios')
+                return None
+            with span('transformacion', recorrido_id):
+                return recorrido_id, hash_actual, transformar_recorrido(
+                    recorrido_id, json_data, modo_paths, tolerancia_m, fecha)
+
+        # Pipeline: listado -> descargas en paralelo -> parseo/transformación -> carga por lotes
+        fuente, etapas = etapas_recorridos(
+            storage_client, bucket, fecha, preparar,
+            get_parametro(request, 'hilos_descarga', HILOS_DESCARGA, int),
+            get_parametro(request, 'hilos_transformacion', HILOS_TRANSFORMACION, int),
+            pendiente=lambda recorrido_id: not checkpoint.hecho(recorrido_id)
+        )
+
+        # Deduplicación entre recorridos con claves compuestas por tabla;
+        # indice_persistente=true evita reinsertar dimensiones de corridas anteriores
+        indice = IndiceDeduplicacion(bucket, get_parametro(request, 'indice_persistente', False, bool))
+        # Las claves de dimensión de la corrida se guardan con el punto de control: al retomar,
+        # las dimensiones que ya cargó la invocación anterior no se vuelven a insertar
+        dimensiones = checkpoint.adjuntar('indice', indice.exportar)
+        if dimensiones is not None:
+            print(f'Índice de la corrida recuperado: {indice.importar(dimensiones)} claves')
+        procesados = []
+        cada = max(1, get_parametro(request, 'cada', CADA_RECORRIDOS, int))
+
+        def confirmar():
+            # Se cargan las filas pendientes y recién entonces se marcan los recorridos;
+            # el manifiesto se actualiza solo después de que las cargas terminaron bien
+            with span('confirmacion'):
+                carga.cerrar()
+            contar('recorridos.cargados', len(procesados))
+            for recorrido_id, hash_actual in procesados:
+                manifiesto.registrar(recorrido_id, hash_actual, fecha)
+            manifiesto.guardar()
+            indice.guardar()
+            checkpoint.marcar(recorrido_id for recorrido_id, _ in procesados)
+            checkpoint.guardar()
+            procesados.clear()
+
+        def sumidero(item):
+            recorrido_id, hash_actual, tablas = item
+            for table_id, rows in tablas.items():
+                carga.agregar(table_id, indice.filtrar(table_id, rows))
+            procesados.append((recorrido_id, hash_actual))
+            if len(procesados) >= cada:
+                confirmar()
+
+        recorridos = ejecutar_pipeline(
+            fuente, etapas, sumidero,
+            capacidad=get_parametro(request, 'capacidad_cola', CAPACIDAD_COLA, int))
+        confirmar()
+        cargadas = carga.cargadas
+        for table_id, descartadas in indice.descartadas.items():
+            contar(f'filas_duplicadas.{table_id}', descartadas)
+        print(f'Filas duplicadas descartadas por tabla: {indice.descartadas}')
+        print(f'{recorridos} recorridos procesados, filas cargadas por tabla: {cargadas}')
 
         return 'Datos procesados y almacenados en BigQuery'
     except Exception as e:
@@ -1,33 +1,112 @@
 # Importar paquetes necesarios
-import requests
 import zipfile
 import os
-from google.cloud import storage
+import csv
+import io
+import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from parametros import get_parametro
+from recursos import storage_client, sesion_http
+from instrumentacion import instrumentar, contar, span, propagar
 
+URL_GTFS = 'https://www.dtpm.cl/descargas/gtfs/GTFS-V124-PO20240601.zip'
+RUTA_ESTADO_FEED = 'datos_historicos/_estado_feed.json'  # ETag, Last-Modified y feed_version del último feed
+CHUNK_DESCARGA = 1024 * 1024
+HILOS_SUBIDA = 8
+
+def leer_estado_feed(bucket):
+    blob = bucket.blob(RUTA_ESTADO_FEED)
+    if not blob.exists():
+        return {}
+    return json.loads(blob.download_as_text())
+
+def guardar_estado_feed(bucket, estado):
+    bucket.blob(RUTA_ESTADO_FEED).upload_from_string(json.dumps(estado), content_type='application/json')
+
+def descargar_zip(url, destino, estado):
+    # Descarga condicional: si el servidor responde 304 el feed no cambió
+    headers = {}
+    if estado.get('etag'):
+        headers['If-None-Match'] = estado['etag']
+    if estado.get('last_modified'):
+        headers['If-Modified-Since'] = estado['last_modified']
+    with sesion_http().get(url, headers=headers, stream=True, timeout=(10, 120)) as response:
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        # Se escribe por bloques en vez de mantener el ZIP completo en memoria
+        with open(destino, 'wb') as file:
+            for chunk in response.iter_content(chunk_size=CHUNK_DESCARGA):
+                file.write(chunk)
+                contar('http.bytes', len(chunk))
+        return {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified')
+        }
+
+def leer_feed_version(zip_ref):
+    if 'feed_info.txt' not in zip_ref.namelist():
+        return None
+    with zip_ref.open('feed_info.txt') as member:
+        reader = csv.DictReader(io.TextIOWrapper(member, encoding='utf-8-sig'))
+        fila = next(reader, None)
+    return fila.get('feed_version') if fila else None
+
+def subir_miembro(zip_path, nombre, bucket, fecha):
+    # Cada hilo abre su propio ZipFile y sube el miembro sin extraerlo a disco
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref, span('gcs.subida', nombre):
+        info = zip_ref.getinfo(nombre)
+        with zip_ref.open(info) as member:
+            blob = bucket.blob(f'datos_historicos/{fecha}/{os.path.basename(nombre)}')
+            blob.upload_from_file(member, size=info.file_size, content_type='text/plain')
+    contar('gcs.bytes_subidos', info.file_size)
+    return nombre
+
+@instrumentar('download_and_extract_zip')
 def download_and_extract_zip(request):
     # Obtener la fecha actual
     now = datetime.now()
     fecha = now.strftime('%Y-%m-%d')
 
-    url = 'https://www.dtpm.cl/descargas/gtfs/GTFS-V124-PO20240601.zip'
-    response = requests.get(url)
-    zip_path = '/tmp/data.zip'
-    
-    # Guardar el archivo ZIP
-    with open(zip_path, 'wb') as file:
-        file.write(response.content)
-    
-    # Extraer el archivo ZIP
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall('/tmp')
-
-    # Subir los archivos extraídos a Cloud Storage
-    client = storage.Client()
+    forzar = get_parametro(request, 'forzar', False, bool)
+    url = get_parametro(request, 'url', URL_GTFS)
+
+    client = storage_client()
     bucket = client.bucket('transporte-publico-red')
-    for root, dirs, files in os.walk('/tmp'):
-        for file in files:
-            if file.endswith(".txt"):  # Ajustar según los tipos de archivos esperados
-                blob = bucket.blob(f'datos_historicos/{fecha}/{file}')
-                blob.upload_from_filename(os.path.join(root, file))
+    estado = leer_estado_feed(bucket)
+    if forzar or estado.get('url') != url:
+        estado = {}
+
+    descriptor, zip_path = tempfile.mkstemp(suffix='.zip')
+    os.close(descriptor)
+    try:
+        with span('http.descarga_gtfs', registrar=True):
+            cabeceras = descargar_zip(url, zip_path, estado)
+        if cabeceras is None:
+            return 'El feed GTFS no ha cambiado, no se procesa'
+
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            feed_version = leer_feed_version(zip_ref)
+            miembros = [info.filename for info in zip_ref.infolist()
+                        if not info.is_dir() and info.filename.endswith(".txt")]  # Ajustar según los tipos de archivos esperados
+        if feed_version and feed_version == estado.get('feed_version'):
+            guardar_estado_feed(bucket, {**estado, **cabeceras})
+            return f'El feed GTFS {feed_version} ya fue cargado, no se procesa'
+
+        # Subir los archivos del ZIP a Cloud Storage en paralelo
+        hilos = get_parametro(request, 'hilos_subida', HILOS_SUBIDA, int)
+        with ThreadPoolExecutor(max_workers=hilos) as executor:
+            list(executor.map(propagar(lambda nombre: subir_miembro(zip_path, nombre, bucket, fecha)), miembros))
+
+        guardar_estado_feed(bucket, {
+            **cabeceras,
+            'feed_version': feed_version,
+            'url': url,
+            'fecha': fecha
+        })
+    finally:
+        # /tmp ocupa memoria en Cloud Functions: se libera siempre
+        os.remove(zip_path)
     return 'Datos históricos descargados y almacenados en Cloud Storage'
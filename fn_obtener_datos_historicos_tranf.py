@@ -1,26 +1,156 @@
-import requests
-import json
-from google.cloud import storage, bigquery
-from datetime import datetime
-import os
-
-def create_table_if_not_exists(client, dataset_id, table_id, schema):
-    dataset_ref = client.dataset(dataset_id)
-    table_ref = dataset_ref.table(table_id)
-    try:
-        client.get_table(table_ref)
-        print(f"Table {table_id} already exists.")
-    except:
-        table = bigquery.Table(table_ref, schema=schema)
-        table = client.create_table(table)
-        print(f"Table {table_id} created.")
-
-def upload_data_to_bigquery(client, dataset_id, table_id, rows_to_insert):
-    table_ref = client.dataset(dataset_id).table(table_id)
-    errors = client.insert_rows_json(table_ref, rows_to_insert)
-    if errors != []:
-        print(f"Errors occurred while inserting rows into table {table_id}: {errors}")
+from google.cloud import bigquery
+from datetime import datetime, timezone
+from lector_gtfs import leer_lotes_gtfs
+from carga_bigquery import CargaPorLotes, MODO_CARGA
+from parametros import get_parametro
+from instrumentacion import instrumentar, span
+from registro_esquemas import registro_esquemas, DisenoTabla
+from recursos import bigquery_client, storage_client as obtener_storage_client
+from checkpoint import Checkpoint, ruta_checkpoint
+from staging_parquet import ruta_parquet, escribir_parquet, cargar_parquet
+from delta_gtfs import HuellasGtfs, cargar_tabla_delta, tabla_vigente
+
+# Filas por load job: acota la memoria del buffer NDJSON en los archivos grandes
+FILAS_POR_CARGA = 200000
+
+# Definir los esquemas para las tablas
+schemas = {
+    'agency': [
+        bigquery.SchemaField('agency_id', 'STRING'),
+        bigquery.SchemaField('agency_name', 'STRING'),
+        bigquery.SchemaField('agency_url', 'STRING'),
+        bigquery.SchemaField('agency_timezone', 'STRING'),
+        bigquery.SchemaField('created_at', 'TIMESTAMP'),
+        bigquery.SchemaField('periodo_de_carga', 'STRING'),
+        bigquery.SchemaField('fecha_carga', 'DATE')
+    ],
+    'calendar': [
+        bigquery.SchemaField('service_id', 'STRING'),
+        bigquery.SchemaField('monday', 'INTEGER'),
+        bigquery.SchemaField('tuesday', 'INTEGER'),
+        bigquery.SchemaField('wednesday', 'INTEGER'),
+        bigquery.SchemaField('thursday', 'INTEGER'),
+        bigquery.SchemaField('friday', 'INTEGER'),
+        bigquery.SchemaField('saturday', 'INTEGER'),
+        bigquery.SchemaField('sunday', 'INTEGER'),
+        bigquery.SchemaField('start_date', 'STRING'),
+        bigquery.SchemaField('end_date', 'STRING'),
+        bigquery.SchemaField('created_at', 'TIMESTAMP'),
+        bigquery.SchemaField('periodo_de_carga', 'STRING'),
+        bigquery.SchemaField('fecha_carga', 'DATE')
+    ],
+    'calendar_dates': [
+        bigquery.SchemaField('service_id', 'STRING'),
+        bigquery.SchemaField('date', 'STRING'),
+        bigquery.SchemaField('exception_type', 'INTEGER'),
+        bigquery.SchemaField('created_at', 'TIMESTAMP'),
+        bigquery.SchemaField('periodo_de_carga', 'STRING'),
+        bigquery.SchemaField('fecha_carga', 'DATE')
+    ],
+    'feed_info': [
+        bigquery.SchemaField('feed_publisher_name', 'STRING'),
+        bigquery.SchemaField('feed_publisher_url', 'STRING'),
+        bigquery.SchemaField('feed_lang', 'STRING'),
+        bigquery.SchemaField('feed_start_date', 'STRING'),
+        bigquery.SchemaField('feed_end_date', 'STRING'),
+        bigquery.SchemaField('feed_version', 'STRING'),
+        bigquery.SchemaField('created_at', 'TIMESTAMP'),
+        bigquery.SchemaField('periodo_de_carga', 'STRING'),
+        bigquery.SchemaField('fecha_carga', 'DATE')
+    ],
+    'frequencies': [
+        bigquery.SchemaField('trip_id', 'STRING'),
+        bigquery.SchemaField('start_time', 'STRING'),
+        bigquery.SchemaField('end_time', 'STRING'),
+        bigquery.SchemaField('headway_secs', 'INTEGER'),
+        bigquery.SchemaField('exact_times', 'INTEGER'),
+        bigquery.SchemaField('created_at', 'TIMESTAMP'),
+        bigquery.SchemaField('periodo_de_carga', 'STRING'),
+        bigquery.SchemaField('fecha_carga', 'DATE')
+    ],
+    'routes': [
+        bigquery.SchemaField('route_id', 'STRING'),
+        bigquery.SchemaField('agency_id', 'STRING'),
+        bigquery.SchemaField('route_short_name', 'STRING'),
+        bigquery.SchemaField('route_long_name', 'STRING'),
+        bigquery.SchemaField('route_desc', 'STRING'),
+        bigquery.SchemaField('route_type', 'STRING'),
+        bigquery.SchemaField('route_url', 'STRING'),
+        bigquery.SchemaField('route_color', 'STRING'),
+        bigquery.SchemaField('route_text_color', 'STRING'),
+        bigquery.SchemaField('created_at', 'TIMESTAMP'),
+        bigquery.SchemaField('periodo_de_carga', 'STRING'),
+        bigquery.SchemaField('fecha_carga', 'DATE')
+    ],
+    'shapes': [
+        bigquery.SchemaField('shape_id', 'STRING'),
+        bigquery.SchemaField('shape_pt_lat', 'FLOAT'),
+        bigquery.SchemaField('shape_pt_lon', 'FLOAT'),
+        bigquery.SchemaField('shape_pt_sequence', 'INTEGER'),
+        bigquery.SchemaField('created_at', 'TIMESTAMP'),
+        bigquery.SchemaField('periodo_de_carga', 'STRING'),
+        bigquery.SchemaField('fecha_carga', 'DATE')
+    ],
+    'stop_times': [
+        bigquery.SchemaField('trip_id', 'STRING'),
+        bigquery.SchemaField('arrival_time', 'STRING'),
+        bigquery.SchemaField('departure_time', 'STRING'),
+        bigquery.SchemaField('stop_id', 'STRING'),
+        bigquery.SchemaField('stop_sequence', 'INTEGER'),
+        bigquery.SchemaField('created_at', 'TIMESTAMP'),
+        bigquery.SchemaField('periodo_de_carga', 'STRING'),
+        bigquery.SchemaField('fecha_carga', 'DATE')
+    ],
+    'stops': [
+        bigquery.SchemaField('stop_id', 'STRING'),
+        bigquery.SchemaField('stop_code', 'STRING'),
+        bigquery.SchemaField('stop_name', 'STRING'),
+        bigquery.SchemaField('stop_lat', 'FLOAT'),
+        bigquery.SchemaField('stop_lon', 'FLOAT'),
+        bigquery.SchemaField('stop_url', 'STRING'),
+        bigquery.SchemaField('wheelchair_boarding', 'STRING'),
+        bigquery.SchemaField('created_at', 'TIMESTAMP'),
+        bigquery.SchemaField('periodo_de_carga', 'STRING'),
+        bigquery.SchemaField('fecha_carga', 'DATE')
+    ],
+    'trips': [
+        bigquery.SchemaField('route_id', 'STRING'),
+        bigquery.SchemaField('service_id', 'STRING'),
+        bigquery.SchemaField('trip_id', 'STRING'),
+        bigquery.SchemaField('trip_headsign', 'STRING'),
+        bigquery.SchemaField('direction_id', 'INTEGER'),
+        bigquery.SchemaField('shape_id', 'STRING'),
+        bigquery.SchemaField('created_at', 'TIMESTAMP'),
+        bigquery.SchemaField('periodo_de_carga', 'STRING'),
+        bigquery.SchemaField('fecha_carga', 'DATE')
+    ]
+}
+
+# Partición diaria por fecha_carga y clustering por las claves de los joins. Sin vencimiento:
+# en modo_historico=delta las filas sin cambios quedan en la partición de su última carga
+disenos = {
+    'agency': DisenoTabla(),
+    'calendar': DisenoTabla(clustering=['service_id']),
+    'calendar_dates': DisenoTabla(clustering=['service_id']),
+    'feed_info': DisenoTabla(),
+    'frequencies': DisenoTabla(clustering=['trip_id']),
+    'routes': DisenoTabla(clustering=['route_id']),
+    'shapes': DisenoTabla(clustering=['shape_id']),
+    'stop_times': DisenoTabla(clustering=['trip_id', 'stop_id']),
+    'stops': DisenoTabla(clustering=['stop_id']),
+    'trips': DisenoTabla(clustering=['trip_id', 'route_id']),
+}
+
+def saltar_filas(lotes, filas):
+    # Descarta las primeras `filas` filas de una secuencia de lotes
+    for lote in lotes:
+        if filas >= len(lote):
+            filas -= len(lote)
+            continue
+        yield lote[filas:]
+        filas = 0
 
+@instrumentar('process_historical_data')
 def process_historical_data(request):
     try:
         # Obtener la fecha actual
@@ -29,143 +159,142 @@ def process_historical_data(request):
         periodo_de_carga = fecha  # Asumimos que el periodo de carga es la fecha actual
         
         # Inicializar el cliente de BigQuery
-        client = bigquery.Client()
+        client = bigquery_client()
 
         # Especificar el ID del dataset
         dataset_id = 'transporte_publico'
 
-        # Definir los esquemas para las tablas
-        schemas = {
-            'agency': [
-                bigquery.SchemaField('agency_id', 'STRING'),
-                bigquery.SchemaField('agency_name', 'STRING'),
-                bigquery.SchemaField('agency_url', 'STRING'),
-                bigquery.SchemaField('agency_timezone', 'STRING'),
-                bigquery.SchemaField('created_at', 'TIMESTAMP'),
-                bigquery.SchemaField('periodo_de_carga', 'STRING')
-            ],
-            'calendar': [
-                bigquery.SchemaField('service_id', 'STRING'),
-                bigquery.SchemaField('monday', 'INTEGER'),
-                bigquery.SchemaField('tuesday', 'INTEGER'),
-                bigquery.SchemaField('wednesday', 'INTEGER'),
-                bigquery.SchemaField('thursday', 'INTEGER'),
-                bigquery.SchemaField('friday', 'INTEGER'),
-                bigquery.SchemaField('saturday', 'INTEGER'),
-                bigquery.SchemaField('sunday', 'INTEGER'),
-                bigquery.SchemaField('start_date', 'STRING'),
-                bigquery.SchemaField('end_date', 'STRING'),
-                bigquery.SchemaField('created_at', 'TIMESTAMP'),
-                bigquery.SchemaField('periodo_de_carga', 'STRING')
-            ],
-            'calendar_dates': [
-                bigquery.SchemaField('service_id', 'STRING'),
-                bigquery.SchemaField('date', 'STRING'),
-                bigquery.SchemaField('exception_type', 'INTEGER'),
-                bigquery.SchemaField('created_at', 'TIMESTAMP'),
-                bigquery.SchemaField('periodo_de_carga', 'STRING')
-            ],
-            'feed_info': [
-                bigquery.SchemaField('feed_publisher_name', 'STRING'),
-                bigquery.SchemaField('feed_publisher_url', 'STRING'),
-                bigquery.SchemaField('feed_lang', 'STRING'),
-                bigquery.SchemaField('feed_start_date', 'STRING'),
-                bigquery.SchemaField('feed_end_date', 'STRING'),
-                bigquery.SchemaField('feed_version', 'STRING'),
-                bigquery.SchemaField('created_at', 'TIMESTAMP'),
-                bigquery.SchemaField('periodo_de_carga', 'STRING')
-            ],
-            'frequencies': [
-                bigquery.SchemaField('trip_id', 'STRING'),
-                bigquery.SchemaField('start_time', 'STRING'),
-                bigquery.SchemaField('end_time', 'STRING'),
-                bigquery.SchemaField('headway_secs', 'INTEGER'),
-                bigquery.SchemaField('exact_times', 'INTEGER'),
-                bigquery.SchemaField('created_at', 'TIMESTAMP'),
-                bigquery.SchemaField('periodo_de_carga', 'STRING')
-            ],
-            'routes': [
-                bigquery.SchemaField('route_id', 'STRING'),
-                bigquery.SchemaField('agency_id', 'STRING'),
-                bigquery.SchemaField('route_short_name', 'STRING'),
-                bigquery.SchemaField('route_long_name', 'STRING'),
-                bigquery.SchemaField('route_desc', 'STRING'),
-                bigquery.SchemaField('route_type', 'STRING'),
-                bigquery.SchemaField('route_url', 'STRING'),
-                bigquery.SchemaField('route_color', 'STRING'),
-                bigquery.SchemaField('route_text_color', 'STRING'),
-                bigquery.SchemaField('created_at', 'TIMESTAMP'),
-                bigquery.SchemaField('periodo_de_carga', 'STRING')
-            ],
-            'shapes': [
-                bigquery.SchemaField('shape_id', 'STRING'),
-                bigquery.SchemaField('shape_pt_lat', 'FLOAT'),
-                bigquery.SchemaField('shape_pt_lon', 'FLOAT'),
-                bigquery.SchemaField('shape_pt_sequence', 'INTEGER'),
-                bigquery.SchemaField('created_at', 'TIMESTAMP'),
-                bigquery.SchemaField('periodo_de_carga', 'STRING')
-            ],
-            'stop_times': [
-                bigquery.SchemaField('trip_id', 'STRING'),
-                bigquery.SchemaField('arrival_time', 'STRING'),
-                bigquery.SchemaField('departure_time', 'STRING'),
-                bigquery.SchemaField('stop_id', 'STRING'),
-                bigquery.SchemaField('stop_sequence', 'INTEGER'),
-                bigquery.SchemaField('created_at', 'TIMESTAMP'),
-                bigquery.SchemaField('periodo_de_carga', 'STRING')
-            ],
-            'stops': [
-                bigquery.SchemaField('stop_id', 'STRING'),
-                bigquery.SchemaField('stop_code', 'STRING'),
-                bigquery.SchemaField('stop_name', 'STRING'),
-                bigquery.SchemaField('stop_lat', 'FLOAT'),
-                bigquery.SchemaField('stop_lon', 'FLOAT'),
-                bigquery.SchemaField('stop_url', 'STRING'),
-                bigquery.SchemaField('wheelchair_boarding', 'STRING'),
-                bigquery.SchemaField('created_at', 'TIMESTAMP'),
-                bigquery.SchemaField('periodo_de_carga', 'STRING')
-            ],
-            'trips': [
-                bigquery.SchemaField('route_id', 'STRING'),
-                bigquery.SchemaField('service_id', 'STRING'),
-                bigquery.SchemaField('trip_id', 'STRING'),
-                bigquery.SchemaField('trip_headsign', 'STRING'),
-                bigquery.SchemaField('direction_id', 'INTEGER'),
-                bigquery.SchemaField('shape_id', 'STRING'),
-                bigquery.SchemaField('created_at', 'TIMESTAMP'),
-                bigquery.SchemaField('periodo_de_carga', 'STRING')
-            ]
-        }
-
-        # Crear tablas si no existen
-        for table_id, schema in schemas.items():
-            create_table_if_not_exists(client, dataset_id, table_id, schema)
-
         # Inicializar el cliente de Cloud Storage
-        storage_client = storage.Client()
+        storage_client = obtener_storage_client()
         bucket = storage_client.bucket('transporte-publico-red')
         prefix = f'datos_historicos/{fecha}/'
 
-        # Función para limpiar el BOM de los nombres de campo
-        def clean_bom(field):
-            return field.replace('\ufeff', '')
-
-        # Procesar y subir cada archivo
-        for table_id in schemas.keys():
-            blob = bucket.blob(f'{prefix}{table_id}.txt')
-            content = blob.download_as_string().decode('utf-8')
-            lines = content.splitlines()
-            headers = [clean_bom(header) for header in lines[0].split(',')]
-            rows = [dict(zip(headers, line.split(','))) for line in lines[1:]]
-
-            # Añadir los campos created_at y periodo_de_carga a cada fila
-            for row in rows:
-                row['created_at'] = datetime.now().isoformat()
-                row['periodo_de_carga'] = periodo_de_carga
-
-            # Insertar datos en BigQuery
-            for i in range(0, len(rows), 500):  # Dividir en lotes de 500 filas
-                upload_data_to_bigquery(client, dataset_id, table_id, rows[i:i+500])
+        # Si el feed no cambió, la ingesta no dejó archivos para hoy
+        if not list(storage_client.list_blobs(bucket, prefix=prefix, max_results=1)):
+            return 'No hay un feed GTFS nuevo para procesar'
+
+        # formato_staging=parquet convierte cada tabla a Parquet tipado y la carga desde GCS;
+        # recargar_parquet=true reutiliza los Parquet ya escritos sin volver a leer los CSV
+        formato_staging = get_parametro(request, 'formato_staging', 'ninguno')
+        recargar_parquet = get_parametro(request, 'recargar_parquet', False, bool)
+
+        # modo_historico=delta compara el feed con el último cargado por clave natural y aplica
+        # solo los cambios con un MERGE sobre `{tabla}_vigente` (ignora formato_staging);
+        # completo agrega una copia entera del feed con el periodo_de_carga del día
+        modo_historico = get_parametro(request, 'modo_historico', 'completo')
+        huellas = HuellasGtfs(bucket)
+        if modo_historico != 'delta':
+            # Las tablas vigentes quedan atrasadas: la próxima corrida delta las reemplaza
+            huellas.olvidar(schemas)
+        cambios = {}
+
+        # Tablas ya cargadas y filas confirmadas por una invocación anterior del día;
+        # una reinvocación tras un timeout sigue desde ahí (reiniciar=true parte de cero)
+        checkpoint = Checkpoint(bucket, ruta_checkpoint('datos_historicos', fecha, 'tranf'),
+                                get_parametro(request, 'reiniciar', False, bool))
+        filas_confirmadas = checkpoint.estado.setdefault('filas', {})
+
+        # agregados=true (por defecto) calcula headways, horarios y pasadas por parada
+        # con los mismos lotes que se cargan, sin volver a leer stop_times
+        agregador = None
+        schemas_carga = dict(schemas)
+        disenos_carga = dict(disenos)
+        if modo_historico == 'delta':
+            schemas_carga.update({tabla_vigente(table_id): schema for table_id, schema in schemas.items()})
+            disenos_carga.update({tabla_vigente(table_id): diseno for table_id, diseno in disenos.items()})
+        if get_parametro(request, 'agregados', True, bool):
+            # Import diferido: NumPy solo se carga cuando se piden los agregados
+            from agregados_gtfs import AgregadorGtfs, schemas_agregados, disenos_agregados, TABLAS_OBSERVADAS
+            schemas_carga.update(schemas_agregados)
+            disenos_carga.update(disenos_agregados)
+            if checkpoint.pendientes(schemas_agregados):
+                agregador = AgregadorGtfs()
+
+        # Crea las tablas que falten y aplica columnas nuevas y diseño; un cambio incompatible
+        # corta aquí. migrar_particiones=true recrea particionadas las tablas que no lo están
+        registro_esquemas(client, dataset_id, bucket).asegurar(
+            schemas_carga, disenos_carga, get_parametro(request, 'migrar_particiones', False, bool))
+
+        def observar(table_id, lotes):
+            for lote in lotes:
+                if agregador:
+                    agregador.observar(table_id, lote)
+                yield lote
+
+        filas_por_carga = get_parametro(request, 'filas_por_carga', FILAS_POR_CARGA, int)
+        carga = CargaPorLotes(
+            client, dataset_id, schemas_carga,
+            modo=get_parametro(request, 'modo_carga', MODO_CARGA),
+            max_filas=filas_por_carga
+        )
+
+        # Procesar y subir cada archivo leyéndolo en streaming por lotes
+        for table_id, schema in schemas.items():
+            with span('tabla', table_id, registrar=True):
+                blob = bucket.blob(f'{prefix}{table_id}.txt')
+                if checkpoint.hecho(table_id):
+                    if agregador and table_id in TABLAS_OBSERVADAS:
+                        # Ya cargada, pero los agregados pendientes necesitan sus filas
+                        for _ in observar(table_id, leer_lotes_gtfs(blob, schema, {})):
+                            pass
+                    print(f'Tabla {table_id} ya cargada en una invocación anterior')
+                    continue
+                if modo_historico == 'delta':
+                    extras = {'created_at': datetime.now().isoformat(), 'periodo_de_carga': periodo_de_carga,
+                              'fecha_carga': fecha}
+                    cambios[table_id] = cargar_tabla_delta(
+                        client, dataset_id, table_id, schema,
+                        observar(table_id, leer_lotes_gtfs(blob, schema, extras)),
+                        lambda: leer_lotes_gtfs(blob, schema, extras),
+                        huellas, fecha, filas_por_carga
+                    )
+                    carga.cargadas[table_id] = cambios[table_id]['insertadas'] + cambios[table_id]['modificadas']
+                elif formato_staging == 'parquet':
+                    parquet = bucket.blob(ruta_parquet(fecha, table_id))
+                    if not (recargar_parquet and parquet.exists()):
+                        extras = {'created_at': datetime.now(timezone.utc), 'periodo_de_carga': periodo_de_carga,
+                                  'fecha_carga': now.date()}
+                        lotes = observar(table_id, leer_lotes_gtfs(blob, schema, extras))
+                        filas = escribir_parquet(parquet, lotes, schema)
+                        print(f'{filas} filas escritas en {parquet.name}')
+                    elif agregador:
+                        # Sin leer los CSV no hay datos para los agregados de esta corrida
+                        print(f'Agregados omitidos: {table_id} se recargó desde Parquet')
+                        agregador = None
+                    filas = cargar_parquet(client, dataset_id, table_id, f'gs://{bucket.name}/{parquet.name}')
+                    carga.cargadas[table_id] = filas
+                    print(f'{filas} filas cargadas desde Parquet en la tabla {table_id}')
+                else:
+                    # Añadir los campos created_at y periodo_de_carga a cada fila; se saltan
+                    # las filas que ya entraron en load jobs de una invocación anterior
+                    extras = {'created_at': datetime.now().isoformat(), 'periodo_de_carga': periodo_de_carga,
+                              'fecha_carga': fecha}
+                    inicio = filas_confirmadas.get(table_id, 0)
+                    lotes = saltar_filas(observar(table_id, leer_lotes_gtfs(blob, schema, extras)), inicio)
+                    for lote in lotes:
+                        antes = carga.cargadas.get(table_id, 0)
+                        carga.agregar(table_id, lote)
+                        if carga.cargadas.get(table_id, 0) != antes:
+                            filas_confirmadas[table_id] = inicio + carga.cargadas[table_id]
+                            checkpoint.guardar()
+                    carga.enviar(table_id)
+                    filas_confirmadas[table_id] = inicio + carga.cargadas.get(table_id, 0)
+                checkpoint.marcar([table_id])
+                checkpoint.guardar()
+
+        if agregador:
+            extras = {'created_at': datetime.now().isoformat(), 'periodo_de_carga': periodo_de_carga,
+                      'fecha_carga': fecha}
+            with span('agregados.calculo', registrar=True):
+                agregados = agregador.calcular(extras)
+            for table_id, rows in agregados.items():
+                carga.agregar(table_id, rows)
+                carga.enviar(table_id)
+                checkpoint.marcar([table_id])
+                checkpoint.guardar()
+        print(f'Filas cargadas por tabla: {carga.cargadas}')
+        if cambios:
+            print(f'Cambios por tabla respecto del feed anterior: {cambios}')
 
         return 'Datos históricos procesados y almacenados en BigQuery'
     except Exception as e:
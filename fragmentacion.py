@@ -0,0 +1,93 @@
+# Reparto de la ingesta diaria en varias invocaciones (shards)
+# El coordinador obtiene la lista de recorridos una vez, la reparte con un hash
+# estable del codsint y llama en paralelo a la misma función con shard, num_shards
+# y su lista de codsints. Cada shard deja un marcador de término en
+# datos_diarios/_shards/{fecha}/ y el transform espera a que estén todos.
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import requests
+from recursos import sesion_http
+
+URL_FUNCION_INGESTA = 'https://us-central1-eva-2-duocuc-clk.cloudfunctions.net/fn_obtener_datos_diarios_in'
+TIMEOUT_SHARD = 600  # Igual al timeout de la función
+
+def shard_de(codsint, num_shards):
+    # Distinto del crc32 que reparte fragmentos de snapshot, para no sesgar los fragmentos de cada shard
+    digest = hashlib.blake2b(str(codsint).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % num_shards
+
+def particionar(servicios, num_shards):
+    particiones = [[] for _ in range(num_shards)]
+    for codsint in servicios:
+        particiones[shard_de(codsint, num_shards)].append(codsint)
+    return particiones
+
+def etiqueta_shard(shard, num_shards):
+    # Se usa en los nombres de snapshot y de fallidos para que los shards no se pisen
+    return f's{shard:03d}de{num_shards:03d}'
+
+def _prefijo_shards(fecha):
+    return f'datos_diarios/_shards/{fecha}/'
+
+def guardar_plan(storage_client, bucket, fecha, particiones):
+    # Un plan nuevo invalida los marcadores de una corrida anterior del mismo día
+    for blob in storage_client.list_blobs(bucket, prefix=_prefijo_shards(fecha)):
+        blob.delete()
+    plan = {
+        'creado': datetime.now().isoformat(),
+        'num_shards': len(particiones),
+        'recorridos': [len(p) for p in particiones]
+    }
+    bucket.blob(f'{_prefijo_shards(fecha)}plan.json').upload_from_string(
+        json.dumps(plan), content_type='application/json')
+
+def escribir_marcador(bucket, fecha, shard, num_shards, resumen):
+    marcador = {'shard': shard, 'num_shards': num_shards, 'terminado': datetime.now().isoformat(), **resumen}
+    bucket.blob(f'{_prefijo_shards(fecha)}shard-{shard:03d}.json').upload_from_string(
+        json.dumps(marcador), content_type='application/json')
+
+def shards_pendientes(storage_client, bucket, fecha):
+    # Índices de shard sin marcador; vacío si el día no se repartió en shards
+    num_shards = None
+    terminados = set()
+    for blob in storage_client.list_blobs(bucket, prefix=_prefijo_shards(fecha)):
+        contenido = json.loads(blob.download_as_text())
+        if blob.name.endswith('/plan.json'):
+            num_shards = contenido['num_shards']
+        else:
+            terminados.add(contenido['shard'])
+            num_shards = num_shards or contenido['num_shards']
+    if not num_shards:
+        return []
+    return sorted(set(range(num_shards)) - terminados)
+
+def _token_identidad(url):
+    # Token OIDC para invocar funciones privadas; sin credenciales se llama sin token
+    try:
+        import google.auth.transport.requests
+        import google.oauth2.id_token
+        return google.oauth2.id_token.fetch_id_token(google.auth.transport.requests.Request(), url)
+    except Exception as e:
+        print(f'No se pudo obtener un token de identidad para {url}: {e}')
+        return None
+
+def invocar_shards(url, particiones, parametros, timeout=TIMEOUT_SHARD):
+    # Llama a los shards en paralelo y devuelve el resultado de cada uno (texto o error)
+    token = _token_identidad(url)
+    encabezados = {'Authorization': f'Bearer {token}'} if token else {}
+    num_shards = len(particiones)
+
+    def invocar(shard):
+        cuerpo = {**parametros, 'shard': shard, 'num_shards': num_shards, 'codsints': particiones[shard]}
+        try:
+            respuesta = sesion_http().post(url, json=cuerpo, headers=encabezados, timeout=timeout)
+            respuesta.raise_for_status()
+            return respuesta.text
+        except requests.exceptions.RequestException as e:
+            print(f'Error al invocar el shard {shard}: {e}')
+            return f'Error: {e}'
+
+    with ThreadPoolExecutor(max_workers=num_shards) as executor:
+        return list(executor.map(invocar, range(num_shards)))
@@ -0,0 +1,77 @@
+# Índice de deduplicación para toda la corrida del transform diario
+# Por cada fila se guarda solo un hash de 64 bits de su clave compuesta, así la
+# memoria depende de la cantidad de claves y no del tamaño de las filas.
+# Las claves de las tablas de dimensión se pueden persistir en el bucket para
+# no volver a insertar dimensiones que ya se cargaron en corridas anteriores, y
+# se exportan junto al punto de control para que una invocación que retoma la
+# corrida no vuelva a insertar las que ya cargó la invocación anterior.
+import array
+import gzip
+import hashlib
+
+CLAVES = {
+    'negocios': ('negocio_id',),
+    # Una fila por paradero en cada sentido de cada recorrido: con solo paradero_id se
+    # perdían las asociaciones de un paradero con todos los recorridos salvo el primero
+    'paraderos': ('paradero_id', 'recorrido_id', 'ida_o_regreso'),
+    'servicios': ('paradero_id', 'id'),
+    'horarios': ('recorrido_id', 'ida_o_regreso', 'tipoDia'),
+    'paths': ('recorrido_id', 'ida_o_regreso'),
+    'paths_polilinea': ('recorrido_id', 'ida_o_regreso'),
+}
+# En estas tablas la clave identifica un grupo de filas (todos los puntos de un
+# path) que se acepta o descarta completo
+TABLAS_GRUPO = {'paths'}
+TABLAS_DIMENSION = ('negocios', 'paraderos', 'servicios')
+RUTA_INDICE = 'datos_diarios/_manifiestos/indice_dimensiones.bin.gz'
+
+def hash_clave(table_id, valores):
+    texto = '\x1f'.join([table_id] + [str(valor) for valor in valores])
+    return int.from_bytes(hashlib.blake2b(texto.encode('utf-8'), digest_size=8).digest(), 'big')
+
+class IndiceDeduplicacion:
+    def __init__(self, bucket=None, persistente=False):
+        self.dimensiones = set()  # Claves de negocios, paraderos y servicios
+        self.corrida = set()  # Claves del resto de las tablas, solo para esta corrida
+        self.descartadas = {}
+        self.blob = bucket.blob(RUTA_INDICE) if bucket is not None and persistente else None
+        if self.blob is not None and self.blob.exists():
+            n = self.importar(self.blob.download_as_bytes())
+            print(f'Índice de dimensiones cargado: {n} claves')
+
+    def exportar(self):
+        # Claves de dimensión comprimidas (uint64 ordenados, gzip)
+        return gzip.compress(array.array('Q', sorted(self.dimensiones)).tobytes())
+
+    def importar(self, datos):
+        claves = array.array('Q')
+        claves.frombytes(gzip.decompress(datos))
+        self.dimensiones.update(claves)
+        return len(claves)
+
+    def filtrar(self, table_id, rows):
+        campos = CLAVES.get(table_id)
+        if not campos:
+            return rows
+        vistos = self.dimensiones if table_id in TABLAS_DIMENSION else self.corrida
+        grupo = table_id in TABLAS_GRUPO
+        aceptados = set()
+        unicas = []
+        for row in rows:
+            clave = hash_clave(table_id, [row.get(campo) for campo in campos])
+            if grupo and clave in aceptados:
+                unicas.append(row)
+            elif clave not in vistos:
+                vistos.add(clave)
+                aceptados.add(clave)
+                unicas.append(row)
+        if len(unicas) < len(rows):
+            self.descartadas[table_id] = self.descartadas.get(table_id, 0) + len(rows) - len(unicas)
+        return unicas
+
+    def guardar(self):
+        # Llamar solo después de que las cargas de la corrida terminaron bien
+        if self.blob is None:
+            return
+        self.blob.upload_from_string(self.exportar(), content_type='application/octet-stream')
+        print(f'Índice de dimensiones {self.blob.name}: {len(self.dimensiones)} claves')
@@ -0,0 +1,81 @@
+# Índice espacial en memoria (grilla hash) con distancias haversine vectorizadas
+# Los puntos se agrupan en celdas de `celda_m` metros; una consulta solo calcula
+# distancias contra los puntos de las celdas vecinas.
+import math
+import numpy as np
+
+RADIO_TIERRA_M = 6371008.8
+METROS_POR_GRADO = 111195.0
+
+def haversine(lat1, lon1, lat2, lon2):
+    # Distancia en metros; acepta escalares o arreglos (con broadcasting)
+    lat1, lon1, lat2, lon2 = (np.radians(v) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_TIERRA_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+class IndiceGrilla:
+    def __init__(self, lats, lons, celda_m=200.0):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.celda_lat = celda_m / METROS_POR_GRADO
+        lat_media = float(self.lats.mean()) if len(self.lats) else 0.0
+        self.celda_lon = celda_m / (METROS_POR_GRADO * max(math.cos(math.radians(lat_media)), 1e-6))
+        self.celda_m = celda_m
+        # Se ordenan los puntos por celda y se guarda el rango de cada una
+        filas = np.floor(self.lats / self.celda_lat).astype(np.int64)
+        columnas = np.floor(self.lons / self.celda_lon).astype(np.int64)
+        orden = np.lexsort((columnas, filas))
+        self.orden = orden
+        self.celdas = {}
+        if len(orden):
+            claves = np.column_stack((filas[orden], columnas[orden]))
+            cambios = np.flatnonzero(np.any(np.diff(claves, axis=0) != 0, axis=1)) + 1
+            inicios = np.concatenate(([0], cambios))
+            fines = np.concatenate((cambios, [len(orden)]))
+            for inicio, fin in zip(inicios, fines):
+                self.celdas[(int(claves[inicio, 0]), int(claves[inicio, 1]))] = (inicio, fin)
+
+    def _celda(self, lat, lon):
+        return int(math.floor(lat / self.celda_lat)), int(math.floor(lon / self.celda_lon))
+
+    def _candidatos(self, lat, lon, anillo):
+        fila, columna = self._celda(lat, lon)
+        rangos = [self.celdas[(f, c)]
+                  for f in range(fila - anillo, fila + anillo + 1)
+                  for c in range(columna - anillo, columna + anillo + 1)
+                  if (f, c) in self.celdas]
+        if not rangos:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([self.orden[inicio:fin] for inicio, fin in rangos])
+
+    def radio(self, lat, lon, radio_m):
+        # Índices y distancias de los puntos a menos de `radio_m`, ordenados por distancia
+        anillo = int(math.ceil(radio_m / self.celda_m))
+        candidatos = self._candidatos(lat, lon, anillo)
+        distancias = haversine(lat, lon, self.lats[candidatos], self.lons[candidatos])
+        dentro = distancias <= radio_m
+        candidatos, distancias = candidatos[dentro], distancias[dentro]
+        orden = np.argsort(distancias, kind='stable')
+        return candidatos[orden], distancias[orden]
+
+    def k_cercanos(self, lat, lon, k, radio_max_m=None):
+        # Se amplía el anillo de celdas hasta que los k encontrados estén garantizados
+        if not len(self.lats):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        anillo = 1
+        maximo = int(math.ceil(radio_max_m / self.celda_m)) + 1 if radio_max_m else None
+        while True:
+            candidatos = self._candidatos(lat, lon, anillo)
+            distancias = haversine(lat, lon, self.lats[candidatos], self.lons[candidatos])
+            orden = np.argsort(distancias, kind='stable')[:k]
+            candidatos, distancias = candidatos[orden], distancias[orden]
+            # Todo punto fuera de los anillos revisados está a más de anillo * celda_m
+            cubierto = anillo * self.celda_m
+            completo = len(candidatos) >= k and distancias[-1] <= cubierto
+            if completo or (maximo and anillo >= maximo) or len(candidatos) == len(self.lats):
+                break
+            anillo *= 2
+        if radio_max_m is not None:
+            dentro = distancias <= radio_max_m
+            candidatos, distancias = candidatos[dentro], distancias[dentro]
+        return candidatos, distancias
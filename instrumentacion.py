@@ -0,0 +1,239 @@
+# Instrumentación de las funciones
+# Cada invocación de un entry point decorado con @instrumentar abre una corrida con:
+#   - spans: tiempo por etapa y, si se indica una clave, por recorrido o tabla
+#   - contadores: filas, bytes, llamadas a APIs, reintentos y fallos
+#   - histogramas de latencia con buckets fijos (los spans también alimentan uno)
+# Al terminar se emite un log estructurado (una línea JSON en stdout, que Cloud Logging
+# indexa) y se escribe un resumen JSON en el bucket. Con perfil=cprofile,tracemalloc se
+# agrega al resumen el perfil de CPU y de memoria de la invocación.
+# La corrida activa viaja en una ContextVar; los hilos de un pool la reciben con
+# propagar(). Fuera de una corrida las funciones de registro no hacen nada.
+import bisect
+import contextvars
+import functools
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from parametros import get_parametro
+
+BUCKET_METRICAS = 'transporte-publico-red'
+PREFIJO_METRICAS = '_metricas'
+LIMITES_HISTOGRAMA_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+CLAVES_MAS_LENTAS = 20  # Claves por span que se informan en el resumen
+LINEAS_PERFIL = 30
+
+_actual = contextvars.ContextVar('corrida', default=None)
+
+class Histograma:
+    def __init__(self):
+        self.cuentas = [0] * (len(LIMITES_HISTOGRAMA_MS) + 1)
+        self.n = 0
+        self.total_ms = 0.0
+        self.maximo_ms = 0.0
+
+    def observar(self, ms):
+        self.cuentas[bisect.bisect_left(LIMITES_HISTOGRAMA_MS, ms)] += 1
+        self.n += 1
+        self.total_ms += ms
+        self.maximo_ms = max(self.maximo_ms, ms)
+
+    def percentil(self, p):
+        # Límite superior del bucket que contiene el percentil
+        objetivo = p / 100 * self.n
+        acumulado = 0
+        for limite, cuenta in zip(LIMITES_HISTOGRAMA_MS, self.cuentas):
+            acumulado += cuenta
+            if cuenta and acumulado >= objetivo:
+                return min(limite, self.maximo_ms)
+        return self.maximo_ms
+
+    def resumen(self):
+        etiquetas = [f'<={limite}' for limite in LIMITES_HISTOGRAMA_MS] + [f'>{LIMITES_HISTOGRAMA_MS[-1]}']
+        return {
+            'n': self.n,
+            'total_ms': round(self.total_ms, 1),
+            'promedio_ms': round(self.total_ms / self.n, 2) if self.n else 0.0,
+            'p50_ms': round(self.percentil(50), 1),
+            'p95_ms': round(self.percentil(95), 1),
+            'p99_ms': round(self.percentil(99), 1),
+            'max_ms': round(self.maximo_ms, 1),
+            'buckets_ms': {etiqueta: cuenta for etiqueta, cuenta in zip(etiquetas, self.cuentas) if cuenta}
+        }
+
+class Corrida:
+    def __init__(self, funcion):
+        self.funcion = funcion
+        self.id = uuid.uuid4().hex[:12]
+        self.inicio = datetime.now(timezone.utc)
+        self.comienzo = time.perf_counter()
+        self.lock = threading.Lock()
+        self.contadores = {}
+        self.histogramas = {}
+        self.por_clave = {}  # {span: {clave: segundos}}
+
+    def contar(self, nombre, n=1):
+        with self.lock:
+            self.contadores[nombre] = self.contadores.get(nombre, 0) + n
+
+    def observar(self, nombre, segundos, clave=None):
+        with self.lock:
+            self.histogramas.setdefault(nombre, Histograma()).observar(segundos * 1000)
+            if clave is not None:
+                claves = self.por_clave.setdefault(nombre, {})
+                claves[clave] = claves.get(clave, 0.0) + segundos
+
+    def resumen(self):
+        with self.lock:
+            histogramas = {}
+            for nombre, histograma in sorted(self.histogramas.items()):
+                histogramas[nombre] = histograma.resumen()
+                lentos = sorted(self.por_clave.get(nombre, {}).items(), key=lambda c: c[1], reverse=True)
+                if lentos:
+                    histogramas[nombre]['mas_lentos_s'] = {str(clave): round(s, 3)
+                                                           for clave, s in lentos[:CLAVES_MAS_LENTAS]}
+            return {
+                'funcion': self.funcion,
+                'corrida': self.id,
+                'inicio': self.inicio.isoformat(),
+                'duracion_s': round(time.perf_counter() - self.comienzo, 3),
+                'contadores': dict(sorted(self.contadores.items())),
+                'latencias': histogramas
+            }
+
+def log(mensaje, severidad='INFO', **campos):
+    # Log estructurado: Cloud Logging toma severity y message y deja el resto como jsonPayload
+    corrida = _actual.get()
+    registro = {'severity': severidad, 'message': mensaje}
+    if corrida is not None:
+        registro.update({'funcion': corrida.funcion, 'corrida': corrida.id})
+    registro.update(campos)
+    print(json.dumps(registro, default=str, ensure_ascii=False))
+
+def contar(nombre, n=1):
+    corrida = _actual.get()
+    if corrida is not None and n:
+        corrida.contar(nombre, n)
+
+def observar(nombre, segundos, clave=None):
+    corrida = _actual.get()
+    if corrida is not None:
+        corrida.observar(nombre, segundos, clave)
+
+@contextmanager
+def span(nombre, clave=None, registrar=False):
+    # Mide el bloque; registrar=true además emite un log estructurado al cerrarlo
+    corrida = _actual.get()
+    if corrida is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = e
+        corrida.contar(f'{nombre}.errores')
+        raise
+    finally:
+        duracion = time.perf_counter() - inicio
+        corrida.observar(nombre, duracion, clave)
+        if registrar:
+            mensaje = f'{nombre} {clave} terminado' if clave is not None else f'{nombre} terminado'
+            log(mensaje, 'ERROR' if error else 'INFO', span=nombre, clave=clave,
+                duracion_s=round(duracion, 3), **({'error': str(error)} if error else {}))
+
+def propagar(funcion):
+    # Envuelve `funcion` para que los hilos de un pool registren en la corrida actual
+    corrida = _actual.get()
+    if corrida is None:
+        return funcion
+
+    @functools.wraps(funcion)
+    def envuelta(*args, **kwargs):
+        token = _actual.set(corrida)
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            _actual.reset(token)
+    return envuelta
+
+class Perfilador:
+    # cprofile mide solo el hilo que atiende la petición (los pools aparecen como esperas);
+    # tracemalloc sigue las asignaciones de todos los hilos
+    def __init__(self, modos):
+        self.modos = set(modos)
+        self.perfil = None
+
+    def iniciar(self):
+        if 'tracemalloc' in self.modos:
+            import tracemalloc
+            tracemalloc.start(10)
+        if 'cprofile' in self.modos:
+            import cProfile
+            self.perfil = cProfile.Profile()
+            self.perfil.enable()
+
+    def detener(self):
+        informe = {}
+        if self.perfil is not None:
+            import io
+            import pstats
+            self.perfil.disable()
+            salida = io.StringIO()
+            pstats.Stats(self.perfil, stream=salida).sort_stats('cumulative').print_stats(LINEAS_PERFIL)
+            informe['cprofile'] = salida.getvalue().splitlines()
+        if 'tracemalloc' in self.modos:
+            import tracemalloc
+            actual, pico = tracemalloc.get_traced_memory()
+            lineas = tracemalloc.take_snapshot().statistics('lineno')[:LINEAS_PERFIL]
+            tracemalloc.stop()
+            informe['tracemalloc'] = {
+                'actual_mb': round(actual / 1e6, 2),
+                'pico_mb': round(pico / 1e6, 2),
+                'mayores': [str(estadistica) for estadistica in lineas]
+            }
+        return informe
+
+def guardar_resumen(resumen):
+    from recursos import storage_client
+    fecha = resumen['inicio'][:10]
+    nombre = f'{PREFIJO_METRICAS}/{resumen["funcion"]}/{fecha}/{resumen["inicio"][11:19]}-{resumen["corrida"]}.json'
+    storage_client().bucket(BUCKET_METRICAS).blob(nombre).upload_from_string(
+        json.dumps(resumen, default=str, ensure_ascii=False), content_type='application/json')
+    return nombre
+
+def instrumentar(funcion_nombre):
+    # Decorador de los entry points HTTP: abre la corrida, perfila si se pide y guarda el resumen.
+    # metricas=false omite el resumen en el bucket (el log estructurado se emite igual).
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envuelta(request):
+            corrida = Corrida(funcion_nombre)
+            token = _actual.set(corrida)
+            perfilador = Perfilador(get_parametro(request, 'perfil', [], list))
+            perfilador.iniciar()
+            resultado = None
+            try:
+                resultado = funcion(request)
+                return resultado
+            finally:
+                perfil = perfilador.detener()
+                resumen = corrida.resumen()
+                resumen['resultado'] = resultado
+                resumen['estado'] = 'error' if not isinstance(resultado, str) or resultado.startswith('Error') else 'ok'
+                log(f'{funcion_nombre} terminado en {resumen["duracion_s"]} s',
+                    'ERROR' if resumen['estado'] == 'error' else 'INFO',
+                    estado=resumen['estado'], duracion_s=resumen['duracion_s'], contadores=resumen['contadores'])
+                if perfil:
+                    resumen['perfil'] = perfil
+                if get_parametro(request, 'metricas', True, bool):
+                    try:
+                        print(f'Resumen de la corrida en {guardar_resumen(resumen)}')
+                    except Exception as e:
+                        print(f'No se pudo guardar el resumen de la corrida: {e}')
+                _actual.reset(token)
+        return envuelta
+    return decorador
@@ -0,0 +1,67 @@
+# Lectura en streaming de los archivos GTFS (CSV) guardados en Cloud Storage
+# El blob se lee por bloques, se parsea con el módulo csv (respeta comillas y
+# comas dentro de los campos) y se entregan lotes de filas ya tipadas según el
+# esquema de BigQuery, de modo que la memoria no depende del tamaño del archivo.
+import csv
+import io
+
+CHUNK_LECTURA = 4 * 1024 * 1024  # Bytes por descarga parcial del blob
+FILAS_POR_LOTE = 10000
+
+def _a_booleano(valor):
+    return valor.strip().lower() in ('1', 'true')
+
+def _a_entero(valor):
+    try:
+        return int(valor)
+    except ValueError:
+        return int(float(valor))  # Algunos feeds escriben enteros como "1.0"
+
+CONVERSORES = {
+    'INTEGER': _a_entero,
+    'INT64': _a_entero,
+    'FLOAT': float,
+    'FLOAT64': float,
+    'BOOLEAN': _a_booleano,
+    'BOOL': _a_booleano,
+}
+
+def leer_filas_gtfs(archivo_texto, schema, extras=None):
+    # Genera una fila tipada por línea del CSV; solo se conservan las columnas del esquema
+    campos = {field.name: CONVERSORES.get(field.field_type) for field in schema}
+    reader = csv.reader(archivo_texto)
+    headers = [header.replace('\ufeff', '').strip() for header in next(reader, [])]
+    columnas = [(i, nombre, campos[nombre]) for i, nombre in enumerate(headers) if nombre in campos]
+    invalidos = 0
+    for valores in reader:
+        if not valores:
+            continue
+        row = {}
+        for i, nombre, conversor in columnas:
+            valor = valores[i].strip() if i < len(valores) else ''
+            if valor == '':
+                continue
+            if conversor is None:
+                row[nombre] = valor
+                continue
+            try:
+                row[nombre] = conversor(valor)
+            except ValueError:
+                invalidos += 1
+        if extras:
+            row.update(extras)
+        yield row
+    if invalidos:
+        print(f'{invalidos} valores no se pudieron convertir al tipo del esquema y quedaron nulos')
+
+def leer_lotes_gtfs(blob, schema, extras=None, filas_por_lote=FILAS_POR_LOTE):
+    with blob.open('rb', chunk_size=CHUNK_LECTURA) as binario:
+        texto = io.TextIOWrapper(binario, encoding='utf-8-sig', newline='')
+        lote = []
+        for row in leer_filas_gtfs(texto, schema, extras):
+            lote.append(row)
+            if len(lote) >= filas_por_lote:
+                yield lote
+                lote = []
+        if lote:
+            yield lote
@@ -0,0 +1,74 @@
+# Manifiesto de hashes por codsint para detectar recorridos sin cambios
+# Por cada recorrido se guarda el hash del JSON normalizado, la fecha en que
+# cambió por última vez (donde está su versión vigente) y la última fecha en que se vio.
+# Lo escribe el transform tras cargar cada recorrido; la ingesta lo lee para no volver a
+# subir lo que ya está en BigQuery.
+# Varias ejecuciones pueden guardar el mismo manifiesto: la subida usa la generación leída
+# como precondición y, si otro la cambió antes, se mezcla con la versión remota y se reintenta.
+import hashlib
+import json
+import threading
+
+RUTA_MANIFIESTO_TRANSFORMACION = 'datos_diarios/_manifiestos/hashes_tranf.json'
+INTENTOS_GUARDADO = 5
+
+def hash_recorrido(detalles):
+    # Claves ordenadas y sin espacios: el mismo contenido siempre da el mismo hash
+    normalizado = json.dumps(detalles, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(normalizado.encode('utf-8')).hexdigest()
+
+class ManifiestoCambios:
+    def __init__(self, bucket, ruta):
+        self.bucket = bucket
+        self.ruta = ruta
+        self.lock = threading.Lock()
+        self.recorridos, self.generacion = self._leer()
+        self.modificados = set()  # Solo estas entradas se imponen al mezclar
+        self.sin_cambio = 0
+
+    def _leer(self):
+        # Generación 0 = el objeto no existe (precondición de "crear solo si no existe")
+        blob = self.bucket.get_blob(self.ruta)
+        if blob is None:
+            return {}, 0
+        contenido = blob.download_as_text(if_generation_match=blob.generation)
+        return json.loads(contenido).get('recorridos', {}), blob.generation
+
+    def cambio(self, codsint, hash_actual):
+        # True si el recorrido es nuevo o su contenido cambió desde el último registro
+        with self.lock:
+            anterior = self.recorridos.get(str(codsint))
+            if anterior and anterior['hash'] == hash_actual:
+                self.sin_cambio += 1
+                return False
+            return True
+
+    def registrar(self, codsint, hash_actual, fecha):
+        with self.lock:
+            entrada = self.recorridos.setdefault(str(codsint), {'hash': None, 'cambio': fecha})
+            if entrada['hash'] != hash_actual:
+                entrada['hash'] = hash_actual
+                entrada['cambio'] = fecha
+            entrada['visto'] = fecha
+            self.modificados.add(str(codsint))
+
+    def guardar(self):
+        from google.api_core.exceptions import PreconditionFailed
+        for intento in range(INTENTOS_GUARDADO):
+            with self.lock:
+                contenido = json.dumps({'recorridos': self.recorridos})
+            try:
+                self.bucket.blob(self.ruta).upload_from_string(
+                    contenido, content_type='application/json', if_generation_match=self.generacion)
+                break
+            except PreconditionFailed:
+                # Otro shard guardó primero: se toma su versión y se reaplican las entradas propias
+                remotos, generacion = self._leer()
+                with self.lock:
+                    for codsint in self.modificados:
+                        remotos[codsint] = self.recorridos[codsint]
+                    self.recorridos, self.generacion = remotos, generacion
+                print(f'Manifiesto {self.ruta} modificado por otra ejecución, reintento {intento + 1}')
+        else:
+            raise RuntimeError(f'No se pudo guardar el manifiesto {self.ruta} tras {INTENTOS_GUARDADO} intentos')
+        print(f'Manifiesto {self.ruta}: {len(self.recorridos)} recorridos, {self.sin_cambio} sin cambios')
@@ -0,0 +1,31 @@
+# Registro de recorridos que siguen fallando después de los reintentos
+# Se guarda en el bucket para poder relanzar solo esos recorridos (solo_fallidos=true)
+import json
+from datetime import datetime
+
+def ruta_manifiesto(prefijo, fecha, etiqueta=None):
+    # Fuera de la carpeta del día para que el transform no lo lea como recorrido;
+    # con shards cada uno lleva su propio registro
+    if etiqueta:
+        return f'{prefijo}/_fallidos/{fecha}-{etiqueta}.json'
+    return f'{prefijo}/_fallidos/{fecha}.json'
+
+def leer_fallidos(bucket, ruta):
+    blob = bucket.blob(ruta)
+    if not blob.exists():
+        return []
+    return json.loads(blob.download_as_text()).get('fallidos', [])
+
+def guardar_fallidos(bucket, ruta, fallidos):
+    blob = bucket.blob(ruta)
+    if not fallidos:
+        # Nada pendiente: se elimina el manifiesto de una ejecución anterior
+        if blob.exists():
+            blob.delete()
+        return
+    contenido = {
+        'actualizado': datetime.now().isoformat(),
+        'fallidos': sorted(set(fallidos), key=str)
+    }
+    blob.upload_from_string(json.dumps(contenido), content_type='application/json')
+    print(f'{len(contenido["fallidos"])} recorridos fallidos registrados en {ruta}')
@@ -0,0 +1,33 @@
+# Lectura de parámetros de las funciones HTTP
+# Se aceptan tanto en la query string (?concurrencia=8) como en el cuerpo JSON
+
+
+def _convertir(valor, tipo):
+    if tipo is bool:
+        if isinstance(valor, bool):
+            return valor
+        return str(valor).strip().lower() in ('1', 'true', 'si', 'sí', 'yes')
+    if tipo is list:
+        if isinstance(valor, (list, tuple)):
+            return list(valor)
+        return [v.strip() for v in str(valor).split(',') if v.strip()]
+    return tipo(valor)
+
+
+def get_parametro(request, nombre, default=None, tipo=str):
+    valor = None
+    if request is not None:
+        args = getattr(request, 'args', None)
+        if args:
+            valor = args.get(nombre)
+        if valor is None and hasattr(request, 'get_json'):
+            body = request.get_json(silent=True)
+            if isinstance(body, dict):
+                valor = body.get(nombre)
+    if valor is None or valor == '':
+        return default
+    try:
+        return _convertir(valor, tipo)
+    except (TypeError, ValueError):
+        print(f'Parámetro {nombre} inválido ({valor!r}), se usa {default!r}')
+        return default
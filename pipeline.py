@@ -0,0 +1,117 @@
+# Pipeline por etapas con colas acotadas
+# fuente -> etapa 1 (N hilos) -> ... -> etapa k (M hilos) -> sumidero (hilo que llama)
+# Cada cola tiene capacidad limitada: si una etapa se atrasa, las anteriores se
+# bloquean al encolar (backpressure) y la memoria queda acotada.
+import queue
+import threading
+import time
+from instrumentacion import observar, propagar
+
+CAPACIDAD_COLA = 64
+_FIN = object()
+
+class Etapa:
+    def __init__(self, nombre, funcion, hilos=1):
+        self.nombre = nombre
+        self.funcion = funcion  # Si devuelve None el elemento se descarta
+        self.hilos = max(1, hilos)
+
+class _Control:
+    def __init__(self):
+        self.detener = threading.Event()
+        self.lock = threading.Lock()
+        self.error = None
+
+    def fallar(self, error):
+        with self.lock:
+            if self.error is None:
+                self.error = error
+        self.detener.set()
+
+def _poner(cola, item, control):
+    while not control.detener.is_set():
+        try:
+            cola.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _sacar(cola, control):
+    while not control.detener.is_set():
+        try:
+            return cola.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _FIN
+
+def _productor(fuente, salida, consumidores, control):
+    try:
+        for item in fuente:
+            if not _poner(salida, item, control):
+                return
+    except Exception as e:
+        control.fallar(e)
+        return
+    for _ in range(consumidores):
+        _poner(salida, _FIN, control)
+
+def _trabajador(etapa, entrada, salida, consumidores, pendientes, control):
+    try:
+        while True:
+            item = _sacar(entrada, control)
+            if item is _FIN:
+                break
+            inicio = time.perf_counter()
+            resultado = etapa.funcion(item)
+            observar(f'etapa.{etapa.nombre}', time.perf_counter() - inicio)
+            if resultado is not None and not _poner(salida, resultado, control):
+                return
+    except Exception as e:
+        print(f'Error en la etapa {etapa.nombre}: {e}')
+        control.fallar(e)
+        return
+    # El último hilo de la etapa avisa el fin a la etapa siguiente
+    with pendientes['lock']:
+        pendientes['hilos'] -= 1
+        ultimo = pendientes['hilos'] == 0
+    if ultimo:
+        for _ in range(consumidores):
+            _poner(salida, _FIN, control)
+
+def ejecutar_pipeline(fuente, etapas, sumidero, capacidad=CAPACIDAD_COLA):
+    control = _Control()
+    colas = [queue.Queue(maxsize=capacidad) for _ in range(len(etapas) + 1)]
+    hilos = [threading.Thread(target=_productor, daemon=True,
+                              args=(fuente, colas[0], etapas[0].hilos if etapas else 1, control))]
+    for i, etapa in enumerate(etapas):
+        consumidores = etapas[i + 1].hilos if i + 1 < len(etapas) else 1
+        pendientes = {'lock': threading.Lock(), 'hilos': etapa.hilos}
+        for _ in range(etapa.hilos):
+            # propagar: las métricas de cada etapa quedan en la corrida de quien llama
+            hilos.append(threading.Thread(
+                target=propagar(_trabajador), daemon=True,
+                args=(etapa, colas[i], colas[i + 1], consumidores, pendientes, control)))
+    for hilo in hilos:
+        hilo.start()
+
+    procesados = 0
+    try:
+        while True:
+            item = _sacar(colas[-1], control)
+            if item is _FIN:
+                break
+            inicio = time.perf_counter()
+            sumidero(item)
+            observar('etapa.sumidero', time.perf_counter() - inicio)
+            procesados += 1
+    except Exception as e:
+        control.fallar(e)
+    finally:
+        if control.error:
+            control.detener.set()
+        for hilo in hilos:
+            hilo.join()
+    if control.error:
+        raise control.error
+    return procesados
@@ -0,0 +1,84 @@
+# Etapa de paths: simplificación y codificación de polilíneas con NumPy
+# Los puntos vienen como [lat, lon]. Las distancias se calculan en metros con una
+# proyección equirectangular local, suficiente a la escala de un recorrido urbano.
+import numpy as np
+
+METROS_POR_GRADO_LAT = 110540.0
+METROS_POR_GRADO_LON = 111320.0
+TOLERANCIA_M = 5.0
+
+def a_metros(puntos):
+    puntos = np.asarray(puntos, dtype=np.float64)
+    lat0 = np.radians(puntos[:, 0].mean())
+    x = puntos[:, 1] * METROS_POR_GRADO_LON * np.cos(lat0)
+    y = puntos[:, 0] * METROS_POR_GRADO_LAT
+    return np.column_stack((x, y))
+
+def simplificar(puntos, tolerancia_m=TOLERANCIA_M):
+    # Douglas-Peucker iterativo; devuelve los índices de los puntos que se conservan.
+    # Las distancias de cada tramo al segmento se calculan vectorizadas.
+    n = len(puntos)
+    if n <= 2:
+        return np.arange(n)
+    xy = a_metros(puntos)
+    conservar = np.zeros(n, dtype=bool)
+    conservar[0] = conservar[-1] = True
+    pila = [(0, n - 1)]
+    while pila:
+        inicio, fin = pila.pop()
+        if fin - inicio < 2:
+            continue
+        a, b = xy[inicio], xy[fin]
+        tramo = xy[inicio + 1:fin]
+        ab = b - a
+        largo = np.hypot(ab[0], ab[1])
+        if largo == 0:
+            distancias = np.hypot(tramo[:, 0] - a[0], tramo[:, 1] - a[1])
+        else:
+            distancias = np.abs(ab[0] * (tramo[:, 1] - a[1]) - ab[1] * (tramo[:, 0] - a[0])) / largo
+        i = int(np.argmax(distancias))
+        if distancias[i] > tolerancia_m:
+            medio = inicio + 1 + i
+            conservar[medio] = True
+            pila.append((inicio, medio))
+            pila.append((medio, fin))
+    return np.flatnonzero(conservar)
+
+def codificar(puntos, precision=5):
+    # Algoritmo de polilínea codificada de Google, vectorizado sobre todos los valores
+    enteros = np.round(np.asarray(puntos, dtype=np.float64) * 10 ** precision).astype(np.int64)
+    deltas = np.diff(enteros, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    valores = ((deltas << 1) ^ (deltas >> 63)).astype(np.uint64)  # zigzag
+    # Cada valor ocupa hasta 7 bloques de 5 bits; se arma una matriz valor x bloque
+    bloques = []
+    validos = []
+    restante = valores.copy()
+    valido = np.ones(len(valores), dtype=bool)
+    for _ in range(7):
+        bloque = (restante & np.uint64(0x1f)).astype(np.uint8)
+        restante = restante >> np.uint64(5)
+        continua = restante > 0
+        bloques.append(np.where(continua, bloque | 0x20, bloque) + 63)
+        validos.append(valido)
+        valido = valido & continua
+    bloques = np.stack(bloques, axis=1)
+    validos = np.stack(validos, axis=1)
+    return bloques[validos].astype(np.uint8).tobytes().decode('ascii')
+
+def decodificar(texto, precision=5):
+    valores = []
+    actual = desplazamiento = 0
+    for caracter in texto.encode('ascii'):
+        bloque = caracter - 63
+        actual |= (bloque & 0x1f) << desplazamiento
+        desplazamiento += 5
+        if bloque < 0x20:
+            valores.append((actual >> 1) ^ -(actual & 1))
+            actual = desplazamiento = 0
+    enteros = np.cumsum(np.array(valores, dtype=np.int64).reshape(-1, 2), axis=0)
+    return enteros / 10 ** precision
+
+def linestring_wkt(puntos):
+    # WKT usa el orden lon lat
+    coordenadas = ', '.join(f'{lon} {lat}' for lat, lon in puntos)
+    return f'LINESTRING({coordenadas})'
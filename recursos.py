@@ -0,0 +1,59 @@
+# Clientes compartidos por proceso
+# Una instancia de Cloud Functions atiende muchas invocaciones seguidas: los clientes
+# de GCP y las sesiones HTTP se crean en la primera invocación que los necesita y se
+# reutilizan en las siguientes, sin repetir la búsqueda de credenciales ni las conexiones.
+# Las librerías de Google se importan recién al crear cada cliente.
+import threading
+
+_lock = threading.Lock()
+_compartidos = {}
+
+def compartido(clave, crear):
+    # Devuelve el objeto cacheado bajo `clave`, creándolo una sola vez aunque haya hilos en paralelo
+    objeto = _compartidos.get(clave)
+    if objeto is None:
+        with _lock:
+            objeto = _compartidos.get(clave)
+            if objeto is None:
+                objeto = _compartidos[clave] = crear()
+    return objeto
+
+def limpiar():
+    # Olvida los clientes cacheados (entorno_local y benchmark de arranque)
+    with _lock:
+        _compartidos.clear()
+
+def storage_client():
+    def crear():
+        from google.cloud import storage
+        return storage.Client()
+    return compartido('storage', crear)
+
+def bigquery_client():
+    def crear():
+        from google.cloud import bigquery
+        return bigquery.Client()
+    return compartido('bigquery', crear)
+
+def publisher_client(max_mensajes, max_bytes, max_latencia, ordenar):
+    # Un cliente por combinación de opciones de lote y orden
+    def crear():
+        from google.cloud import pubsub_v1
+        batch_settings = pubsub_v1.types.BatchSettings(
+            max_messages=max_mensajes, max_bytes=max_bytes, max_latency=max_latencia)
+        publisher_options = pubsub_v1.types.PublisherOptions(enable_message_ordering=ordenar)
+        return pubsub_v1.PublisherClient(batch_settings, publisher_options)
+    return compartido(('publisher', max_mensajes, max_bytes, max_latencia, ordenar), crear)
+
+def subscriber_client():
+    def crear():
+        from google.cloud import pubsub_v1
+        return pubsub_v1.SubscriberClient()
+    return compartido('subscriber', crear)
+
+def sesion_http(clave='default', crear=None):
+    # Sesión requests con keep-alive reutilizada entre invocaciones
+    def crear_por_defecto():
+        import requests
+        return requests.Session()
+    return compartido(('sesion', clave), crear or crear_por_defecto)
@@ -0,0 +1,222 @@
+# Registro de esquemas de BigQuery
+# Reemplaza a create_table_if_not_exists: guarda en el bucket (y en memoria mientras
+# viva la instancia) una huella del esquema declarado de cada tabla ya verificada.
+# Si la huella no cambió y la verificación es reciente no se consulta BigQuery; si no,
+# las tablas se verifican en paralelo: las que faltan se crean, los campos nuevos y
+# los REQUIRED -> NULLABLE se aplican solos, y un cambio incompatible (tipo distinto,
+# NULLABLE -> REQUIRED, campo nuevo REQUIRED) detiene la función antes de cargar.
+# Junto al esquema cada tabla puede declarar su diseño (DisenoTabla): partición diaria
+# por fecha_carga o por hora de ingesta, clustering y vencimiento de particiones. El
+# clustering y el vencimiento se cambian en la tabla existente; particionar una tabla que
+# ya tiene datos exige recrearla y solo se hace con migrar=true (ver migrar_tabla).
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core.exceptions import NotFound
+from google.cloud import bigquery
+from recursos import compartido
+
+RUTA_CATALOGO = '_catalogo/esquemas_bigquery.json'
+COLUMNA_FECHA_CARGA = 'fecha_carga'  # Columna DATE de partición de todas las tablas
+SUFIJO_RESPALDO = '__respaldo'
+VIGENCIA_CATALOGO = 24 * 3600  # Segundos antes de volver a verificar una tabla sin cambios
+HILOS_VERIFICACION = 8
+
+# Alias que BigQuery devuelve según cómo se creó la tabla
+TIPOS_EQUIVALENTES = {
+    'INT64': 'INTEGER',
+    'FLOAT64': 'FLOAT',
+    'BOOL': 'BOOLEAN',
+    'STRUCT': 'RECORD',
+}
+
+class EsquemaIncompatible(RuntimeError):
+    pass
+
+class DisenoTabla:
+    def __init__(self, particion=COLUMNA_FECHA_CARGA, clustering=(), expiracion_dias=None):
+        self.particion = particion  # Columna DATE/TIMESTAMP, 'ingesta' (_PARTITIONDATE) o None
+        self.clustering = list(clustering)  # Hasta 4 columnas, de la más a la menos filtrada
+        self.expiracion_dias = expiracion_dias  # Las particiones más antiguas se borran solas
+
+    def time_partitioning(self):
+        if self.particion is None:
+            return None
+        return bigquery.TimePartitioning(
+            type_=bigquery.TimePartitioningType.DAY,
+            field=None if self.particion == 'ingesta' else self.particion,
+            expiration_ms=self.expiracion_dias * 24 * 3600 * 1000 if self.expiracion_dias else None
+        )
+
+    def aplicar(self, table):
+        table.time_partitioning = self.time_partitioning()
+        table.clustering_fields = self.clustering or None
+        return table
+
+    def huella(self):
+        return [self.particion, self.clustering, self.expiracion_dias]
+
+def particion_actual(table):
+    if table.time_partitioning is None:
+        return None
+    return table.time_partitioning.field or 'ingesta'
+
+def _tipo(field):
+    return TIPOS_EQUIVALENTES.get(field.field_type, field.field_type)
+
+def _modo(field):
+    return field.mode or 'NULLABLE'
+
+def huella_esquema(schema, diseno=None):
+    campos = [[field.name, _tipo(field), _modo(field)] for field in schema]
+    if diseno is not None:
+        campos.append(diseno.huella())
+    return hashlib.sha256(json.dumps(campos).encode('utf-8')).hexdigest()[:16]
+
+def comparar_esquemas(declarado, vivo):
+    # Devuelve (esquema a aplicar o None si no hay cambios, lista de incompatibilidades)
+    vivos = {field.name: field for field in vivo}
+    nuevo = list(vivo)
+    incompatibles = []
+    cambios = False
+    for field in declarado:
+        actual = vivos.get(field.name)
+        if actual is None:
+            if _modo(field) == 'REQUIRED':
+                incompatibles.append(f'{field.name}: columna nueva REQUIRED')
+            else:
+                nuevo.append(field)
+                cambios = True
+            continue
+        if _tipo(actual) != _tipo(field):
+            incompatibles.append(f'{field.name}: {_tipo(actual)} -> {_tipo(field)}')
+        elif _modo(actual) != _modo(field):
+            if _modo(actual) == 'REQUIRED' and _modo(field) == 'NULLABLE':
+                nuevo[nuevo.index(actual)] = field  # Relajar el modo es compatible
+                cambios = True
+            else:
+                incompatibles.append(f'{field.name}: modo {_modo(actual)} -> {_modo(field)}')
+    return (nuevo if cambios else None), incompatibles
+
+def expresion_fecha_carga(columnas):
+    # Valor de fecha_carga para las filas anteriores a la columna: se deduce del periodo
+    # de carga o de created_at; si la tabla no tiene ninguno quedan en la partición NULL
+    if 'periodo_de_carga' in columnas:
+        return f"COALESCE({COLUMNA_FECHA_CARGA}, SAFE.PARSE_DATE('%Y-%m-%d', periodo_de_carga))"
+    if 'created_at' in columnas:
+        return f'COALESCE({COLUMNA_FECHA_CARGA}, DATE(created_at))'
+    return COLUMNA_FECHA_CARGA
+
+def migrar_tabla(client, dataset_id, table, diseno):
+    # BigQuery no particiona una tabla existente: se copia a un respaldo, se recrea con el
+    # diseño declarado y se vuelven a insertar las filas. Si algo falla, los datos quedan en
+    # {tabla}__respaldo y la copia de una migración siguiente falla hasta que se resuelva.
+    table_ref = client.dataset(dataset_id).table(table.table_id)
+    respaldo_ref = client.dataset(dataset_id).table(f'{table.table_id}{SUFIJO_RESPALDO}')
+    columnas = [field.name for field in table.schema]
+    client.copy_table(table_ref, respaldo_ref).result()
+    client.delete_table(table_ref)
+    client.create_table(diseno.aplicar(bigquery.Table(table_ref, schema=table.schema)))
+    seleccion = [expresion_fecha_carga(columnas) if columna == COLUMNA_FECHA_CARGA else columna
+                 for columna in columnas]
+    client.query(
+        f'INSERT INTO `{dataset_id}.{table.table_id}` ({", ".join(columnas)}) '
+        f'SELECT {", ".join(seleccion)} FROM `{dataset_id}.{respaldo_ref.table_id}`'
+    ).result()
+    client.delete_table(respaldo_ref)
+    print(f'Tabla {table.table_id} migrada a particion={diseno.particion}, clustering={diseno.clustering}')
+
+class RegistroEsquemas:
+    def __init__(self, client, dataset_id, bucket=None, vigencia=VIGENCIA_CATALOGO):
+        self.client = client
+        self.dataset_id = dataset_id
+        self.bucket = bucket
+        self.vigencia = vigencia
+        self.lock = threading.Lock()
+        self.catalogo = {}
+        if bucket is not None:
+            blob = bucket.blob(RUTA_CATALOGO)
+            if blob.exists():
+                self.catalogo = json.loads(blob.download_as_text()).get('tablas', {})
+
+    def _clave(self, table_id):
+        return f'{self.dataset_id}.{table_id}'
+
+    def _vigente(self, table_id, huella):
+        entrada = self.catalogo.get(self._clave(table_id))
+        return bool(entrada) and entrada['huella'] == huella and time.time() - entrada['verificado'] < self.vigencia
+
+    def _disenar(self, table, diseno, migrar):
+        # Devuelve False si la tabla sigue sin la partición declarada (migración pendiente)
+        if particion_actual(table) != diseno.particion:
+            if not migrar:
+                print(f'Tabla {table.table_id} con particion={particion_actual(table)} en vez de '
+                      f'{diseno.particion}: ejecutar con migrar_particiones=true para recrearla')
+                return False
+            migrar_tabla(self.client, self.dataset_id, table, diseno)
+            return True
+        campos = []
+        if (table.clustering_fields or []) != diseno.clustering:
+            table.clustering_fields = diseno.clustering or None
+            campos.append('clustering_fields')
+        declarado = diseno.time_partitioning()
+        if declarado is not None and table.time_partitioning.expiration_ms != declarado.expiration_ms:
+            table.time_partitioning = declarado
+            campos.append('time_partitioning')
+        if campos:
+            self.client.update_table(table, campos)
+            print(f'Diseño de la tabla {table.table_id} actualizado: {campos}')
+        return True
+
+    def _verificar(self, table_id, schema, diseno=None, migrar=False):
+        # Devuelve (incompatibilidades, diseño al día)
+        table_ref = self.client.dataset(self.dataset_id).table(table_id)
+        try:
+            table = self.client.get_table(table_ref)
+        except NotFound:
+            table = bigquery.Table(table_ref, schema=schema)
+            if diseno is not None:
+                diseno.aplicar(table)
+            self.client.create_table(table, exists_ok=True)
+            print(f'Tabla {table_id} creada')
+            return [], True
+        nuevo, incompatibles = comparar_esquemas(schema, table.schema)
+        if incompatibles:
+            return [f'{table_id}.{detalle}' for detalle in incompatibles], True
+        if nuevo is not None:
+            table.schema = nuevo
+            table = self.client.update_table(table, ['schema'])
+            print(f'Esquema de la tabla {table_id} actualizado')
+        if diseno is None:
+            return [], True
+        return [], self._disenar(table, diseno, migrar)
+
+    def asegurar(self, schemas, disenos=None, migrar=False, hilos=HILOS_VERIFICACION):
+        # Verifica solo las tablas cuyo esquema o diseño declarado cambió o cuya verificación venció
+        disenos = disenos or {}
+        huellas = {table_id: huella_esquema(schema, disenos.get(table_id)) for table_id, schema in schemas.items()}
+        pendientes = [table_id for table_id in schemas if not self._vigente(table_id, huellas[table_id])]
+        if not pendientes:
+            return
+        with ThreadPoolExecutor(max_workers=max(1, min(hilos, len(pendientes)))) as executor:
+            resultados = list(executor.map(
+                lambda t: self._verificar(t, schemas[t], disenos.get(t), migrar), pendientes))
+        incompatibles = [detalle for resultado, _ in resultados for detalle in resultado]
+        if incompatibles:
+            raise EsquemaIncompatible(f'Cambios de esquema incompatibles: {"; ".join(incompatibles)}')
+        # Una tabla con la migración pendiente se vuelve a revisar (y avisar) en cada invocación
+        pendientes = [table_id for table_id, (_, al_dia) in zip(pendientes, resultados) if al_dia]
+        with self.lock:
+            for table_id in pendientes:
+                self.catalogo[self._clave(table_id)] = {'huella': huellas[table_id], 'verificado': time.time()}
+            contenido = json.dumps({'tablas': self.catalogo})
+        if self.bucket is not None:
+            self.bucket.blob(RUTA_CATALOGO).upload_from_string(contenido, content_type='application/json')
+        print(f'{len(pendientes)} tablas verificadas en BigQuery')
+
+def registro_esquemas(client, dataset_id, bucket):
+    # Un registro por instancia: en invocaciones en caliente ni siquiera se relee el catálogo
+    return compartido(('registro_esquemas', dataset_id, bucket.name),
+                      lambda: RegistroEsquemas(client, dataset_id, bucket))
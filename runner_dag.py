@@ -0,0 +1,124 @@
+# Ejecuta en proceso el mismo DAG que Workflow_transporte_publico.yaml
+#   datos diarios:    get_daily_data -> process_json_to_bigquery  ┐
+#   datos históricos: download_and_extract_zip -> process_historical_data ┴-> match_paraderos_to_stops
+# Cada tarea parte apenas terminan sus dependencias, en un pool de hilos. Al final se
+# informa el tiempo total y la ruta crítica (la cadena de tareas que fija ese tiempo).
+#
+#   python runner_dag.py --local              (con entorno_local, sin servicios de GCP)
+#   python runner_dag.py --local --hilos 1    (ejecución secuencial, para comparar)
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+class Tarea:
+    def __init__(self, nombre, funcion, dependencias=(), parametros=None):
+        self.nombre = nombre
+        self.funcion = funcion  # Entry point HTTP: recibe un request y devuelve texto
+        self.dependencias = tuple(dependencias)
+        self.parametros = parametros or {}
+
+class SolicitudLocal:
+    # Lo mínimo de flask.Request que usan las funciones (query string y cuerpo JSON)
+    def __init__(self, args=None, body=None):
+        self.args = dict(args or {})
+        self.body = body
+
+    def get_json(self, silent=False):
+        return self.body
+
+def dag_transporte_publico(parametros=None):
+    # Imports diferidos: cada función carga sus dependencias solo al armar el DAG
+    from fn_obtener_datos_diarios_in import get_daily_data
+    from fn_obtener_datos_diarios_tranf import process_json_to_bigquery
+    from fn_obtener_datos_historicos_in import download_and_extract_zip
+    from fn_obtener_datos_historicos_tranf import process_historical_data
+    from fn_emparejar_paraderos import match_paraderos_to_stops
+    parametros = parametros or {}
+    return [
+        Tarea('obtener_datos_diarios_iniciales', get_daily_data, (), parametros.get('diarios_in')),
+        Tarea('transferir_datos_diarios', process_json_to_bigquery,
+              ('obtener_datos_diarios_iniciales',), parametros.get('diarios_tranf')),
+        Tarea('obtener_datos_historicos_iniciales', download_and_extract_zip, (), parametros.get('historicos_in')),
+        Tarea('transferir_datos_historicos', process_historical_data,
+              ('obtener_datos_historicos_iniciales',), parametros.get('historicos_tranf')),
+        Tarea('emparejar_paraderos', match_paraderos_to_stops,
+              ('transferir_datos_diarios', 'transferir_datos_historicos'), parametros.get('emparejar')),
+    ]
+
+def ruta_critica(tareas, duraciones):
+    # Camino más largo del DAG usando las duraciones medidas
+    por_nombre = {tarea.nombre: tarea for tarea in tareas}
+    fin = {}
+
+    def calcular(nombre):
+        if nombre not in fin:
+            previas = [(calcular(d), d) for d in por_nombre[nombre].dependencias]
+            previo, anterior = max(previas, default=((0.0, []), None))
+            fin[nombre] = (previo[0] + duraciones[nombre], previo[1] + [nombre])
+        return fin[nombre]
+
+    return max((calcular(tarea.nombre) for tarea in tareas), key=lambda f: f[0])
+
+def ejecutar_dag(tareas, hilos=4):
+    pendientes = {tarea.nombre: tarea for tarea in tareas}
+    terminadas = {}
+    resultados = {}
+    en_curso = {}
+    inicio = time.perf_counter()
+
+    def ejecutar(tarea):
+        comienzo = time.perf_counter()
+        try:
+            resultado = tarea.funcion(SolicitudLocal(tarea.parametros))
+        except Exception as e:
+            resultado = f'Error: {e}'
+        return resultado, comienzo - inicio, time.perf_counter() - comienzo
+
+    with ThreadPoolExecutor(max_workers=max(1, hilos)) as executor:
+        while pendientes or en_curso:
+            for nombre, tarea in list(pendientes.items()):
+                if all(d in terminadas for d in tarea.dependencias):
+                    en_curso[executor.submit(ejecutar, tarea)] = nombre
+                    del pendientes[nombre]
+            if not en_curso:
+                raise RuntimeError(f'Dependencias sin resolver: {sorted(pendientes)}')
+            listos, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+            for futuro in listos:
+                nombre = en_curso.pop(futuro)
+                resultado, comienzo, duracion = futuro.result()
+                terminadas[nombre] = duracion
+                resultados[nombre] = {'resultado': resultado, 'inicio_s': round(comienzo, 3),
+                                      'duracion_s': round(duracion, 3)}
+                print(f'{nombre}: {duracion:.2f} s -> {resultado}')
+
+    total = time.perf_counter() - inicio
+    largo, camino = ruta_critica(tareas, terminadas)
+    return {
+        'tiempo_total_s': round(total, 3),
+        'suma_tareas_s': round(sum(terminadas.values()), 3),
+        'ruta_critica': camino,
+        'ruta_critica_s': round(largo, 3),
+        'tareas': resultados
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Ejecuta el DAG del workflow en proceso')
+    parser.add_argument('--local', action='store_true', help='usar entorno_local en vez de GCP')
+    parser.add_argument('--hilos', type=int, default=4, help='tareas simultáneas (1 = secuencial)')
+    parser.add_argument('--recorridos', type=int, default=50, help='recorridos sintéticos de red.cl')
+    parser.add_argument('--viajes', type=int, default=100, help='viajes sintéticos del GTFS')
+    parser.add_argument('--parametros', type=json.loads, default={},
+                        help='JSON con parámetros por tarea, p. ej. {"diarios_in": {"formato": "snapshot"}}')
+    args = parser.parse_args()
+
+    if args.local:
+        from entorno_local import entorno_local
+        with entorno_local(recorridos=args.recorridos, viajes_gtfs=args.viajes):
+            resumen = ejecutar_dag(dag_transporte_publico(args.parametros), args.hilos)
+    else:
+        resumen = ejecutar_dag(dag_transporte_publico(args.parametros), args.hilos)
+    print(json.dumps({k: v for k, v in resumen.items() if k != 'tareas'}, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# Snapshot diario consolidado de los recorridos
+# En vez de un objeto por recorrido se escribe uno o varios fragmentos
+# datos_diarios/{fecha}/snapshot-NNN.ndjson.gz con un recorrido por línea.
+# Cada línea se comprime como un miembro gzip independiente: la concatenación
+# sigue siendo un .gz válido y el índice (snapshot-NNN.index.json) guarda el
+# offset y el largo de cada miembro para leer un solo recorrido con una
+# descarga parcial.
+import gzip
+import json
+import threading
+import zlib
+from instrumentacion import contar
+
+PREFIJO_SNAPSHOT = 'snapshot-'
+EXTENSION_DATOS = '.ndjson.gz'
+EXTENSION_INDICE = '.index.json'
+CHUNK_SUBIDA = 8 * 1024 * 1024  # Múltiplo de 256 KB, requerido por la subida reanudable
+
+def nombre_fragmento(fecha, fragmento, etiqueta=None):
+    # La etiqueta separa los fragmentos de cada shard de la ingesta (snapshot-s000de004-000...)
+    nombre = f'{etiqueta}-{fragmento:03d}' if etiqueta else f'{fragmento:03d}'
+    return f'datos_diarios/{fecha}/{PREFIJO_SNAPSHOT}{nombre}{EXTENSION_DATOS}'
+
+def nombre_indice(nombre_datos):
+    return nombre_datos[:-len(EXTENSION_DATOS)] + EXTENSION_INDICE
+
+def es_archivo_snapshot(nombre):
+    return nombre.rsplit('/', 1)[-1].startswith(PREFIJO_SNAPSHOT)
+
+class FragmentoSnapshot:
+    def __init__(self, bucket, nombre):
+        self.bucket = bucket
+        self.blob = bucket.blob(nombre, chunk_size=CHUNK_SUBIDA)
+        self.archivo = None  # Se abre con el primer recorrido para no dejar archivos vacíos
+        self.lock = threading.Lock()
+        self.offset = 0
+        self.indice = {}
+
+    def escribir(self, codsint, detalles):
+        linea = json.dumps({'codsint': codsint, 'detalles': detalles}).encode('utf-8') + b'\n'
+        miembro = gzip.compress(linea)  # Se comprime fuera del lock
+        with self.lock:
+            if self.archivo is None:
+                # Sin content_encoding para que GCS no descomprima y los rangos sigan siendo válidos
+                self.archivo = self.blob.open('wb', content_type='application/x-ndjson')
+            self.archivo.write(miembro)
+            self.indice[str(codsint)] = [self.offset, len(miembro)]
+            self.offset += len(miembro)
+
+    def cerrar(self):
+        if self.archivo is None:
+            return
+        self.archivo.close()
+        indice = {'archivo': self.blob.name, 'recorridos': self.indice}
+        self.bucket.blob(nombre_indice(self.blob.name)).upload_from_string(
+            json.dumps(indice), content_type='application/json')
+        contar('gcs.bytes_subidos', self.offset)
+        print(f'Snapshot {self.blob.name}: {len(self.indice)} recorridos, {self.offset} bytes')
+
+class EscritorSnapshot:
+    # Reparte los recorridos en `fragmentos` archivos con un hash estable del codsint
+    def __init__(self, bucket, fecha, fragmentos=1, etiqueta=None):
+        self.fragmentos = [FragmentoSnapshot(bucket, nombre_fragmento(fecha, i, etiqueta))
+                           for i in range(max(1, fragmentos))]
+
+    def escribir(self, codsint, detalles):
+        fragmento = zlib.crc32(str(codsint).encode('utf-8')) % len(self.fragmentos)
+        self.fragmentos[fragmento].escribir(codsint, detalles)
+
+    def cerrar(self):
+        for fragmento in self.fragmentos:
+            fragmento.cerrar()
+
+def listar_fragmentos(storage_client, bucket, fecha):
+    prefijo = f'datos_diarios/{fecha}/{PREFIJO_SNAPSHOT}'
+    return [blob for blob in storage_client.list_blobs(bucket, prefix=prefijo)
+            if blob.name.endswith(EXTENSION_DATOS)]
+
+def leer_lineas_snapshot(storage_client, bucket, fecha):
+    # Lee los fragmentos en streaming y entrega cada línea sin parsear
+    for blob in listar_fragmentos(storage_client, bucket, fecha):
+        with blob.open('rb') as archivo, gzip.GzipFile(fileobj=archivo) as descomprimido:
+            for linea in descomprimido:
+                if linea.strip():
+                    yield linea
+
+def decodificar_linea(linea):
+    registro = json.loads(linea)
+    return str(registro['codsint']), registro['detalles']
+
+def leer_snapshot(storage_client, bucket, fecha):
+    # Entrega (codsint, detalles) por cada recorrido del snapshot
+    for linea in leer_lineas_snapshot(storage_client, bucket, fecha):
+        yield decodificar_linea(linea)
+
+def leer_recorrido_snapshot(storage_client, bucket, fecha, codsint):
+    # Busca el recorrido en los índices y descarga solo su rango de bytes
+    prefijo = f'datos_diarios/{fecha}/{PREFIJO_SNAPSHOT}'
+    for blob in storage_client.list_blobs(bucket, prefix=prefijo):
+        if not blob.name.endswith(EXTENSION_INDICE):
+            continue
+        indice = json.loads(blob.download_as_text())
+        posicion = indice['recorridos'].get(str(codsint))
+        if posicion:
+            offset, largo = posicion
+            datos = bucket.blob(indice['archivo']).download_as_bytes(start=offset, end=offset + largo - 1)
+            return json.loads(gzip.decompress(datos))['detalles']
+    return None
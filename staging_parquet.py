@@ -0,0 +1,60 @@
+# Staging tipado de las tablas GTFS en Parquet
+# Cada tabla se convierte en lotes Arrow según el esquema de BigQuery, se escribe en
+# datos_historicos/{fecha}/parquet/{tabla}.parquet y se carga desde ahí con un load job.
+# pyarrow es opcional: solo se importa cuando se usa formato_staging=parquet.
+from google.cloud import bigquery
+from instrumentacion import contar, span
+
+def _tipos_arrow():
+    import pyarrow as pa
+    return {
+        'STRING': pa.string(),
+        'INTEGER': pa.int64(),
+        'INT64': pa.int64(),
+        'FLOAT': pa.float64(),
+        'FLOAT64': pa.float64(),
+        'BOOLEAN': pa.bool_(),
+        'BOOL': pa.bool_(),
+        # Con zona horaria UTC BigQuery lo reconoce como TIMESTAMP y no como DATETIME
+        'TIMESTAMP': pa.timestamp('us', tz='UTC'),
+        'DATE': pa.date32(),
+    }
+
+def esquema_arrow(schema):
+    import pyarrow as pa
+    tipos = _tipos_arrow()
+    return pa.schema([pa.field(field.name, tipos[field.field_type]) for field in schema])
+
+def ruta_parquet(fecha, table_id):
+    return f'datos_historicos/{fecha}/parquet/{table_id}.parquet'
+
+def escribir_parquet(blob, lotes, schema):
+    # Escribe los lotes en streaming: en memoria solo queda el lote actual
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    esquema = esquema_arrow(schema)
+    filas = 0
+    with blob.open('wb', ignore_flush=True, content_type='application/vnd.apache.parquet') as archivo:
+        writer = pq.ParquetWriter(archivo, esquema, compression='snappy')
+        try:
+            for lote in lotes:
+                writer.write_batch(pa.RecordBatch.from_pylist(lote, schema=esquema))
+                filas += len(lote)
+        finally:
+            writer.close()
+    return filas
+
+def cargar_parquet(client, dataset_id, table_id, uri):
+    table_ref = client.dataset(dataset_id).table(table_id)
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.PARQUET,
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND
+    )
+    contar('bigquery.llamadas')
+    with span('bigquery.carga', table_id):
+        job = client.load_table_from_uri(uri, table_ref, job_config=job_config)
+        job.result()  # Lanza una excepción si el job falla
+    if job.errors:
+        raise RuntimeError(f'El load job {job.job_id} de la tabla {table_id} terminó con errores: {job.errors}')
+    contar('bigquery.filas', job.output_rows)
+    return job.output_rows
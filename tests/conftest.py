@@ -0,0 +1,19 @@
+# Pruebas con los reemplazos en memoria de entorno_local (sin servicios de GCP)
+#   python -m pytest tests
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def entorno():
+    # Storage, BigQuery, Pub/Sub y red.cl en memoria, vacíos al comenzar cada prueba
+    from entorno_local import entorno_local
+    with entorno_local(recorridos=12, rutas_gtfs=3, viajes_gtfs=20):
+        yield
+
+@pytest.fixture
+def bucket(entorno):
+    from recursos import storage_client
+    return storage_client().bucket('transporte-publico-red')
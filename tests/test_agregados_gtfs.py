@@ -0,0 +1,22 @@
+# Conversión vectorizada de horas GTFS a segundos
+import numpy as np
+from agregados_gtfs import tiempos_a_segundos
+
+def test_formatos_validos():
+    tiempos = ['08:05:30', '8:05:30', ' 08:05:30 ', '00:00:00', '25:10:00', '100:00:01']
+    assert tiempos_a_segundos(tiempos).tolist() == [29130, 29130, 29130, 0, 90600, 360001]
+
+def test_anchos_mezclados_no_truncan_las_horas():
+    assert tiempos_a_segundos(['1:00:00', '100:00:00', '10:00:00']).tolist() == [3600, 360000, 36000]
+
+def test_mal_formados_valen_menos_uno():
+    tiempos = ['', '8:5:30', 'ab:cd:ef', '08-05-30', '1:02', '08:05:30:00', '08:05:3x', '08:05:30']
+    assert tiempos_a_segundos(tiempos).tolist() == [-1] * 7 + [29130]
+
+def test_solo_textos_cortos():
+    assert tiempos_a_segundos(['', '1:02']).tolist() == [-1, -1]
+
+def test_entrada_vacia():
+    resultado = tiempos_a_segundos([])
+    assert resultado.dtype == np.int64
+    assert resultado.size == 0
@@ -0,0 +1,69 @@
+# Punto de control: retomar una corrida cortada sin repetir trabajo ni filas
+from unittest import mock
+from checkpoint import Checkpoint, ruta_checkpoint
+from entorno_local import BigQueryLocal
+from runner_dag import SolicitudLocal
+
+RUTA = ruta_checkpoint('datos_diarios', '2024-01-01', 'tranf')
+
+def test_retoma_elementos_y_estado(bucket):
+    checkpoint = Checkpoint(bucket, RUTA)
+    checkpoint.marcar(['a', 'b'])
+    checkpoint.estado['filas'] = {'stops': 10}
+    checkpoint.guardar()
+
+    retomado = Checkpoint(bucket, RUTA)
+
+    assert retomado.hecho('a') and retomado.hecho('b')
+    assert retomado.pendientes(['a', 'c']) == ['c']
+    assert retomado.estado == {'filas': {'stops': 10}}
+
+def test_reiniciar_parte_de_cero(bucket):
+    checkpoint = Checkpoint(bucket, RUTA)
+    checkpoint.marcar(['a'])
+    checkpoint.guardar()
+
+    reiniciado = Checkpoint(bucket, RUTA, reiniciar=True)
+
+    assert not reiniciado.hecho('a')
+    assert not bucket.blob(RUTA).exists()
+
+def test_adjunto_solo_se_recupera_al_retomar(bucket):
+    checkpoint = Checkpoint(bucket, RUTA)
+    assert checkpoint.adjuntar('indice', lambda: b'claves') is None
+    checkpoint.guardar()
+
+    assert Checkpoint(bucket, RUTA).adjuntar('indice', lambda: b'') == b'claves'
+    assert Checkpoint(bucket, RUTA, reiniciar=True).adjuntar('indice', lambda: b'') is None
+
+def test_transform_diario_retoma_sin_duplicar_filas(bucket):
+    from carga_bigquery import CargaPorLotes
+    from fn_obtener_datos_diarios_in import get_daily_data
+    from fn_obtener_datos_diarios_tranf import process_json_to_bigquery
+    get_daily_data(SolicitudLocal({'metricas': False}))
+    cerrar = CargaPorLotes.cerrar
+    llamadas = []
+
+    def cerrar_y_cortar(self):
+        # La segunda confirmación falla antes de cargar: simula un timeout a mitad de corrida
+        llamadas.append(1)
+        if len(llamadas) == 2:
+            raise RuntimeError('timeout simulado')
+        return cerrar(self)
+
+    with mock.patch.object(CargaPorLotes, 'cerrar', cerrar_y_cortar):
+        assert process_json_to_bigquery(SolicitudLocal({'cada': 4, 'metricas': False})).startswith('Error')
+    assert process_json_to_bigquery(SolicitudLocal({'cada': 4, 'metricas': False})) == \
+        'Datos procesados y almacenados en BigQuery'
+
+    claves = {
+        'negocios': ('negocio_id',),
+        'paraderos': ('paradero_id', 'recorrido_id', 'ida_o_regreso'),
+        'servicios': ('paradero_id', 'id'),
+        'horarios': ('recorrido_id', 'ida_o_regreso', 'tipoDia'),
+    }
+    for table_id, campos in claves.items():
+        filas = BigQueryLocal.tablas[table_id]['filas']
+        assert filas
+        assert len(filas) == len({tuple(fila[campo] for campo in campos) for fila in filas}), table_id
+    assert len({fila['recorrido_id'] for fila in BigQueryLocal.tablas['horarios']['filas']}) == 12
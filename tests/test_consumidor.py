@@ -0,0 +1,97 @@
+# Consumidor de Pub/Sub: ack solo después de escribir el lote, nack si la escritura falla
+from unittest import mock
+import pytest
+from entorno_local import BigQueryLocal, PubSubLocal, PublicadorLocal, SuscriptorLocal
+from runner_dag import SolicitudLocal
+
+RECORRIDOS = 12
+
+@pytest.fixture
+def publicados(entorno):
+    from fn_obtener_datos_diarios_in_realtime import get_daily_data
+    assert get_daily_data(SolicitudLocal({'metricas': False})) == 'Datos diarios obtenidos y publicados en Pub/Sub'
+    return RECORRIDOS
+
+def consumidor(max_mensajes=5):
+    from carga_bigquery import CargaPorLotes
+    from fn_consumir_datos_diarios_realtime import ConsumidorRecorridos, PROJECT_ID, SUBSCRIPTION_ID
+    from fn_obtener_datos_diarios_tranf import schemas
+    from recursos import bigquery_client
+    subscriber = SuscriptorLocal()
+    return ConsumidorRecorridos(subscriber, subscriber.subscription_path(PROJECT_ID, SUBSCRIPTION_ID),
+                                CargaPorLotes(bigquery_client(), 'transporte_publico', schemas),
+                                max_mensajes=max_mensajes, ventana=0.05)
+
+def pendientes():
+    return sum(len(cola) for cola in PubSubLocal.colas.values()) + len(PubSubLocal.en_vuelo)
+
+def recorridos_cargados():
+    # Sin duplicados: cada recorrido aparece una vez por sentido y tipo de día
+    filas = BigQueryLocal.tablas['horarios']['filas']
+    claves = [(fila['recorrido_id'], fila['ida_o_regreso'], fila['tipoDia']) for fila in filas]
+    assert len(claves) == len(set(claves))
+    return {fila['recorrido_id'] for fila in filas}
+
+def test_confirma_cada_lote_despues_de_escribirlo(publicados):
+    eventos = []
+    cargar = BigQueryLocal.load_table_from_file
+    confirmar = SuscriptorLocal.acknowledge
+
+    def load(self, *args, **kwargs):
+        eventos.append('load')
+        return cargar(self, *args, **kwargs)
+
+    def acknowledge(self, request, **kwargs):
+        eventos.append(('ack', len(request['ack_ids'])))
+        return confirmar(self, request, **kwargs)
+
+    with mock.patch.object(BigQueryLocal, 'load_table_from_file', load), \
+            mock.patch.object(SuscriptorLocal, 'acknowledge', acknowledge):
+        resumen = consumidor().consumir(tiempo_maximo=10, max_vacios=1)
+
+    assert resumen['confirmados'] == publicados
+    assert resumen['liberados'] == 0
+    assert pendientes() == 0
+    assert len(recorridos_cargados()) == publicados
+    # Cada ack llega justo después de las cargas de su lote
+    acks = [i for i, evento in enumerate(eventos) if evento != 'load']
+    assert len(acks) == 3  # Lotes de 5, 5 y 2 mensajes
+    assert all(i > 0 and eventos[i - 1] == 'load' for i in acks)
+    assert sum(eventos[i][1] for i in acks) == publicados
+
+def test_libera_el_lote_si_la_escritura_falla(publicados):
+    cargar = BigQueryLocal.load_table_from_file
+    fallas = [RuntimeError('load job fallido')]
+
+    def load(self, *args, **kwargs):
+        if fallas:
+            raise fallas.pop()
+        return cargar(self, *args, **kwargs)
+
+    with mock.patch.object(BigQueryLocal, 'load_table_from_file', load):
+        resumen = consumidor().consumir(tiempo_maximo=10, max_vacios=2)
+
+    # El lote fallido se reentrega y se escribe una sola vez
+    assert resumen['liberados'] == 5
+    assert resumen['confirmados'] == publicados
+    assert pendientes() == 0
+    assert len(recorridos_cargados()) == publicados
+
+def test_no_confirma_si_la_escritura_falla_siempre(publicados):
+    with mock.patch.object(BigQueryLocal, 'load_table_from_file', side_effect=RuntimeError('sin BigQuery')):
+        resumen = consumidor().consumir(tiempo_maximo=0.5, max_vacios=1)
+
+    assert resumen['confirmados'] == 0
+    assert resumen['liberados'] > 0
+    assert pendientes() == publicados
+
+def test_confirma_y_descarta_un_mensaje_ilegible(entorno):
+    from fn_obtener_datos_diarios_in_realtime import PROJECT_ID, TOPIC_ID
+    publicador = PublicadorLocal()
+    publicador.publish(publicador.topic_path(PROJECT_ID, TOPIC_ID), b'no es json', codsint='X1')
+
+    resumen = consumidor().consumir(tiempo_maximo=5, max_vacios=1)
+
+    assert resumen['descartados'] == 1
+    assert resumen['confirmados'] == 0
+    assert pendientes() == 0
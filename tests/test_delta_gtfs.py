@@ -0,0 +1,78 @@
+# Recarga incremental de tablas GTFS: huellas, staging y MERGE sobre la tabla vigente
+import pytest
+from entorno_local import BigQueryLocal
+from delta_gtfs import HuellasGtfs, cargar_tabla_delta, tabla_vigente
+
+DATASET = 'transporte_publico'
+
+@pytest.fixture
+def cargar(bucket):
+    from fn_obtener_datos_historicos_tranf import schemas
+    from recursos import bigquery_client
+    client = bigquery_client()
+
+    def cargar(table_id, filas, fecha='2024-01-01'):
+        filas = [dict(fila, created_at=f'{fecha}T00:00:00', periodo_de_carga=fecha) for fila in filas]
+        return cargar_tabla_delta(client, DATASET, table_id, schemas[table_id], [filas], lambda: [filas],
+                                  HuellasGtfs(bucket), fecha, 1000)
+    return cargar
+
+def vigentes(table_id, *campos):
+    return sorted(tuple(fila.get(campo) for campo in campos)
+                  for fila in BigQueryLocal.tablas[tabla_vigente(table_id)]['filas'])
+
+def parada(stop_id, nombre):
+    return {'stop_id': stop_id, 'stop_code': stop_id, 'stop_name': nombre, 'stop_lat': -33.4, 'stop_lon': -70.6}
+
+def test_primera_carga_reemplaza_la_tabla_vigente(cargar):
+    conteo = cargar('stops', [parada('A', 'Alameda'), parada('B', 'Baquedano')])
+
+    assert conteo == {'insertadas': 2, 'modificadas': 0, 'eliminadas': 0, 'sin_cambio': 0}
+    assert vigentes('stops', 'stop_id', 'stop_name') == [('A', 'Alameda'), ('B', 'Baquedano')]
+
+def test_aplica_inserciones_modificaciones_y_eliminaciones(cargar):
+    cargar('stops', [parada('A', 'Alameda'), parada('B', 'Baquedano'), parada('C', 'Cumming')])
+
+    conteo = cargar('stops', [parada('A', 'Alameda'), parada('B', 'Plaza Italia'), parada('D', 'Dorsal')],
+                    fecha='2024-01-02')
+
+    assert conteo == {'insertadas': 1, 'modificadas': 1, 'eliminadas': 1, 'sin_cambio': 1}
+    assert vigentes('stops', 'stop_id', 'stop_name') == [('A', 'Alameda'), ('B', 'Plaza Italia'), ('D', 'Dorsal')]
+    assert 'stops__delta' not in BigQueryLocal.tablas
+
+def test_columnas_de_control_no_cuentan_como_cambio(cargar):
+    cargar('stops', [parada('A', 'Alameda')])
+
+    conteo = cargar('stops', [parada('A', 'Alameda')], fecha='2024-01-02')
+
+    assert conteo == {'insertadas': 0, 'modificadas': 0, 'eliminadas': 0, 'sin_cambio': 1}
+    assert [fila['periodo_de_carga'] for fila in BigQueryLocal.tablas['stops_vigente']['filas']] == ['2024-01-01']
+
+def test_claves_con_nulos_se_actualizan_y_eliminan(cargar):
+    # calendar_dates tiene clave (service_id, date); una fecha nula no debe duplicar la fila
+    cargar('calendar_dates', [{'service_id': 'L', 'date': None, 'exception_type': 1},
+                              {'service_id': 'S', 'date': '20240101', 'exception_type': 1}])
+
+    conteo = cargar('calendar_dates', [{'service_id': 'L', 'date': None, 'exception_type': 2},
+                                       {'service_id': 'S', 'date': '20240101', 'exception_type': 1}],
+                    fecha='2024-01-02')
+    assert conteo['modificadas'] == 1
+    assert vigentes('calendar_dates', 'service_id', 'exception_type') == [('L', 2), ('S', 1)]
+
+    conteo = cargar('calendar_dates', [{'service_id': 'S', 'date': '20240101', 'exception_type': 1}],
+                    fecha='2024-01-03')
+    assert conteo['eliminadas'] == 1
+    assert vigentes('calendar_dates', 'service_id', 'exception_type') == [('S', 1)]
+
+def test_claves_repetidas_reemplazan_solo_la_tabla_vigente(cargar):
+    historia = [dict(parada('A', 'Alameda'), periodo_de_carga='2023-12-01')]
+    BigQueryLocal.tablas['stops'] = {'schema': [], 'filas': list(historia)}
+    cargar('stops', [parada('A', 'Alameda'), parada('B', 'Baquedano')])
+
+    conteo = cargar('stops', [parada('A', 'Alameda'), parada('A', 'Alameda bis'), parada('C', 'Cumming')],
+                    fecha='2024-01-02')
+
+    assert conteo['insertadas'] == 3
+    assert vigentes('stops', 'stop_id') == [('A',), ('A',), ('C',)]
+    # La tabla histórica del modo completo no se toca
+    assert BigQueryLocal.tablas['stops']['filas'] == historia
@@ -0,0 +1,55 @@
+# Índice de grilla: los k más cercanos coinciden con la búsqueda exhaustiva
+import numpy as np
+import pytest
+from indice_espacial import IndiceGrilla, haversine
+
+@pytest.fixture(scope='module')
+def puntos():
+    rng = np.random.default_rng(11)
+    return rng.uniform(-33.55, -33.35, 2000), rng.uniform(-70.75, -70.55, 2000)
+
+def fuerza_bruta(lats, lons, lat, lon, k, radio_max_m=None):
+    distancias = haversine(lat, lon, lats, lons)
+    orden = np.argsort(distancias, kind='stable')[:k]
+    if radio_max_m is not None:
+        orden = orden[distancias[orden] <= radio_max_m]
+    return orden, distancias[orden]
+
+@pytest.mark.parametrize('celda_m', [50.0, 150.0, 1000.0])
+@pytest.mark.parametrize('k', [1, 3, 10])
+def test_k_cercanos_igual_a_fuerza_bruta(puntos, celda_m, k):
+    lats, lons = puntos
+    indice = IndiceGrilla(lats, lons, celda_m=celda_m)
+    rng = np.random.default_rng(3)
+    for lat, lon in zip(rng.uniform(-33.6, -33.3, 50), rng.uniform(-70.8, -70.5, 50)):
+        candidatos, distancias = indice.k_cercanos(lat, lon, k)
+        esperados, distancias_esperadas = fuerza_bruta(lats, lons, lat, lon, k)
+        np.testing.assert_allclose(distancias, distancias_esperadas)
+        assert candidatos.tolist() == esperados.tolist()
+
+def test_k_cercanos_con_radio_maximo(puntos):
+    lats, lons = puntos
+    indice = IndiceGrilla(lats, lons, celda_m=150.0)
+    rng = np.random.default_rng(5)
+    for lat, lon in zip(rng.uniform(-33.55, -33.35, 50), rng.uniform(-70.75, -70.55, 50)):
+        candidatos, distancias = indice.k_cercanos(lat, lon, 5, radio_max_m=300.0)
+        esperados, distancias_esperadas = fuerza_bruta(lats, lons, lat, lon, 5, radio_max_m=300.0)
+        assert candidatos.tolist() == esperados.tolist()
+        np.testing.assert_allclose(distancias, distancias_esperadas)
+
+def test_consulta_lejos_de_todos_los_puntos(puntos):
+    lats, lons = puntos
+    indice = IndiceGrilla(lats, lons, celda_m=100.0)
+    candidatos, _ = indice.k_cercanos(-33.0, -70.0, 3)
+    assert candidatos.tolist() == fuerza_bruta(lats, lons, -33.0, -70.0, 3)[0].tolist()
+    assert len(indice.k_cercanos(-33.0, -70.0, 3, radio_max_m=500.0)[0]) == 0
+
+def test_mas_vecinos_que_puntos():
+    indice = IndiceGrilla([-33.45, -33.46], [-70.65, -70.66])
+    candidatos, distancias = indice.k_cercanos(-33.45, -70.65, 5)
+    assert candidatos.tolist() == [0, 1]
+    assert distancias[0] == 0.0
+
+def test_indice_vacio():
+    candidatos, distancias = IndiceGrilla([], []).k_cercanos(-33.45, -70.65, 3)
+    assert len(candidatos) == 0 and len(distancias) == 0
@@ -0,0 +1,30 @@
+# Codificación de polilíneas de Google y simplificación Douglas-Peucker
+import numpy as np
+from polilineas import codificar, decodificar, simplificar
+
+# Ejemplo de la documentación del formato
+PUNTOS = [[38.5, -120.2], [40.7, -120.95], [43.252, -126.453]]
+CODIFICADO = '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+
+def test_codifica_el_ejemplo_de_referencia():
+    assert codificar(PUNTOS) == CODIFICADO
+
+def test_decodifica_el_ejemplo_de_referencia():
+    np.testing.assert_allclose(decodificar(CODIFICADO), PUNTOS)
+
+def test_ida_y_vuelta_con_la_precision_pedida():
+    rng = np.random.default_rng(7)
+    puntos = np.column_stack((rng.uniform(-33.6, -33.3, 500), rng.uniform(-70.8, -70.5, 500)))
+    for precision in (5, 6):
+        np.testing.assert_allclose(decodificar(codificar(puntos, precision), precision),
+                                   np.round(puntos, precision), atol=10 ** -(precision + 1))
+
+def test_deltas_negativos_y_grandes():
+    puntos = [[0.0, 0.0], [-89.99999, 179.99999], [89.99999, -179.99999], [0.00001, -0.00001]]
+    np.testing.assert_allclose(decodificar(codificar(puntos)), puntos)
+
+def test_simplificar_conserva_extremos_y_quita_puntos_alineados():
+    linea = [[-33.45, -70.65 + i * 0.001] for i in range(20)]
+    assert simplificar(linea).tolist() == [0, 19]
+    quiebre = linea[:10] + [[-33.44, -70.64]] + linea[11:]
+    assert 10 in simplificar(quiebre).tolist()